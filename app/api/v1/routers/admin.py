@@ -0,0 +1,27 @@
+from typing import Any, Dict
+
+from core.authentication.auth_middleware import get_current_admin_user
+from core.cache import caches
+from core.mail.outbox import outbox
+from fastapi import APIRouter, Depends
+from schemas.user import User
+
+router = APIRouter()
+
+
+@router.get("/admin/caches", response_model=Dict[str, Dict[str, Any]])
+async def get_cache_stats(
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Gets the size and hit/miss counters of the in-process caches"""
+
+    return {name: cache.stats() for name, cache in caches.items()}
+
+
+@router.get("/admin/outbox", response_model=Dict[str, Any])
+async def get_outbox_stats(
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Gets the queue depth and send latency of the email outbox"""
+
+    return await outbox.stats()
@@ -1,14 +1,49 @@
-import os
-from io import BytesIO
+import re
+from datetime import UTC, datetime
 from logging import getLogger
-from tempfile import NamedTemporaryFile
-from typing import Dict, Optional
+from typing import Dict, List, Literal, Optional
 
+from core.archive import files_archive
 from core.authentication.auth_middleware import get_current_active_user
+from core.authentication.signed_url import (
+    SignedDownload,
+    signed_download_url,
+    verify_download,
+)
+from core.config import settings
+from core.download import (
+    file_response,
+    signed_file_response,
+    source_variant_response,
+    variant_response,
+)
+from core.images import VARIANTS, create_variants
 from core.storage import storage
-from fastapi import APIRouter, Depends, Form, HTTPException, UploadFile, status
-from fastapi.responses import JSONResponse, StreamingResponse
-from schemas.file import File, FileCategory, FileMetadata, FileUpdate
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+    status,
+)
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi_pagination.cursor import CursorPage
+from pymongo import ASCENDING, DESCENDING
+from schemas.file import (
+    File,
+    FileBatchItem,
+    FileBatchResult,
+    FileCategory,
+    FileField,
+    FileListItem,
+    FileMetadata,
+    FileUpdate,
+    SignedUrl,
+)
 from schemas.user import User
 
 router = APIRouter()
@@ -18,6 +53,7 @@ router = APIRouter()
 async def upload_project_file(
     file: UploadFile,
     project_id: str,
+    background_tasks: BackgroundTasks,
     file_group: Optional[str] = Form(default=None),
     restrict_access: bool = Form(default=True),
     current_user: User = Depends(get_current_active_user),
@@ -26,52 +62,228 @@ async def upload_project_file(
 
     logger = getLogger(__name__ + ".upload_project_file")
     try:
-        storage.project_verify_record(
+        await storage.project_verify_record(
             {"_id": project_id, "user_id": current_user.id}
         )
 
-        if file.content_type.split("/") != "image":
+        if (file.content_type or "").split("/")[0] != "image":
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid file format",
             )
 
-        data = await file.read()
+        file_metadata = FileMetadata(
+            filename=file.filename,
+            user_id=current_user.id,
+            project_id=project_id,
+            group=file_group,
+            category=FileCategory.PROJECT_FILE,
+            restrict_access=restrict_access,
+        )
+
+        created = await storage.file_create_record(
+            source=file, file_data=file_metadata
+        )
+        background_tasks.add_task(create_variants, created)
+
+        return created
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.post(
+    path="/projects/{project_id}/files/batch", response_model=FileBatchResult
+)
+async def upload_project_files(
+    files: List[UploadFile],
+    project_id: str,
+    background_tasks: BackgroundTasks,
+    file_group: Optional[str] = Form(default=None),
+    restrict_access: bool = Form(default=True),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Uploads several files under a project in one request. Each file
+    is reported on separately, so some can fail while the rest are
+    stored.
+    """
 
-        logger.info("Validating image content")
-        temp_file_path = None
+    logger = getLogger(__name__ + ".upload_project_files")
+    try:
+        if len(files) > settings.MAX_BATCH_UPLOAD_FILES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Too many files, at most "
+                f"{settings.MAX_BATCH_UPLOAD_FILES} per request",
+            )
 
-        with NamedTemporaryFile(
-            mode="w+b", suffix=".pdf", delete=False
-        ) as temp:
-            temp.write(data)
-            temp_file_path = temp.name
+        await storage.project_verify_record(
+            {"_id": project_id, "user_id": current_user.id}
+        )
 
-        # Save temp file
+        items: List[Optional[FileBatchItem]] = []
+        images = []
+        for file in files:
+            if (file.content_type or "").split("/")[0] != "image":
+                items.append(
+                    FileBatchItem(
+                        filename=file.filename,
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="Invalid file format",
+                    )
+                )
+            else:
+                items.append(None)
+                images.append(file)
 
         file_metadata = FileMetadata(
-            filename=file.filename,
+            filename="",
             user_id=current_user.id,
             project_id=project_id,
             group=file_group,
             category=FileCategory.PROJECT_FILE,
             restrict_access=restrict_access,
         )
+        results = iter(
+            await storage.file_create_records(
+                sources=images, file_data=file_metadata
+            )
+        )
+
+        for i, file in enumerate(files):
+            if items[i] is not None:
+                continue
+
+            result = next(results)
+            if isinstance(result, HTTPException):
+                items[i] = FileBatchItem(
+                    filename=file.filename,
+                    status_code=result.status_code,
+                    detail=result.detail,
+                )
+            elif isinstance(result, Exception):
+                logger.error(result)
+                items[i] = FileBatchItem(
+                    filename=file.filename,
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=str(result),
+                )
+            else:
+                items[i] = FileBatchItem(
+                    filename=file.filename,
+                    status_code=status.HTTP_200_OK,
+                    file=result,
+                )
+                background_tasks.add_task(create_variants, result)
 
-        id = storage.file_create_record(data=data, file_data=file_metadata)
+        created = sum(item.file is not None for item in items)
 
-        return storage.file_verify_record(
-            {"_id": id, "user_id": current_user.id}
+        return FileBatchResult(
+            created=created, failed=len(items) - created, files=items
+        )
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.api_route(
+    path="/projects/{project_id}/files/archive", methods=["GET", "HEAD"]
+)
+async def download_project_archive(
+    project_id: str,
+    request: Request,
+    group: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Downloads the files of a project, or of one of its groups, as a ZIP
+    archive streamed as it is built. A HEAD request gets the archive's
+    size without any file data being read. Only the owner and the users
+    the project is shared with may download it.
+    """
+    logger = getLogger(__name__ + ".download_project_archive")
+    try:
+        project = await storage.project_verify_record({"_id": project_id})
+        if project.user_id != current_user.id and not (
+            await storage.project_check_access(project_id, current_user.id)
+        ):
+            # answered as for a missing project, so ids cannot be probed
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Project not found",
+            )
+
+        filter = {"project_id": project_id, "user_id": project.user_id}
+        if group is not None:
+            filter["group"] = group
+
+        files = await storage.file_get_all_records(
+            filter, sort=[("date_created", ASCENDING), ("_id", ASCENDING)]
+        )
+        archive = await files_archive(files, by_group=group is None)
+
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", project.name)
+        if group is not None:
+            name += "-" + re.sub(r"[^A-Za-z0-9_.-]+", "_", group)
+        headers = {
+            "Content-Length": str(archive.size()),
+            "Content-Disposition": f'attachment; filename="{name}.zip"',
+        }
+
+        if request.method == "HEAD":
+            return Response(headers=headers, media_type="application/zip")
+
+        return StreamingResponse(
+            archive, headers=headers, media_type="application/zip"
+        )
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.get(
+    path="/projects/{project_id}/files",
+    response_model=CursorPage[FileListItem],
+    response_model_exclude_unset=True,
+)
+async def get_project_files(
+    project_id: str,
+    group: Optional[str] = None,
+    restrict_access: Optional[bool] = None,
+    order: Literal["asc", "desc"] = "desc",
+    fields: Optional[List[FileField]] = Query(default=None),
+    current_user: User = Depends(get_current_active_user),
+) -> CursorPage[FileListItem]:
+    """
+    Lists the files of a project ordered by creation date, one cursor
+    page at a time. Only the requested fields are returned.
+    """
+
+    logger = getLogger(__name__ + ".get_project_files")
+    try:
+        filter = {"project_id": project_id, "user_id": current_user.id}
+        if group is not None:
+            filter["group"] = group
+        if restrict_access is not None:
+            filter["restrict_access"] = restrict_access
+
+        return await storage.file_get_cursor_page(
+            filter=filter,
+            fields=fields,
+            direction=ASCENDING if order == "asc" else DESCENDING,
         )
     except Exception as ex:
         logger.error(ex)
         if type(ex) is not HTTPException:
             raise HTTPException(status_code=500, detail=str(ex))
         raise ex
-    finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-        pass
 
 
 @router.patch(
@@ -88,22 +300,12 @@ async def update_project_file(
 
     logger = getLogger(__name__ + ".update_project_file")
     try:
-        storage.project_verify_record(
-            {"_id": project_id, "user_id": current_user.id}
-        )
-        storage.file_verify_record(
-            {
-                "_id": file_id,
-                "project_id": project_id,
-                "user_id": current_user.id,
-            }
-        )
         update = {}
         for k, v in new_values.model_dump().items():
             if v is not None:
                 update[k] = v
 
-        storage.file_update_record(
+        await storage.file_update_record(
             filter={
                 "_id": file_id,
                 "project_id": project_id,
@@ -135,11 +337,7 @@ async def delete_project_file(
 
     logger = getLogger(__name__ + ".delete_project_file")
     try:
-        storage.project_verify_record(
-            {"_id": project_id, "user_id": current_user.id}
-        )
-
-        storage.file_delete_record(
+        await storage.file_delete_record(
             {
                 "_id": file_id,
                 "project_id": project_id,
@@ -155,43 +353,42 @@ async def delete_project_file(
         raise ex
 
 
+async def check_file_access(file: File, current_user: User):
+    """
+    Checks that a user may read a restricted file: its owner or
+    anyone on its project's access list
+
+    Raises:
+        HTTPException: 404 if the user has no access
+    """
+    if not file.restrict_access or file.user_id == current_user.id:
+        return
+
+    if file.project_id is not None and await storage.project_check_access(
+        file.project_id, current_user.id
+    ):
+        return
+
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="File not found",
+    )
+
+
 @router.get(path="/files/{file_id}/download")
-def download_file(
-    file_id: str, current_user: User = Depends(get_current_active_user)
+async def download_file(
+    file_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_active_user),
 ):
     """Downloads a file from the server"""
     logger = getLogger(__name__ + ".download_file")
     try:
-        file = storage.file_get_record({"_id": file_id})
+        file = await storage.file_verify_record({"_id": file_id})
         logger.info("Checking for access")
-        if file.restrict_access:
-            if not (
-                (file.user_id == current_user.id)
-                or (
-                    file.project_id is not None
-                    and storage.project_get_record(
-                        {
-                            "_id": file.project_id,
-                            "access_list": current_user.id,
-                        }
-                    )
-                )
-            ):
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="File not found",
-                )
-
-        data = storage.file_get_data(file_id=file.id)
-        file_like = BytesIO(data)
+        await check_file_access(file, current_user)
 
-        response = StreamingResponse(
-            file_like, media_type="application/octet-stream"
-        )
-        response.headers["Content-Disposition"] = (
-            f"attachment; filename={file.filename}"
-        )
-        return response
+        return await file_response(request, file)
     except Exception as ex:
         logger.error(ex)
         if type(ex) is not HTTPException:
@@ -200,11 +397,11 @@ def download_file(
 
 
 @router.get(path="/files/{file_id}/unrestricted/download")
-def download_unrestricted_file(file_id: str):
+async def download_unrestricted_file(file_id: str, request: Request):
     """Downloads a file from the server"""
     logger = getLogger(__name__ + ".download_unrestricted_file")
     try:
-        file = storage.file_get_record({"_id": file_id})
+        file = await storage.file_verify_record({"_id": file_id})
         logger.info("Checking for access")
         if file.restrict_access:
             raise HTTPException(
@@ -212,16 +409,157 @@ def download_unrestricted_file(file_id: str):
                 detail="File not found",
             )
 
-        data = storage.file_get_data(file_id=file.id)
-        file_like = BytesIO(data)
+        return await file_response(request, file)
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.get(path="/files/{file_id}/variants/{variant}")
+async def download_file_variant(
+    file_id: str,
+    variant: str,
+    request: Request,
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Downloads a resized variant of an image file, encoded in the best
+    format the Accept header allows
+    """
+    logger = getLogger(__name__ + ".download_file_variant")
+    try:
+        file = await storage.file_verify_record({"_id": file_id})
+        await check_file_access(file, current_user)
+
+        return await variant_response(request, file, variant)
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.get(path="/files/{file_id}/unrestricted/variants/{variant}")
+async def download_unrestricted_file_variant(
+    file_id: str, variant: str, request: Request
+):
+    """
+    Downloads a resized variant of an image file, encoded in the best
+    format the Accept header allows
+    """
+    logger = getLogger(__name__ + ".download_unrestricted_file_variant")
+    try:
+        file = await storage.file_verify_record({"_id": file_id})
+        if file.restrict_access:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found",
+            )
+
+        return await variant_response(request, file, variant)
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.get(path="/files/{file_id}/signed-url", response_model=SignedUrl)
+async def get_signed_url(
+    file_id: str,
+    variant: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Issues a short lived link that downloads a file, or one of its
+    image variants, without credentials. Access is checked once here
+    instead of on every use of the link.
+    """
+    logger = getLogger(__name__ + ".get_signed_url")
+    try:
+        file = await storage.file_verify_record({"_id": file_id})
+        await check_file_access(file, current_user)
+
+        if variant is not None and variant not in VARIANTS:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Variant not found",
+            )
+
+        url, expires = signed_download_url(
+            file_id, file.gridfs_id, file.backend, variant
+        )
 
-        response = StreamingResponse(
-            file_like, media_type="application/octet-stream"
+        return SignedUrl(
+            url=url, expires_at=datetime.fromtimestamp(expires, UTC)
         )
-        response.headers["Content-Disposition"] = (
-            f"attachment; filename={file.filename}"
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.get(path="/files/{file_id}/signed/download")
+async def download_signed_file(
+    file_id: str,
+    gridfs_id: str,
+    expires: int,
+    key: str,
+    signature: str,
+    request: Request,
+    backend: Optional[str] = None,
+):
+    """Downloads a file through a signed link"""
+    logger = getLogger(__name__ + ".download_signed_file")
+    try:
+        download = verify_download(
+            SignedDownload(file_id, gridfs_id, backend, None, expires),
+            key,
+            signature,
+        )
+
+        return await signed_file_response(request, download)
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.get(path="/files/{file_id}/signed/variants/{variant}")
+async def download_signed_file_variant(
+    file_id: str,
+    variant: str,
+    gridfs_id: str,
+    expires: int,
+    key: str,
+    signature: str,
+    request: Request,
+    backend: Optional[str] = None,
+):
+    """
+    Downloads a resized variant of an image file through a signed link,
+    encoded in the best format the Accept header allows
+    """
+    logger = getLogger(__name__ + ".download_signed_file_variant")
+    try:
+        download = verify_download(
+            SignedDownload(file_id, gridfs_id, backend, variant, expires),
+            key,
+            signature,
+        )
+
+        return await source_variant_response(
+            request,
+            download.gridfs_id,
+            download.backend,
+            variant,
+            public=False,
+            max_age=download.remaining(),
         )
-        return response
     except Exception as ex:
         logger.error(ex)
         if type(ex) is not HTTPException:
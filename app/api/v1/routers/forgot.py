@@ -5,7 +5,7 @@ from core.authentication.auth_token import (
     create_access_token,
     verify_access_token,
 )
-from core.authentication.hashing import hash_bcrypt
+from core.authentication.hashing import hash_password
 from core.mail.mail_service import send_reset_email
 from core.storage import storage
 from fastapi import APIRouter, Body, HTTPException, status
@@ -17,9 +17,9 @@ router = APIRouter()
 
 
 @router.post("/forgot_password", response_model=ForgotPasswordOutput)
-def forgot_password(email: str = Body(embed=True)) -> JSONResponse:
+async def forgot_password(email: str = Body(embed=True)) -> JSONResponse:
     """Sends a password reset to the user's email"""
-    user = storage.user_verify_record({"email": email})
+    user = await storage.user_verify_record({"email": email})
 
     if not user:
         raise HTTPException(
@@ -31,7 +31,7 @@ def forgot_password(email: str = Body(embed=True)) -> JSONResponse:
         timedelta(hours=1),
     )
 
-    send_reset_email(user.email, reset_token)
+    await send_reset_email(user.email, reset_token)
 
     response_message = {
         "message": "Password reset token has been sent to your email.",
@@ -43,7 +43,7 @@ def forgot_password(email: str = Body(embed=True)) -> JSONResponse:
 
 
 @router.post("/reset_password", response_model=Dict[str, str])
-def reset_password(request: PasswordResetRequest) -> JSONResponse:
+async def reset_password(request: PasswordResetRequest) -> JSONResponse:
     """Resets a user's password"""
 
     try:
@@ -71,15 +71,10 @@ def reset_password(request: PasswordResetRequest) -> JSONResponse:
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid password"
         )
 
-    if not storage.user_get_record({"email": token_data.email}):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="Account not found"
-        )
-
     update = {
-        "password": hash_bcrypt(request.new_password),
+        "password": await hash_password(request.new_password),
     }
-    storage.user_update_record(
+    await storage.user_update_record(
         filter={"email": token_data.email}, update=update
     )
 
@@ -15,7 +15,7 @@ async def login_user(
 ) -> JSONResponse:
     logger = getLogger(__name__ + ".login_user")
     try:
-        user = authenticate_user(request.username, request.password)
+        user = await authenticate_user(request.username, request.password)
 
         logger.info("User Authenticated")
         if not user.verified:
@@ -2,11 +2,13 @@ from logging import getLogger
 from typing import List
 
 from core.authentication.auth_middleware import get_current_active_user
+from core.deletion import deletion_worker
 from core.storage import storage
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import JSONResponse
 from fastapi_pagination import Page
-from schemas.project import Project, ProjectIn, ProjectUpdate
+from fastapi_pagination.cursor import CursorPage
+from schemas.project import Project, ProjectIn, ProjectShare, ProjectUpdate
 from schemas.user import User
 
 router = APIRouter()
@@ -22,7 +24,7 @@ async def create_project(
     logger = getLogger(__name__ + "create_project")
     try:
 
-        project_id = storage.project_create_record(
+        project_id = await storage.project_create_record(
             project_data=input,
             user_id=current_user.id,
         )
@@ -51,19 +53,6 @@ async def update_project(
     """Updates the project specified by project_id"""
     logger = getLogger(__name__ + ".update_project")
     try:
-        # Define the filter to find the user by their username
-        if input.title is not None:
-            existing_project = storage.project_get_record(
-                filter={"user_id": current_user.id, "title": input.title}
-            )
-
-            # If the title exists return a message indicating so
-            if existing_project and existing_project.id != project_id:
-                raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT,
-                    detail="Project title already exists",
-                )
-
         update = {}
         for k, v in input.model_dump().items():
             if v is not None:
@@ -81,7 +70,7 @@ async def update_project(
 
         logger.info(update)
 
-        storage.project_update_record(
+        await storage.project_update_record(
             filter={"_id": project_id, "user_id": current_user.id},
             update=update,
         )
@@ -96,6 +85,54 @@ async def update_project(
         raise ex
 
 
+@router.get("/projects/cursor", response_model=CursorPage[Project])
+async def get_projects_by_cursor(
+    include_total: bool = False,
+    current_user: User = Depends(get_current_active_user),
+) -> CursorPage[Project]:
+    """
+    Get the projects created by the user, most recently modified first,
+    one cursor page at a time
+    """
+    logger = getLogger(__name__ + ".get_projects_by_cursor")
+    try:
+        return await storage.project_get_cursor_page(
+            filter={"user_id": current_user.id}, include_total=include_total
+        )
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.get(
+    "/projects/shared",
+    response_model=CursorPage[Project],
+    response_model_exclude={"items": {"__all__": {"access_list"}}},
+)
+async def get_shared_projects(
+    include_total: bool = False,
+    current_user: User = Depends(get_current_active_user),
+) -> CursorPage[Project]:
+    """
+    Get the projects shared with the user, most recently modified first,
+    one cursor page at a time. Who else they are shared with is left out.
+    """
+    logger = getLogger(__name__ + ".get_shared_projects")
+    try:
+        return await storage.project_get_cursor_page(
+            filter={"access_list": current_user.id},
+            include_total=include_total,
+            projection={"access_list": 0},
+        )
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
 @router.get("/projects/{project_id}", response_model=Project)
 async def get_project_by_id(
     project_id: str,
@@ -104,7 +141,7 @@ async def get_project_by_id(
     """Get project by its id"""
     logger = getLogger(__name__ + ".get_project_by_id")
     try:
-        project = storage.project_verify_record(
+        project = await storage.project_verify_record(
             filter={"_id": project_id, "user_id": current_user.id}
         )
 
@@ -123,7 +160,7 @@ async def get_projects(
     """Get all projects created by the user"""
     logger = getLogger(__name__ + ".get_projects")
     try:
-        projects_page = storage.project_get_page(
+        projects_page = await storage.project_get_page(
             filter={"user_id": current_user.id}
         )
 
@@ -144,9 +181,10 @@ async def delete_project(
     logger = getLogger(__name__ + ".delete_project")
     try:
 
-        storage.project_delete_record(
+        await storage.project_delete_record(
             filter={"_id": project_id, "user_id": current_user.id}
         )
+        deletion_worker.wake()
 
         return JSONResponse({"message": "Project deleted"}, status_code=200)
     except Exception as ex:
@@ -154,3 +192,62 @@ async def delete_project(
         if type(ex) is not HTTPException:
             raise HTTPException(status_code=500, detail=str(ex))
         raise ex
+
+
+@router.post("/projects/{project_id}/share", status_code=200)
+async def share_project(
+    project_id: str,
+    input: ProjectShare,
+    current_user: User = Depends(get_current_active_user),
+) -> JSONResponse:
+    """
+    Gives another user read access to the project's restricted files.
+    The answer is the same whether or not the email is registered, so
+    sharing cannot be used to find out which emails have accounts.
+    """
+    logger = getLogger(__name__ + ".share_project")
+    try:
+        if input.email == current_user.email:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cannot share a project with its owner",
+            )
+
+        filter = {"_id": project_id, "user_id": current_user.id}
+        await storage.project_verify_record(filter)
+
+        user = await storage.user_get_record({"email": input.email})
+        if user is not None:
+            await storage.project_share_record(filter=filter, user_id=user.id)
+
+        return JSONResponse(
+            {"message": "Project shared if the email is registered"},
+            status_code=200,
+        )
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.delete(
+    "/projects/{project_id}/share/{user_id}", response_model=Project
+)
+async def unshare_project(
+    project_id: str,
+    user_id: str,
+    current_user: User = Depends(get_current_active_user),
+) -> Project:
+    """Takes back a user's access to the project"""
+    logger = getLogger(__name__ + ".unshare_project")
+    try:
+        return await storage.project_unshare_record(
+            filter={"_id": project_id, "user_id": current_user.id},
+            user_id=user_id,
+        )
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
@@ -18,7 +18,7 @@ async def register_user(
     logger = getLogger(__name__ + ".register_user")
     try:
         logger.info("Create user record")
-        id = storage.user_create_record(
+        id = await storage.user_create_record(
             user_data=request, role=Roles.USER, verified=True
         )
         token_data = {
@@ -41,8 +41,8 @@ async def register_user(
         raise http_ex
     except Exception as ex:
         logger.error(ex)
-        if storage.user_get_record({"email": request.email}):
-            storage.user_delete_record({"email": request.email})
+        if await storage.user_get_record({"email": request.email}):
+            await storage.user_delete_record({"email": request.email})
         if type(ex) is not HTTPException:
             raise HTTPException(status_code=500, detail=str(ex))
         raise ex
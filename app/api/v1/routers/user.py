@@ -5,7 +5,8 @@ from core.authentication.auth_middleware import (
     authenticate_user,
     get_current_active_user,
 )
-from core.authentication.hashing import hash_bcrypt
+from core.authentication.hashing import hash_password
+from core.deletion import deletion_worker
 from core.storage import storage
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import JSONResponse
@@ -42,11 +43,9 @@ async def update_user_details(
             if v is not None:
                 update[k] = v
 
-        storage.user_update_record(
+        return await storage.user_update_record(
             filter={"_id": current_user.id}, update=update
         )
-
-        return storage.user_verify_record({"_id": current_user.id})
     except Exception as ex:
         logger.error(ex)
         if type(ex) is not HTTPException:
@@ -61,7 +60,7 @@ async def change_password(
 ) -> JSONResponse:
     logger = getLogger(__name__ + ".change_password")
     try:
-        authenticate_user(
+        await authenticate_user(
             email=current_user.email, password=input.old_password
         )
 
@@ -72,9 +71,9 @@ async def change_password(
                 + " Password length must be at least 8 characters",
             )
 
-        storage.user_update_record(
+        await storage.user_update_record(
             filter={"_id": current_user.id},
-            update={"password": hash_bcrypt(input.new_password)},
+            update={"password": await hash_password(input.new_password)},
         )
 
         return JSONResponse(
@@ -95,6 +94,7 @@ async def delete_user(
 ) -> JSONResponse:
     # Delete user
     # settings.mongodb.delete_one({"_id": ObjectId(current_user["_id"])})
-    storage.user_delete_record({"_id": current_user.id})
+    await storage.user_delete_record({"_id": current_user.id})
+    deletion_worker.wake()
 
     return JSONResponse({"success": True})
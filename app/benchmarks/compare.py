@@ -0,0 +1,102 @@
+import argparse
+import json
+import sys
+from typing import Dict, List, NamedTuple
+
+# metrics compared, and whether a higher value is better
+METRICS = {
+    "throughput": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "peak_rss_mb": False,
+}
+
+
+class Change(NamedTuple):
+    """How one metric of one scenario moved against the baseline"""
+
+    scenario: str
+    metric: str
+    baseline: float
+    current: float
+    percent: float
+    regressed: bool
+
+
+def compare(
+    baseline: Dict[str, Dict], current: Dict[str, Dict], threshold: float
+) -> List[Change]:
+    """
+    Compares the results of two suite runs. A metric regresses when it
+    is worse than the baseline by more than threshold percent, and a
+    scenario regresses when it has errors the baseline did not.
+    Scenarios or metrics missing from either run are skipped.
+    """
+    changes = []
+
+    for scenario, before in baseline.items():
+        after = current.get(scenario)
+        if after is None:
+            continue
+
+        for metric, higher_is_better in METRICS.items():
+            old, new = before.get(metric), after.get(metric)
+            if not old or new is None:
+                continue
+
+            percent = (new - old) / old * 100
+            worse = -percent if higher_is_better else percent
+            changes.append(
+                Change(scenario, metric, old, new, percent, worse > threshold)
+            )
+
+        old_errors = before.get("errors", 0)
+        new_errors = after.get("errors", 0)
+        if new_errors > old_errors:
+            changes.append(
+                Change(scenario, "errors", old_errors, new_errors, 0.0, True)
+            )
+
+    return changes
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Fails when benchmark results regress past a "
+        "threshold against a baseline"
+    )
+    parser.add_argument("baseline", help="results file to compare against")
+    parser.add_argument("current", help="results file of the new run")
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="percent a metric may worsen by",
+    )
+    args = parser.parse_args()
+
+    with open(args.baseline) as baseline, open(args.current) as current:
+        changes = compare(
+            json.load(baseline)["results"],
+            json.load(current)["results"],
+            args.threshold,
+        )
+
+    for change in changes:
+        flag = "REGRESSED" if change.regressed else "ok"
+        print(
+            f"{change.scenario:<16} {change.metric:<12} "
+            f"{change.baseline:>10} -> {change.current:>10} "
+            f"({change.percent:+.1f}%) {flag}"
+        )
+
+    regressions = [change for change in changes if change.regressed]
+    print(f"{len(regressions)} regressions past {args.threshold}%")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
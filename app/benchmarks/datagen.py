@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import io
+import json
+import random
+import sys
+from typing import Dict, List
+
+from core.authentication.hashing import shutdown_hash_pool
+from core.config import settings
+from core.indexes import apply_indexes
+from core.storage import storage
+from fastapi import UploadFile
+from schemas.file import FileCategory, FileMetadata
+from schemas.project import ProjectIn
+from schemas.user import UserIn
+
+PASSWORD = "benchmark-password"
+
+
+async def generate(
+    users: int,
+    projects: int,
+    files: int,
+    file_sizes: List[int],
+    seed: int = 0,
+) -> Dict:
+    """
+    Fills the database with users x projects x files of synthetic data
+    through the same storage calls the API uses, so blobs, counters and
+    indexes look as they would in production. File contents are random,
+    drawn from seed, and file sizes cycle through file_sizes.
+
+    Returns:
+        A manifest of the generated users, with their password,
+        projects and file ids, for the benchmark suite to use
+    """
+    rng = random.Random(seed)
+    await apply_indexes(storage.db)
+
+    manifest = {
+        "config": {
+            "users": users,
+            "projects": projects,
+            "files": files,
+            "file_sizes": file_sizes,
+            "seed": seed,
+        },
+        "users": [],
+    }
+
+    for u in range(users):
+        email = f"bench-{u}@example.com"
+        user_id = await storage.user_create_record(
+            UserIn(username=f"bench-{u}", email=email, password=PASSWORD),
+            verified=True,
+        )
+        user = {"id": user_id, "email": email, "password": PASSWORD}
+        user["projects"] = []
+
+        for p in range(projects):
+            project_id = await storage.project_create_record(
+                ProjectIn(name=f"project-{p}"), user_id
+            )
+            sources = [
+                UploadFile(
+                    io.BytesIO(rng.randbytes(file_sizes[f % len(file_sizes)])),
+                    filename=f"figure-{f}.png",
+                )
+                for f in range(files)
+            ]
+            results = await storage.file_create_records(
+                sources,
+                FileMetadata(
+                    filename="",
+                    user_id=user_id,
+                    project_id=project_id,
+                    group=f"group-{p % 4}",
+                    category=FileCategory.PROJECT_FILE,
+                ),
+            )
+
+            failed = [
+                result for result in results if isinstance(result, Exception)
+            ]
+            if failed:
+                raise failed[0]
+            user["projects"].append(
+                {"id": project_id, "files": [file.id for file in results]}
+            )
+
+        manifest["users"].append(user)
+
+    return manifest
+
+
+async def main(args: argparse.Namespace) -> int:
+    if args.drop:
+        # only ever drop a database set aside for benchmarks
+        if "bench" not in settings.DB_NAME:
+            print(f"refusing to drop {settings.DB_NAME}, set DB_NAME")
+            return 1
+        await storage.client.drop_database(settings.DB_NAME)
+
+    try:
+        manifest = await generate(
+            args.users,
+            args.projects,
+            args.files,
+            [int(size) for size in args.file_sizes.split(",")],
+            seed=args.seed,
+        )
+    finally:
+        shutdown_hash_pool()
+
+    with open(args.output, "w") as output:
+        json.dump(manifest, output, indent=2)
+    print(f"wrote {args.output}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generates synthetic users, projects and files "
+        "in DB_NAME for benchmarking"
+    )
+    parser.add_argument("-u", "--users", type=int, default=10)
+    parser.add_argument("-p", "--projects", type=int, default=5)
+    parser.add_argument("-f", "--files", type=int, default=20)
+    parser.add_argument(
+        "-s",
+        "--file-sizes",
+        default="65536,524288,2097152",
+        help="comma separated file sizes in bytes, used in turn",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="drop DB_NAME first, only if its name contains 'bench'",
+    )
+    parser.add_argument("-o", "--output", default="bench-manifest.json")
+
+    sys.exit(asyncio.run(main(parser.parse_args())))
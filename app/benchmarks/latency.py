@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import httpx
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Gets the nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+
+    return ordered[rank]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    """Builds the latency summary of a benchmark run in milliseconds"""
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0,
+        "mean_ms": (
+            round(statistics.fmean(latencies) * 1000, 2) if latencies else 0
+        ),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def run(
+    url: Union[str, Callable[[], str]],
+    requests: int,
+    concurrency: int,
+    token: Optional[str] = None,
+    method: str = "GET",
+    data: Optional[Dict[str, str]] = None,
+    files: Optional[Callable[[], Dict[str, Any]]] = None,
+) -> Dict:
+    """
+    Sends requests to a url with a fixed number of
+    requests in flight and records each request's latency
+
+    Args:
+        url: the url to request, or a function picking one per request
+        requests: the total number of requests to send
+        concurrency: the number of requests kept in flight
+        token: optional bearer token sent with each request
+        method: the http method to use
+        data: optional form fields sent with each request
+        files: optional function building the files of each request,
+            called once per request so uploads can differ
+
+    Returns:
+        The latency summary of the run
+    """
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                response = await client.request(
+                    method,
+                    url() if callable(url) else url,
+                    headers=headers,
+                    data=data,
+                    files=files() if files else None,
+                )
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    return summarize(latencies, errors, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measures request latency under concurrent load"
+    )
+    parser.add_argument("url", help="url of the endpoint to benchmark")
+    parser.add_argument("-n", "--requests", type=int, default=2000)
+    parser.add_argument("-c", "--concurrency", type=int, default=200)
+    parser.add_argument("-t", "--token", help="bearer token to send")
+    parser.add_argument("-X", "--method", default="GET")
+    parser.add_argument(
+        "-d",
+        "--data",
+        action="append",
+        default=[],
+        help="form field to send as key=value, may be repeated",
+    )
+    args = parser.parse_args()
+
+    data = dict(field.split("=", 1) for field in args.data) or None
+    result = asyncio.run(
+        run(
+            args.url,
+            args.requests,
+            args.concurrency,
+            args.token,
+            args.method,
+            data,
+        )
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
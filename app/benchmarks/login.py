@@ -0,0 +1,57 @@
+import argparse
+import asyncio
+import json
+
+from benchmarks.latency import run
+
+
+async def run_login(
+    base_url: str,
+    email: str,
+    password: str,
+    requests: int,
+    concurrency: int,
+) -> dict:
+    """
+    Measures login throughput while probing the health endpoint,
+    showing how much password hashing delays unrelated requests
+    """
+    login, health = await asyncio.gather(
+        run(
+            f"{base_url}/login",
+            requests,
+            concurrency,
+            method="POST",
+            data={"username": email, "password": password},
+        ),
+        run(f"{base_url}/health", requests, 1),
+    )
+
+    return {"login": login, "health_during_login": health}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measures login throughput and event loop stalls"
+    )
+    parser.add_argument("base_url", help="e.g. http://localhost:8000/api/v1")
+    parser.add_argument("email", help="email of an existing verified user")
+    parser.add_argument("password", help="password of the user")
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    result = asyncio.run(
+        run_login(
+            args.base_url,
+            args.email,
+            args.password,
+            args.requests,
+            args.concurrency,
+        )
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import UTC, datetime
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from benchmarks.latency import run
+
+SCENARIOS = [
+    "login",
+    "current_user",
+    "projects_page",
+    "projects_cursor",
+    "upload",
+    "download",
+]
+
+
+def read_rss(pid: int) -> Optional[int]:
+    """Gets the resident set size of a process in bytes, on Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+
+async def measure(
+    scenario: Callable, pid: Optional[int], interval: float = 0.05
+) -> Dict:
+    """
+    Runs a scenario while sampling the server's memory
+
+    Returns:
+        The scenario's latency summary with the peak RSS of the server
+        process in MiB, or None if it could not be read
+    """
+    peak = None
+    done = asyncio.Event()
+
+    async def sample():
+        nonlocal peak
+        while pid is not None and not done.is_set():
+            rss = read_rss(pid)
+            if rss is not None:
+                peak = max(peak or 0, rss)
+            await asyncio.sleep(interval)
+
+    sampler = asyncio.create_task(sample())
+    try:
+        result = await scenario()
+    finally:
+        done.set()
+        await sampler
+
+    result["peak_rss_mb"] = round(peak / 2**20, 1) if peak else None
+    return result
+
+
+async def run_suite(
+    base_url: str,
+    manifest: Dict,
+    requests: int,
+    concurrency: int,
+    scenarios: List[str] = SCENARIOS,
+    pid: Optional[int] = None,
+    upload_size: int = 512 * 1024,
+) -> Dict[str, Dict]:
+    """
+    Runs each scenario against a server filled by benchmarks.datagen
+
+    Args:
+        base_url: e.g. http://localhost:8000/api/v1
+        manifest: the manifest written by benchmarks.datagen
+        requests: the number of requests per scenario
+        concurrency: the number of requests kept in flight
+        scenarios: the scenarios to run, in order
+        pid: the server process to sample memory of
+        upload_size: the size in bytes of each uploaded file
+
+    Returns:
+        The latency summary and peak RSS of each scenario
+    """
+    user = manifest["users"][0]
+    credentials = {"username": user["email"], "password": user["password"]}
+
+    async with httpx.AsyncClient() as client:
+        response = await client.post(f"{base_url}/login", data=credentials)
+        response.raise_for_status()
+        token = response.json()["access_token"]
+
+    project_id = user["projects"][0]["id"]
+    file_ids = itertools.cycle(
+        [id for project in user["projects"] for id in project["files"]]
+    )
+
+    def upload_files() -> Dict:
+        # new content each time, so every upload writes a new blob
+        return {"file": ("figure.png", os.urandom(upload_size), "image/png")}
+
+    runs = {
+        "login": lambda: run(
+            f"{base_url}/login",
+            requests,
+            concurrency,
+            method="POST",
+            data=credentials,
+        ),
+        "current_user": lambda: run(
+            f"{base_url}/users/me/details", requests, concurrency, token
+        ),
+        "projects_page": lambda: run(
+            f"{base_url}/projects?page=1&size=50",
+            requests,
+            concurrency,
+            token,
+        ),
+        "projects_cursor": lambda: run(
+            f"{base_url}/projects/cursor?size=50",
+            requests,
+            concurrency,
+            token,
+        ),
+        "upload": lambda: run(
+            f"{base_url}/projects/{project_id}/files",
+            requests,
+            concurrency,
+            token,
+            method="POST",
+            files=upload_files,
+        ),
+        "download": lambda: run(
+            lambda: f"{base_url}/files/{next(file_ids)}/download",
+            requests,
+            concurrency,
+            token,
+        ),
+    }
+
+    results = {}
+    for name in scenarios:
+        results[name] = await measure(runs[name], pid)
+
+    return results
+
+
+def spawn_server(base_url: str, timeout: float = 30) -> subprocess.Popen:
+    """
+    Starts the API with uvicorn on the port of base_url and waits until
+    it answers requests
+    """
+    port = str(urlsplit(base_url).port or 8000)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", port],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{base_url}/health")
+            return server
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+
+    server.terminate()
+    raise RuntimeError("Server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the API's hot paths against data "
+        "generated by benchmarks.datagen"
+    )
+    parser.add_argument("manifest", help="manifest written by datagen")
+    parser.add_argument("--base-url", default="http://localhost:8000/api/v1")
+    parser.add_argument("-n", "--requests", type=int, default=500)
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument(
+        "-s",
+        "--scenario",
+        action="append",
+        choices=SCENARIOS,
+        help="scenario to run, may be repeated, all by default",
+    )
+    parser.add_argument("--upload-size", type=int, default=512 * 1024)
+    server_group = parser.add_mutually_exclusive_group()
+    server_group.add_argument(
+        "--pid", type=int, help="pid of the running server to measure"
+    )
+    server_group.add_argument(
+        "--spawn",
+        action="store_true",
+        help="start the server with uvicorn for the run",
+    )
+    parser.add_argument("-o", "--output", default="bench-results.json")
+    args = parser.parse_args()
+
+    with open(args.manifest) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    server = spawn_server(args.base_url) if args.spawn else None
+    try:
+        results = asyncio.run(
+            run_suite(
+                args.base_url,
+                manifest,
+                args.requests,
+                args.concurrency,
+                scenarios=args.scenario or SCENARIOS,
+                pid=server.pid if server else args.pid,
+                upload_size=args.upload_size,
+            )
+        )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "meta": {
+            "date": datetime.now(UTC).isoformat(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "upload_size": args.upload_size,
+            "data": manifest["config"],
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+import struct
+import zlib
+from datetime import datetime
+from logging import getLogger
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    List,
+    NamedTuple,
+    Set,
+    Tuple,
+)
+
+from core.blobstore import BlobReader, close_reader, closing_reader
+from core.download import iter_grid_out
+from core.storage import storage
+from schemas.file import File
+
+# sizes and offsets from which a field needs a ZIP64 extra field
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+# entries are stored, images are already compressed
+STORED = 0
+# sizes and CRC follow the data, names are UTF-8
+FLAGS = 0x08 | 0x800
+
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+END_RECORD = struct.Struct("<4s4H2LH")
+ZIP64_END_RECORD = struct.Struct("<4sQ2H2L4Q")
+ZIP64_END_LOCATOR = struct.Struct("<4sLQL")
+
+
+class ArchiveEntry(NamedTuple):
+    """A file to add to an archive, with its data opened on demand"""
+
+    name: str
+    size: int
+    date: datetime
+    open_data: Callable[[], Awaitable[BlobReader]]
+
+
+def _dos_date_time(date: datetime) -> Tuple[int, int]:
+    # DOS dates start in 1980 and count seconds in twos
+    year = min(max(date.year, 1980), 2107)
+    return (
+        (year - 1980) << 9 | date.month << 5 | date.day,
+        date.hour << 11 | date.minute << 5 | date.second // 2,
+    )
+
+
+def archive_name(name: str, taken: Set[str]) -> str:
+    """
+    Makes a file name safe to extract and unique in an archive,
+    numbering repeats as "name (1).ext". Adds the name to taken.
+    """
+    parts = [part.replace("\\", "_").strip() for part in name.split("/")]
+    parts = [
+        "_" if part in (".", "..") else part for part in parts if part
+    ] or ["file"]
+    name = "/".join(parts)
+
+    stem, dot, extension = name.rpartition(".")
+    if not stem or "/" in extension:
+        stem, dot, extension = name, "", ""
+
+    candidate = name
+    count = 0
+    while candidate.lower() in taken:
+        count += 1
+        candidate = f"{stem} ({count}){dot}{extension}"
+
+    taken.add(candidate.lower())
+    return candidate
+
+
+class ZipStream:
+    """
+    A ZIP archive of stored entries produced as it is sent. Entry data
+    is streamed chunk by chunk and CRCs follow each entry in a data
+    descriptor, so memory stays constant whatever the archive's size.
+    ZIP64 fields are used only where sizes, offsets or the number of
+    entries need them, and the archive's size is known up front.
+    """
+
+    def __init__(
+        self, entries: List[ArchiveEntry], zip64_limit: int = ZIP64_LIMIT
+    ) -> None:
+        self.entries = entries
+        self.zip64_limit = zip64_limit
+        self._names = [entry.name.encode() for entry in entries]
+
+    def _is_zip64(self, entry: ArchiveEntry) -> bool:
+        return entry.size >= self.zip64_limit
+
+    def _local_header(self, index: int) -> bytes:
+        entry, name = self.entries[index], self._names[index]
+        day, time = _dos_date_time(entry.date)
+
+        extra = b""
+        size = 0
+        if self._is_zip64(entry):
+            # sizes are in the data descriptor, as for every entry
+            extra = struct.pack("<2H2Q", 0x0001, 16, 0, 0)
+            size = 0xFFFFFFFF
+
+        return (
+            LOCAL_HEADER.pack(
+                b"PK\x03\x04",
+                45 if extra else 20,
+                FLAGS,
+                STORED,
+                time,
+                day,
+                0,
+                size,
+                size,
+                len(name),
+                len(extra),
+            )
+            + name
+            + extra
+        )
+
+    def _descriptor(self, entry: ArchiveEntry, crc: int) -> bytes:
+        if self._is_zip64(entry):
+            return struct.pack("<4sL2Q", b"PK\x07\x08", crc, *[entry.size] * 2)
+        return struct.pack("<4s3L", b"PK\x07\x08", crc, *[entry.size] * 2)
+
+    def _central_header(self, index: int, crc: int, offset: int) -> bytes:
+        entry, name = self.entries[index], self._names[index]
+        day, time = _dos_date_time(entry.date)
+
+        fields = []
+        size = entry.size
+        if size >= self.zip64_limit:
+            fields += [size, size]
+            size = 0xFFFFFFFF
+        if offset >= self.zip64_limit:
+            fields.append(offset)
+            offset = 0xFFFFFFFF
+        extra = (
+            struct.pack(f"<2H{len(fields)}Q", 0x0001, 8 * len(fields), *fields)
+            if fields
+            else b""
+        )
+
+        return (
+            CENTRAL_HEADER.pack(
+                b"PK\x01\x02",
+                45 if fields else 20,
+                45 if fields else 20,
+                FLAGS,
+                STORED,
+                time,
+                day,
+                crc,
+                size,
+                size,
+                len(name),
+                len(extra),
+                0,
+                0,
+                0,
+                0,
+                offset,
+            )
+            + name
+            + extra
+        )
+
+    def _end_records(self, offset: int, size: int) -> bytes:
+        count = len(self.entries)
+        records = b""
+        if (
+            count >= ZIP64_COUNT_LIMIT
+            or offset >= self.zip64_limit
+            or size >= self.zip64_limit
+        ):
+            records = ZIP64_END_RECORD.pack(
+                b"PK\x06\x06", 44, 45, 45, 0, 0, count, count, size, offset
+            ) + ZIP64_END_LOCATOR.pack(b"PK\x06\x07", 0, offset + size, 1)
+            count = min(count, 0xFFFF)
+            offset = min(offset, 0xFFFFFFFF)
+            size = min(size, 0xFFFFFFFF)
+
+        return records + END_RECORD.pack(
+            b"PK\x05\x06", 0, 0, count, count, size, offset, 0
+        )
+
+    def size(self) -> int:
+        """Gets the size in bytes of the whole archive"""
+        offset = 0
+        central_size = 0
+        for index, entry in enumerate(self.entries):
+            central_size += len(self._central_header(index, 0, offset))
+            offset += (
+                len(self._local_header(index))
+                + entry.size
+                + len(self._descriptor(entry, 0))
+            )
+
+        return (
+            offset
+            + central_size
+            + len(self._end_records(offset, central_size))
+        )
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        logger = getLogger(__name__ + ".ZipStream")
+        offset = 0
+        written: List[Tuple[int, int]] = []
+
+        for index, entry in enumerate(self.entries):
+            header = self._local_header(index)
+            yield header
+
+            crc = 0
+            read = 0
+            reader = await entry.open_data()
+            try:
+                if entry.size:
+                    async for chunk in iter_grid_out(
+                        reader, 0, entry.size - 1
+                    ):
+                        crc = zlib.crc32(chunk, crc)
+                        read += len(chunk)
+                        yield chunk
+            finally:
+                await close_reader(reader)
+
+            if read != entry.size:
+                # the archive's announced length can no longer be kept
+                logger.error(f"{entry.name} is {read} bytes not {entry.size}")
+                raise IOError(f"Data of {entry.name} is incomplete")
+
+            descriptor = self._descriptor(entry, crc)
+            yield descriptor
+
+            written.append((crc, offset))
+            offset += len(header) + entry.size + len(descriptor)
+
+        central = b"".join(
+            self._central_header(index, crc, entry_offset)
+            for index, (crc, entry_offset) in enumerate(written)
+        )
+        yield central
+        yield self._end_records(offset, len(central))
+
+
+async def files_archive(files: List[File], by_group: bool = True) -> ZipStream:
+    """
+    Builds the archive of a list of files, in folders named after their
+    group if by_group is set. Nothing is read until it is sent, apart
+    from the size of files stored before sizes were recorded.
+    """
+    entries = []
+    taken: Set[str] = set()
+
+    for file in files:
+        size = file.size
+        if size is None:
+            reader = await storage.file_open_data(file.gridfs_id, file.backend)
+            async with closing_reader(reader):
+                size = reader.length
+
+        name = file.filename
+        if by_group and file.group:
+            name = f"{file.group.replace('/', '_')}/{name.replace('/', '_')}"
+
+        entries.append(
+            ArchiveEntry(
+                name=archive_name(name, taken),
+                size=size,
+                date=file.date_created,
+                open_data=lambda file=file: storage.file_open_data(
+                    file.gridfs_id, file.backend
+                ),
+            )
+        )
+
+    return ZipStream(entries)
@@ -1,7 +1,9 @@
-from typing import List
+import time
+from typing import List, Optional
 
 from core.authentication.auth_token import verify_access_token
-from core.authentication.hashing import hash_verify
+from core.authentication.hashing import verify_password
+from core.cache import token_cache, user_cache
 from core.storage import storage
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -17,16 +19,24 @@ credentials_exception: HTTPException = HTTPException(
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/login")
 
 
-def authenticate_user(email: str, password: str) -> User:
-    user = storage.user_verify_record({"email": email})
+async def authenticate_user(email: str, password: str) -> User:
+    user = await storage.user_verify_record({"email": email})
 
-    if not hash_verify(hashed_password=user.password, plain_password=password):
+    valid, new_hash = await verify_password(
+        hashed_password=user.password, plain_password=password
+    )
+    if not valid:
         raise credentials_exception
 
+    if new_hash is not None:
+        await storage.user_update_record(
+            filter={"_id": user.id}, update={"password": new_hash}
+        )
+
     return user
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     """
     Gets the current user.
 
@@ -36,7 +46,15 @@ def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     Returns:
         Data about the active user
     """
-    tokenData: TokenData = verify_access_token(token)
+    tokenData: Optional[TokenData] = token_cache.get(token)
+
+    if tokenData is None:
+        tokenData = verify_access_token(token)
+        token_cache.set(
+            token,
+            tokenData,
+            ttl=tokenData.exp - time.time() if tokenData.exp else None,
+        )
 
     if tokenData.type != "bearer":
         raise HTTPException(
@@ -44,10 +62,15 @@ def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
             detail="Invalid token type",
         )
 
-    user = storage.user_get_record({"email": tokenData.email})
+    user: Optional[User] = user_cache.get(tokenData.id)
 
     if user is None:
-        raise credentials_exception
+        user = await storage.user_get_record({"email": tokenData.email})
+
+        if user is None:
+            raise credentials_exception
+
+        user_cache.set(tokenData.id, user)
 
     return user
 
@@ -63,6 +63,8 @@ def verify_access_token(token: str) -> TokenData:
         if email is None or id is None:
             raise credentials_exception
 
-        return TokenData(email=email, id=id, type=token_type)
+        return TokenData(
+            email=email, id=id, type=token_type, exp=payload.get("exp")
+        )
     except JWTError:
         raise credentials_exception
@@ -0,0 +1,35 @@
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+# Kept apart from core.authentication.hashing so the spawned hash pool
+# processes only import passlib, not the app's settings, which also
+# set up the log files.
+
+
+@lru_cache
+def _context(rounds: int) -> CryptContext:
+    # hashes with a cost other than rounds are flagged for rehashing
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+def hash_bcrypt(password: str, rounds: int) -> str:
+    """Hashes a password with a bcrypt cost of rounds"""
+    return _context(rounds).hash(password)
+
+
+def hash_verify_and_update(
+    hashed_password: str, plain_password: str, rounds: int
+) -> Tuple[bool, Optional[str]]:
+    """
+    Verifies a password, rehashing it if the stored hash was
+    made with a bcrypt cost other than rounds
+    """
+    return _context(rounds).verify_and_update(plain_password, hashed_password)
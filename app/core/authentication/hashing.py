@@ -1,11 +1,84 @@
-from passlib.context import CryptContext
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
 
-pwd_cxt = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from core.authentication.bcrypt_hash import (
+    hash_bcrypt,
+    hash_verify_and_update,
+)
+from core.config import settings
+from fastapi import HTTPException, status
 
+_pool: Optional[ProcessPoolExecutor] = None
+_pending = 0
 
-def hash_bcrypt(password: str) -> CryptContext:
-    return pwd_cxt.hash(password)
 
+def get_hash_pool() -> ProcessPoolExecutor:
+    """Gets the process pool password hashing runs in"""
+    global _pool
 
-def hash_verify(hashed_password: str, plain_password: str) -> CryptContext:
-    return pwd_cxt.verify(plain_password, hashed_password)
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.HASH_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    return _pool
+
+
+def shutdown_hash_pool():
+    """Stops the password hashing processes"""
+    global _pool
+
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def _run_in_hash_pool(func, *args):
+    """
+    Runs a hashing function in the process pool.
+    Fails fast with 503 once HASH_QUEUE_LIMIT jobs are already
+    running or waiting, instead of queueing without bound.
+    """
+    global _pending
+
+    if _pending >= settings.HASH_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_hash_pool(), func, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    """Hashes a password without blocking the event loop"""
+    return await _run_in_hash_pool(
+        hash_bcrypt, password, settings.BCRYPT_ROUNDS
+    )
+
+
+async def verify_password(
+    hashed_password: str, plain_password: str
+) -> Tuple[bool, Optional[str]]:
+    """
+    Verifies a password without blocking the event loop
+
+    Returns:
+        Whether the password matches, and a new hash to store
+        if the stored one was made with an outdated cost
+    """
+    return await _run_in_hash_pool(
+        hash_verify_and_update,
+        hashed_password,
+        plain_password,
+        settings.BCRYPT_ROUNDS,
+    )
@@ -0,0 +1,144 @@
+import base64
+import hashlib
+import hmac
+import time
+from os import getenv
+from typing import Dict, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode
+
+from core.config import settings
+from fastapi import HTTPException, status
+
+invalid_link_exception: HTTPException = HTTPException(
+    status_code=status.HTTP_403_FORBIDDEN,
+    detail="Invalid or expired link",
+)
+
+
+def load_signing_keys(spec: str, fallback: Optional[str]) -> Dict[str, bytes]:
+    """
+    Parses DOWNLOAD_URL_KEYS, a comma separated list of key_id:secret.
+    The first key signs new links, all of them are accepted, so a key
+    is rotated by putting a new one first and dropping the old one once
+    its links have expired. Without keys one is derived from fallback.
+    """
+    keys = {}
+    for entry in spec.split(","):
+        key_id, _, secret = entry.strip().partition(":")
+        if key_id and secret:
+            keys[key_id] = secret.encode()
+
+    if not keys and fallback:
+        keys["default"] = hashlib.sha256(
+            b"download-url:" + fallback.encode()
+        ).digest()
+
+    return keys
+
+
+SIGNING_KEYS = load_signing_keys(
+    settings.DOWNLOAD_URL_KEYS, getenv("SECRET_KEY")
+)
+
+
+class SignedDownload(NamedTuple):
+    """What a signed download link grants access to, and until when"""
+
+    file_id: str
+    gridfs_id: str
+    backend: Optional[str]
+    variant: Optional[str]
+    expires: int
+
+    def message(self) -> bytes:
+        return "\n".join(
+            [
+                self.file_id,
+                self.gridfs_id,
+                self.backend or "",
+                self.variant or "",
+                str(self.expires),
+            ]
+        ).encode()
+
+    def remaining(self) -> int:
+        """Gets the number of seconds left until the link expires"""
+        return max(self.expires - int(time.time()), 0)
+
+
+def sign_download(
+    download: SignedDownload, key_id: str, keys: Dict[str, bytes]
+) -> str:
+    """Signs a download with a key, in unpadded URL safe base64"""
+    digest = hmac.new(
+        keys[key_id], download.message(), hashlib.sha256
+    ).digest()
+
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def signed_download_url(
+    file_id: str,
+    gridfs_id: str,
+    backend: Optional[str],
+    variant: Optional[str] = None,
+    ttl: int = settings.DOWNLOAD_URL_TTL,
+    keys: Dict[str, bytes] = SIGNING_KEYS,
+) -> Tuple[str, int]:
+    """
+    Builds a link that downloads a file, or one of its image variants,
+    without credentials until it expires
+
+    Returns:
+        The link and the unix time it expires at
+
+    Raises:
+        HTTPException: 503 if no signing key is configured
+    """
+    if not keys:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Signed downloads are not configured",
+        )
+
+    download = SignedDownload(
+        file_id, gridfs_id, backend, variant, int(time.time()) + ttl
+    )
+    key_id = next(iter(keys))
+    query = {"gridfs_id": gridfs_id}
+    if backend is not None:
+        query["backend"] = backend
+    query["expires"] = str(download.expires)
+    query["key"] = key_id
+    query["signature"] = sign_download(download, key_id, keys)
+
+    path = f"variants/{variant}" if variant is not None else "download"
+    url = f"{settings.API_V1_STR}/files/{file_id}/signed/{path}"
+
+    return f"{url}?{urlencode(query)}", download.expires
+
+
+def verify_download(
+    download: SignedDownload,
+    key_id: str,
+    signature: str,
+    keys: Dict[str, bytes] = SIGNING_KEYS,
+) -> SignedDownload:
+    """
+    Checks a signed download link in constant time
+
+    Raises:
+        HTTPException: 403 if the signature does not match or the link
+            has expired
+    """
+    if key_id not in keys:
+        raise invalid_link_exception
+
+    expected = sign_download(download, key_id, keys)
+    if not hmac.compare_digest(expected.encode(), signature.encode()):
+        raise invalid_link_exception
+
+    if download.expires <= time.time():
+        raise invalid_link_exception
+
+    return download
@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import sys
+from logging import getLogger
+from typing import Dict, Optional, Set
+
+from core.blobstore import closing_reader, count_read
+from core.storage import storage
+from pymongo import ASCENDING
+
+BATCH_SIZE = 100
+
+# collections whose records point at blob data
+COLLECTIONS = ["files", "variants"]
+
+
+async def _referenced(gridfs_id: str) -> bool:
+    for collection in ["blobs", *COLLECTIONS]:
+        if await storage.db[collection].find_one(
+            {"gridfs_id": gridfs_id}, {"_id": 1}
+        ):
+            return True
+    return False
+
+
+async def move_blob(gridfs_id: str, target: str, keep_source: bool) -> bool:
+    """
+    Copies a blob into the target engine under the same id, points its
+    records at the copy and deletes it from the other engines
+
+    Returns:
+        Whether the blob was moved, False if it was deleted meanwhile
+    """
+    db = storage.db
+    target_store = storage.blob_stores[target]
+
+    if await target_store.stat(gridfs_id) is None:
+        # uploads are bounded by MAX_UPLOAD_SIZE so a blob fits in memory
+        reader = await storage.file_open_data(gridfs_id)
+        async with closing_reader(reader):
+            data = await reader.read()
+            count_read(reader, len(data))
+        await target_store.put(data, gridfs_id, id=gridfs_id)
+
+        if await target_store.stat(gridfs_id) != len(data):
+            await target_store.delete([gridfs_id])
+            raise IOError(f"Copy of blob {gridfs_id} is incomplete")
+
+    # the blob record goes first so files created from it from now on
+    # already point at the target
+    for collection in ["blobs", *COLLECTIONS]:
+        await db[collection].update_many(
+            {"gridfs_id": gridfs_id}, {"$set": {"backend": target}}
+        )
+
+    if not await _referenced(gridfs_id):
+        # released while it was being copied
+        await target_store.delete([gridfs_id])
+        return False
+
+    if not keep_source:
+        # reads of records flipped late fall back to the target
+        for store in storage.blob_stores.values():
+            if store is not target_store:
+                await store.delete([gridfs_id])
+
+    return True
+
+
+async def migrate_blobs(
+    target: str, limit: Optional[int] = None, keep_source: bool = False
+) -> Dict[str, int]:
+    """
+    Moves the data of files and image variants into the target engine.
+    Runs online: blob ids do not change and reads fall back to the other
+    engines while a record and its data disagree. Records already in the
+    target are skipped, so an interrupted run is resumed by running it
+    again.
+
+    Args:
+        target: the name of the engine to move data to
+        limit: the number of blobs to move in this run
+        keep_source: leave the data in its old engine too
+
+    Returns:
+        The number of blobs moved, skipped as deleted and failed
+    """
+    logger = getLogger(__name__ + ".migrate_blobs")
+    report = {"moved": 0, "deleted": 0, "failed": 0}
+    failed: Set[str] = set()
+
+    for collection in COLLECTIONS:
+        while limit is None or report["moved"] < limit:
+            cursor = (
+                storage.db[collection]
+                .find(
+                    {
+                        "backend": {"$ne": target},
+                        "gridfs_id": {"$nin": [None, *failed]},
+                    },
+                    {"gridfs_id": 1},
+                )
+                .sort("gridfs_id", ASCENDING)
+                .limit(BATCH_SIZE)
+            )
+            ids = list(
+                dict.fromkeys([doc["gridfs_id"] async for doc in cursor])
+            )
+            if not ids:
+                break
+
+            for gridfs_id in ids:
+                if limit is not None and report["moved"] >= limit:
+                    break
+                try:
+                    if await move_blob(gridfs_id, target, keep_source):
+                        report["moved"] += 1
+                    else:
+                        report["deleted"] += 1
+                except Exception as ex:
+                    logger.error(ex)
+                    failed.add(gridfs_id)
+                    report["failed"] += 1
+
+    return report
+
+
+async def main(args: argparse.Namespace) -> int:
+    report = await migrate_blobs(
+        args.to, limit=args.limit, keep_source=args.keep_source
+    )
+    for outcome, count in report.items():
+        print(f"{outcome}: {count}")
+
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Moves blob data between storage engines"
+    )
+    parser.add_argument(
+        "--to",
+        required=True,
+        choices=list(storage.blob_stores),
+        help="the engine to move data to",
+    )
+    parser.add_argument(
+        "--limit", type=int, help="the number of blobs to move"
+    )
+    parser.add_argument(
+        "--keep-source",
+        action="store_true",
+        help="leave the data in its old engine too",
+    )
+
+    sys.exit(asyncio.run(main(parser.parse_args())))
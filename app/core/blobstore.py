@@ -0,0 +1,306 @@
+import asyncio
+import os
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional, Union
+
+from bson.objectid import ObjectId
+from core.metrics import BLOB_BYTES_READ, BLOB_BYTES_WRITTEN
+from gridfs.errors import NoFile
+from motor.motor_asyncio import (
+    AsyncIOMotorDatabase,
+    AsyncIOMotorGridFSBucket,
+    AsyncIOMotorGridOut,
+)
+
+
+class BlobNotFound(Exception):
+    """Raised when a blob is not in the engine asked for it"""
+
+
+class LocalBlobReader:
+    """
+    Reads a blob stored as a local file. Offers the subset of
+    AsyncIOMotorGridOut the download and cache code relies on.
+    """
+
+    def __init__(self, path: str, chunk_size: int) -> None:
+        self.path = path
+        self.chunk_size = chunk_size
+        self._file = open(path, "rb")
+        self.length = os.fstat(self._file.fileno()).st_size
+
+    def seek(self, position: int):
+        self._file.seek(position)
+
+    async def readchunk(self) -> bytes:
+        return await asyncio.to_thread(self._file.read, self.chunk_size)
+
+    async def read(self) -> bytes:
+        return await asyncio.to_thread(self._file.read)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self) -> "LocalBlobReader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+BlobReader = Union[AsyncIOMotorGridOut, LocalBlobReader]
+
+
+async def close_reader(reader: BlobReader):
+    """
+    Closes a blob reader. GridFS streams are closed off the event loop,
+    as closing one that was not read to the end kills its cursor.
+    """
+    if isinstance(reader, LocalBlobReader):
+        reader.close()
+    else:
+        await asyncio.to_thread(reader.close)
+
+
+@asynccontextmanager
+async def closing_reader(reader: BlobReader) -> AsyncIterator[BlobReader]:
+    """Closes a blob reader once the block using it is left"""
+    try:
+        yield reader
+    finally:
+        await close_reader(reader)
+
+
+class BlobStore(ABC):
+    """
+    An engine blob data is kept in. Blobs are immutable and addressed
+    by an ObjectId string, which stays the same when a blob is copied
+    to another engine.
+    """
+
+    name: str
+
+    @abstractmethod
+    async def put(
+        self,
+        source: Union[BinaryIO, bytes],
+        filename: str,
+        metadata: Optional[Dict] = None,
+        id: Optional[str] = None,
+    ) -> str:
+        """
+        Stores a blob
+
+        Args:
+            source: a readable file positioned at the start of the data,
+                or the data itself
+            filename: a name to keep with the data where the engine can
+            metadata: details to keep with the data where the engine can
+            id: the id to store the blob under, a new one if None
+
+        Returns:
+            The id of the blob
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def open(self, id: str) -> BlobReader:
+        """
+        Opens a blob for reading
+
+        Raises:
+            BlobNotFound: if the blob is not stored in this engine
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete(self, ids: List[str]):
+        """Deletes blobs, skipping those not stored in this engine"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def stat(self, id: str) -> Optional[int]:
+        """Gets the size of a blob, or None if it is not stored here"""
+        raise NotImplementedError
+
+    def path(self, id: str) -> Optional[str]:
+        """
+        Gets the local file a blob is stored in, for engines that keep
+        blobs as files
+        """
+        return None
+
+    def _count_written(
+        self, source: Union[BinaryIO, bytes], start: Optional[int]
+    ):
+        """Counts the bytes put from source, which started at start"""
+        size = len(source) if start is None else source.tell() - start
+        BLOB_BYTES_WRITTEN.labels(self.name).inc(size)
+
+
+class GridFSStore(BlobStore):
+    """Keeps blobs in the fs.files and fs.chunks collections"""
+
+    name = "gridfs"
+
+    def __init__(self, db: AsyncIOMotorDatabase, chunk_size: int) -> None:
+        self.db = db
+        self.chunk_size = chunk_size
+        self._bucket: Optional[AsyncIOMotorGridFSBucket] = None
+
+    @property
+    def bucket(self) -> AsyncIOMotorGridFSBucket:
+        """
+        GridFS bucket for the data. Created on first use since the
+        bucket binds to the event loop running when it is made.
+        """
+        if self._bucket is None:
+            self._bucket = AsyncIOMotorGridFSBucket(self.db)
+
+        return self._bucket
+
+    async def put(
+        self,
+        source: Union[BinaryIO, bytes],
+        filename: str,
+        metadata: Optional[Dict] = None,
+        id: Optional[str] = None,
+    ) -> str:
+        start = None if isinstance(source, bytes) else source.tell()
+        if id is None:
+            id = str(
+                await self.bucket.upload_from_stream(
+                    filename,
+                    source,
+                    chunk_size_bytes=self.chunk_size,
+                    metadata=metadata,
+                )
+            )
+        else:
+            await self.bucket.upload_from_stream_with_id(
+                ObjectId(id),
+                filename,
+                source,
+                chunk_size_bytes=self.chunk_size,
+                metadata=metadata,
+            )
+        self._count_written(source, start)
+
+        return id
+
+    async def open(self, id: str) -> AsyncIOMotorGridOut:
+        try:
+            return await self.bucket.open_download_stream(ObjectId(id))
+        except NoFile:
+            raise BlobNotFound(id)
+
+    async def delete(self, ids: List[str]):
+        """
+        Deletes blobs in bulk. Chunks go first so an interrupted
+        delete leaves an unreferenced fs.files entry that the
+        reconciliation scan finds, rather than invisible chunks.
+        """
+        if not ids:
+            return
+
+        object_ids = [ObjectId(id) for id in ids]
+        await self.db["fs.chunks"].delete_many(
+            {"files_id": {"$in": object_ids}}
+        )
+        await self.db["fs.files"].delete_many({"_id": {"$in": object_ids}})
+
+    async def stat(self, id: str) -> Optional[int]:
+        file = await self.db["fs.files"].find_one(
+            {"_id": ObjectId(id)}, {"length": 1}
+        )
+
+        return file["length"] if file else None
+
+
+class LocalStore(BlobStore):
+    """
+    Keeps blobs as files under a directory, sharded by the trailing
+    characters of their id. Files are written under a temporary name
+    and renamed into place, so readers only ever see complete blobs.
+    """
+
+    name = "local"
+
+    def __init__(self, directory: str, chunk_size: int) -> None:
+        self.directory = directory
+        self.chunk_size = chunk_size
+
+    def path(self, id: str) -> str:
+        """Gets the path a blob is stored at"""
+        return os.path.join(self.directory, id[-2:], id)
+
+    def _write(self, source: Union[BinaryIO, bytes], path: str):
+        temp_dir = os.path.join(self.directory, "tmp")
+        temp_path = os.path.join(temp_dir, uuid.uuid4().hex)
+        os.makedirs(temp_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        try:
+            with open(temp_path, "wb") as handle:
+                if isinstance(source, bytes):
+                    handle.write(source)
+                else:
+                    shutil.copyfileobj(source, handle, self.chunk_size)
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    async def put(
+        self,
+        source: Union[BinaryIO, bytes],
+        filename: str,
+        metadata: Optional[Dict] = None,
+        id: Optional[str] = None,
+    ) -> str:
+        id = id or str(ObjectId())
+        start = None if isinstance(source, bytes) else source.tell()
+        await asyncio.to_thread(self._write, source, self.path(id))
+        self._count_written(source, start)
+
+        return id
+
+    async def open(self, id: str) -> LocalBlobReader:
+        try:
+            return LocalBlobReader(self.path(id), self.chunk_size)
+        except FileNotFoundError:
+            raise BlobNotFound(id)
+
+    async def delete(self, ids: List[str]):
+        for id in ids:
+            try:
+                await asyncio.to_thread(os.remove, self.path(id))
+            except FileNotFoundError:
+                pass
+
+    async def stat(self, id: str) -> Optional[int]:
+        try:
+            return os.stat(self.path(id)).st_size
+        except FileNotFoundError:
+            return None
+
+
+# resolved once, as reads are counted chunk by chunk
+bytes_read = {
+    store.name: BLOB_BYTES_READ.labels(store.name)
+    for store in (GridFSStore, LocalStore)
+}
+
+
+def count_read(reader: BlobReader, size: int):
+    """Counts bytes read from a blob towards its engine's total"""
+    store = LocalStore if isinstance(reader, LocalBlobReader) else GridFSStore
+    bytes_read[store.name].inc(size)
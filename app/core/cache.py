@@ -0,0 +1,385 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from logging import getLogger
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    NamedTuple,
+    Optional,
+    Union,
+)
+
+from core.blobstore import BlobReader, closing_reader, count_read
+from core.config import settings
+
+
+class TTLCache:
+    """Size bounded LRU cache whose entries expire after a time to live"""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        """
+        Args:
+            maxsize: the maximum number of entries kept
+            ttl: the default number of seconds an entry stays valid
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Gets the value stored under key if it has not expired"""
+        entry = self._data.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Stores a value under key. A ttl shorter than the cache's
+        default can be supplied, e.g. when the value expires sooner.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable) -> Any:
+        """Removes the entry stored under key"""
+        entry = self._data.pop(key, None)
+
+        return entry[1] if entry else None
+
+    def clear(self):
+        """Removes all entries"""
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Gets the size and hit/miss counters of the cache"""
+        lookups = self.hits + self.misses
+
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class CachedBlob(NamedTuple):
+    """
+    A cached blob, held either in memory or in a file on disk, or the
+    stream opened over a blob found to be too large to cache
+    """
+
+    size: int
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+    reader: Optional[BlobReader] = None
+
+
+class BlobCache:
+    """
+    Two tier LRU cache of immutable blobs keyed by GridFS id.
+    Blobs up to memory_item_size bytes are held in memory and larger ones
+    up to disk_item_size bytes in files under directory. Concurrent
+    misses for the same blob share a single read of its data.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        memory_size: int,
+        memory_item_size: int,
+        disk_size: int,
+        disk_item_size: int,
+    ) -> None:
+        """
+        Args:
+            directory: where the disk tier keeps its files
+            memory_size: the total bytes held in memory
+            memory_item_size: the largest blob held in memory
+            disk_size: the total bytes held on disk
+            disk_item_size: the largest blob held on disk
+        """
+        self.directory = directory
+        self.memory_size = memory_size
+        self.memory_item_size = memory_item_size
+        self.disk_size = disk_size
+        self.disk_item_size = disk_item_size
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = {"memory": 0, "disk": 0}
+        self.bytes_served = {"memory": 0, "disk": 0}
+        self._memory: OrderedDict = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: Optional[OrderedDict] = None
+        self._disk_bytes = 0
+        self._loading: Dict[str, asyncio.Task] = {}
+
+    def _path(self, key: str) -> str:
+        # the trailing characters of an ObjectId vary the most
+        return os.path.join(self.directory, key[-2:], key)
+
+    def _disk_index(self) -> OrderedDict:
+        """Gets the disk tier's entries, picking up earlier runs' files"""
+        if self._disk is None:
+            entries = []
+            if os.path.isdir(self.directory):
+                for shard in os.scandir(self.directory):
+                    if not shard.is_dir() or shard.name == "tmp":
+                        continue
+                    for entry in os.scandir(shard.path):
+                        stat = entry.stat()
+                        entries.append(
+                            (stat.st_mtime, entry.name, stat.st_size)
+                        )
+
+            self._disk = OrderedDict(
+                (name, size) for _, name, size in sorted(entries)
+            )
+            self._disk_bytes = sum(self._disk.values())
+
+        return self._disk
+
+    async def index_disk(self):
+        """
+        Picks up the disk tier's files in a thread, so the first
+        request does not block the event loop scanning them
+        """
+        await asyncio.to_thread(self._disk_index)
+
+    def get(self, key: str) -> Optional[CachedBlob]:
+        """Gets a cached blob"""
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.hits["memory"] += 1
+            return CachedBlob(len(data), data=data)
+
+        disk = self._disk_index()
+        size = disk.get(key)
+        if size is not None:
+            disk.move_to_end(key)
+            self.hits["disk"] += 1
+            return CachedBlob(size, path=self._path(key))
+
+        return None
+
+    async def load(
+        self, key: str, open_data: Callable[[], Awaitable[Any]]
+    ) -> Optional[CachedBlob]:
+        """
+        Gets a cached blob, reading it in on a miss
+
+        Args:
+            key: the GridFS id of the blob
+            open_data: opens a GridFS stream over the blob's data
+
+        Returns:
+            The cached blob or, if it is too large to cache, the stream
+            opened over it for the caller whose miss opened it and None
+            for the others
+        """
+        blob = self.get(key)
+        if blob is not None:
+            return blob
+
+        task = self._loading.get(key)
+        opened = task is None
+        if opened:
+            self.misses += 1
+            task = asyncio.create_task(self._load(key, open_data))
+            self._loading[key] = task
+            task.add_done_callback(lambda _: self._loading.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        blob = await asyncio.shield(task)
+        if blob is not None and blob.reader is not None and not opened:
+            return None
+
+        return blob
+
+    async def _load(
+        self, key: str, open_data: Callable[[], Awaitable[Any]]
+    ) -> Optional[CachedBlob]:
+        grid_out = await open_data()
+        size = grid_out.length
+
+        if size <= min(self.memory_item_size, self.memory_size):
+            async with closing_reader(grid_out):
+                data = await grid_out.read()
+                count_read(grid_out, len(data))
+            self._store_memory(key, data)
+            return CachedBlob(size, data=data)
+
+        if size <= min(self.disk_item_size, self.disk_size):
+            async with closing_reader(grid_out):
+                path = await self._store_disk(key, grid_out)
+            # the stream is spent either way
+            return CachedBlob(size, path=path) if path is not None else None
+
+        # the caller streams it and closes it once it is sent
+        return CachedBlob(size, reader=grid_out)
+
+    def _store_memory(self, key: str, data: bytes):
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+
+        while self._memory_bytes > self.memory_size:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions["memory"] += 1
+
+    async def _store_disk(self, key: str, grid_out) -> Optional[str]:
+        disk = self._disk_index()
+        path = self._path(key)
+        temp_dir = os.path.join(self.directory, "tmp")
+        temp_path = os.path.join(temp_dir, uuid.uuid4().hex)
+
+        try:
+            os.makedirs(temp_dir, exist_ok=True)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, "wb") as handle:
+                while chunk := await grid_out.readchunk():
+                    count_read(grid_out, len(chunk))
+                    await asyncio.to_thread(handle.write, chunk)
+            # readers only ever see complete files
+            os.replace(temp_path, path)
+        except OSError as ex:
+            getLogger(__name__ + ".BlobCache").error(ex)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return None
+
+        disk[key] = grid_out.length
+        self._disk_bytes += grid_out.length
+
+        while self._disk_bytes > self.disk_size:
+            evicted, size = disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.evictions["disk"] += 1
+            self._remove(evicted)
+
+        return path
+
+    def _remove(self, key: str):
+        # open readers keep reading an unlinked file
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def discard(self, keys: Iterable[str]):
+        """Removes blobs whose data was deleted"""
+        disk = self._disk_index()
+
+        for key in keys:
+            data = self._memory.pop(key, None)
+            if data is not None:
+                self._memory_bytes -= len(data)
+
+            size = disk.pop(key, None)
+            if size is not None:
+                self._disk_bytes -= size
+                self._remove(key)
+
+    def served(self, blob: CachedBlob, size: int):
+        """Counts bytes sent to a client from a cached blob"""
+        tier = "memory" if blob.data is not None else "disk"
+        self.bytes_served[tier] += size
+
+    def stats(self) -> Dict[str, Union[int, float, Dict[str, int]]]:
+        """Gets the size, hit/miss, eviction and traffic counters"""
+        hits = sum(self.hits.values())
+        lookups = hits + self.misses + self.coalesced
+        disk = self._disk_index()
+
+        return {
+            "size": len(self._memory) + len(disk),
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes,
+            "hits": hits,
+            "memory_hits": self.hits["memory"],
+            "disk_hits": self.hits["disk"],
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": sum(self.evictions.values()),
+            "memory_evictions": self.evictions["memory"],
+            "disk_evictions": self.evictions["disk"],
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "bytes_served": dict(self.bytes_served),
+        }
+
+
+# decoded bearer tokens keyed by the token string
+token_cache = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL
+)
+# authenticated users keyed by user id
+user_cache = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL
+)
+# whether a user may read a project's restricted files,
+# keyed by (user id, project id)
+permission_cache = TTLCache(
+    maxsize=settings.PERMISSION_CACHE_SIZE, ttl=settings.PERMISSION_CACHE_TTL
+)
+# document counts of paginated listings,
+# keyed by (collection name, filter)
+count_cache = TTLCache(
+    maxsize=settings.COUNT_CACHE_SIZE, ttl=settings.COUNT_CACHE_TTL
+)
+
+# file data keyed by GridFS id
+blob_cache = BlobCache(
+    directory=settings.BLOB_CACHE_DIR,
+    memory_size=settings.BLOB_CACHE_MEMORY_SIZE,
+    memory_item_size=settings.BLOB_CACHE_MEMORY_ITEM_SIZE,
+    disk_size=settings.BLOB_CACHE_DISK_SIZE,
+    disk_item_size=settings.BLOB_CACHE_DISK_ITEM_SIZE,
+)
+
+caches: Dict[str, Union[TTLCache, BlobCache]] = {
+    "token": token_cache,
+    "user": user_cache,
+    "permission": permission_cache,
+    "count": count_cache,
+    "blob": blob_cache,
+}
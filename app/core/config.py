@@ -1,6 +1,7 @@
 import logging
 import logging.config
 import os
+import tempfile
 from logging.handlers import TimedRotatingFileHandler
 from typing import Any
 
@@ -58,8 +59,97 @@ class Settings(BaseSettings):
     SMTP_SERVER: str = os.getenv("SMTP_SERVER", "smtp.office365.com")
     SMTP_USERNAME: str = os.getenv("SMTP_USERNAME", "support@mannequins.com")
     SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD", "password")
+    # ssl, starttls or none (plain and unauthenticated, for local testing)
+    SMTP_SECURITY: str = os.getenv("SMTP_SECURITY", "ssl")
+    SMTP_TIMEOUT: int = int(os.getenv("SMTP_TIMEOUT", 30))
+    SMTP_IDLE_TIMEOUT: int = int(os.getenv("SMTP_IDLE_TIMEOUT", 60))
+    MAIL_BATCH_SIZE: int = int(os.getenv("MAIL_BATCH_SIZE", 20))
+    MAIL_POLL_INTERVAL: int = int(os.getenv("MAIL_POLL_INTERVAL", 10))
+    MAIL_LEASE_SECONDS: int = int(os.getenv("MAIL_LEASE_SECONDS", 300))
+    MAIL_MAX_ATTEMPTS: int = int(os.getenv("MAIL_MAX_ATTEMPTS", 5))
+    MAIL_RETRY_BASE_SECONDS: int = int(
+        os.getenv("MAIL_RETRY_BASE_SECONDS", 30)
+    )
+    MAIL_RETENTION_SECONDS: int = int(
+        os.getenv("MAIL_RETENTION_SECONDS", 7 * 24 * 60 * 60)
+    )
     MONGO_URI: str = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
     DB_NAME: str = os.getenv("DB_NAME", "mannequins")
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", 255 * 1024))
+    BLOB_BACKEND: str = os.getenv("BLOB_BACKEND", "gridfs")
+    LOCAL_BLOB_DIR: str = os.getenv("LOCAL_BLOB_DIR", "./blobs")
+    MAX_UPLOAD_SIZE: int = int(os.getenv("MAX_UPLOAD_SIZE", 25 * 1024 * 1024))
+    PROJECT_FILE_MAX_SIZE: int = int(
+        os.getenv("PROJECT_FILE_MAX_SIZE", 20 * 1024 * 1024)
+    )
+    MAX_BATCH_UPLOAD_SIZE: int = int(
+        os.getenv("MAX_BATCH_UPLOAD_SIZE", 1024 * 1024 * 1024)
+    )
+    MAX_BATCH_UPLOAD_FILES: int = int(os.getenv("MAX_BATCH_UPLOAD_FILES", 500))
+    UPLOAD_BATCH_CONCURRENCY: int = int(
+        os.getenv("UPLOAD_BATCH_CONCURRENCY", 8)
+    )
+    USER_STORAGE_QUOTA: int = int(
+        os.getenv("USER_STORAGE_QUOTA", 1024 * 1024 * 1024)
+    )
+    IMAGE_VARIANTS: str = os.getenv(
+        "IMAGE_VARIANTS", "thumbnail:256,preview:1024"
+    )
+    IMAGE_VARIANT_FORMATS: str = os.getenv("IMAGE_VARIANT_FORMATS", "webp")
+    IMAGE_VARIANT_QUALITY: int = int(os.getenv("IMAGE_VARIANT_QUALITY", 80))
+    IMAGE_POOL_WORKERS: int = int(
+        os.getenv("IMAGE_POOL_WORKERS", min(os.cpu_count() or 1, 2))
+    )
+    IMAGE_QUEUE_LIMIT: int = int(os.getenv("IMAGE_QUEUE_LIMIT", 32))
+    BLOB_CREATE_ATTEMPTS: int = int(os.getenv("BLOB_CREATE_ATTEMPTS", 3))
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", 12))
+    HASH_POOL_WORKERS: int = int(
+        os.getenv("HASH_POOL_WORKERS", min(os.cpu_count() or 1, 4))
+    )
+    HASH_QUEUE_LIMIT: int = int(os.getenv("HASH_QUEUE_LIMIT", 64))
+    PRINCIPAL_CACHE_SIZE: int = int(os.getenv("PRINCIPAL_CACHE_SIZE", 10000))
+    PRINCIPAL_CACHE_TTL: int = int(os.getenv("PRINCIPAL_CACHE_TTL", 60))
+    PERMISSION_CACHE_SIZE: int = int(
+        os.getenv("PERMISSION_CACHE_SIZE", 100000)
+    )
+    PERMISSION_CACHE_TTL: int = int(os.getenv("PERMISSION_CACHE_TTL", 60))
+    COUNT_CACHE_SIZE: int = int(os.getenv("COUNT_CACHE_SIZE", 10000))
+    COUNT_CACHE_TTL: int = int(os.getenv("COUNT_CACHE_TTL", 30))
+    DOWNLOAD_READ_AHEAD_CHUNKS: int = int(
+        os.getenv("DOWNLOAD_READ_AHEAD_CHUNKS", 4)
+    )
+    PUBLIC_CACHE_MAX_AGE: int = int(
+        os.getenv("PUBLIC_CACHE_MAX_AGE", 365 * 24 * 60 * 60)
+    )
+    DOWNLOAD_URL_KEYS: str = os.getenv("DOWNLOAD_URL_KEYS", "")
+    DOWNLOAD_URL_TTL: int = int(os.getenv("DOWNLOAD_URL_TTL", 300))
+    BLOB_CACHE_DIR: str = os.getenv(
+        "BLOB_CACHE_DIR",
+        os.path.join(tempfile.gettempdir(), "mannequins-blobs"),
+    )
+    BLOB_CACHE_MEMORY_SIZE: int = int(
+        os.getenv("BLOB_CACHE_MEMORY_SIZE", 64 * 1024 * 1024)
+    )
+    BLOB_CACHE_MEMORY_ITEM_SIZE: int = int(
+        os.getenv("BLOB_CACHE_MEMORY_ITEM_SIZE", 512 * 1024)
+    )
+    BLOB_CACHE_DISK_SIZE: int = int(
+        os.getenv("BLOB_CACHE_DISK_SIZE", 1024 * 1024 * 1024)
+    )
+    BLOB_CACHE_DISK_ITEM_SIZE: int = int(
+        os.getenv("BLOB_CACHE_DISK_ITEM_SIZE", 32 * 1024 * 1024)
+    )
+    DELETION_BATCH_SIZE: int = int(os.getenv("DELETION_BATCH_SIZE", 100))
+    DELETION_BATCH_DELAY: float = float(os.getenv("DELETION_BATCH_DELAY", 0.5))
+    DELETION_POLL_INTERVAL: int = int(os.getenv("DELETION_POLL_INTERVAL", 30))
+    DELETION_LEASE_SECONDS: int = int(os.getenv("DELETION_LEASE_SECONDS", 300))
+    RECONCILE_GRACE_SECONDS: int = int(
+        os.getenv("RECONCILE_GRACE_SECONDS", 3600)
+    )
+    SLOW_QUERY_MS: int = int(os.getenv("SLOW_QUERY_MS", 100))
+    SLOW_QUERY_EXPLAIN_INTERVAL: int = int(
+        os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", 600)
+    )
 
     def __init__(self, **values: Any):
         super().__init__(**values)
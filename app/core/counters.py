@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import sys
+from typing import Dict, Set
+
+from bson.objectid import ObjectId
+from core.storage import storage
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from schemas.file import FileCategory
+
+BATCH_SIZE = 1000
+
+# the counters of each collection and the files field that owns them
+OWNERS = {"users": "user_id", "projects": "project_id"}
+
+ZERO = {"file_count": 0, "figure_count": 0, "bytes_used": 0}
+
+
+async def _write(collection, updates: list) -> int:
+    if not updates:
+        return 0
+    result = await collection.bulk_write(updates, ordered=False)
+    updates.clear()
+    return result.modified_count
+
+
+async def repair_counters(db: AsyncIOMotorDatabase) -> Dict[str, int]:
+    """
+    Recomputes the file counters of every user and project from the
+    files collection. Uploads and deletes made while it runs can be
+    miscounted, so it is best run while the API is idle.
+
+    Returns:
+        The number of records corrected in each collection
+    """
+    report = {}
+
+    for collection_name, field in OWNERS.items():
+        collection = db[collection_name]
+        counted: Set[ObjectId] = set()
+        updates = []
+        corrected = 0
+
+        pipeline = [
+            {"$match": {field: {"$ne": None}}},
+            {
+                "$group": {
+                    "_id": f"${field}",
+                    "file_count": {"$sum": 1},
+                    "figure_count": {
+                        "$sum": {
+                            "$cond": [
+                                {
+                                    "$eq": [
+                                        "$category",
+                                        FileCategory.PROJECT_FILE.value,
+                                    ]
+                                },
+                                1,
+                                0,
+                            ]
+                        }
+                    },
+                    "bytes_used": {"$sum": {"$ifNull": ["$size", 0]}},
+                }
+            },
+        ]
+        async for usage in db["files"].aggregate(pipeline):
+            id = ObjectId(usage.pop("_id"))
+            counted.add(id)
+            updates.append(UpdateOne({"_id": id}, {"$set": usage}))
+            if len(updates) >= BATCH_SIZE:
+                corrected += await _write(collection, updates)
+
+        # records without files, including ones stored before counting
+        async for record in collection.find({}, {"_id": 1}):
+            if record["_id"] not in counted:
+                updates.append(
+                    UpdateOne({"_id": record["_id"]}, {"$set": ZERO})
+                )
+            if len(updates) >= BATCH_SIZE:
+                corrected += await _write(collection, updates)
+
+        corrected += await _write(collection, updates)
+        report[collection_name] = corrected
+
+    return report
+
+
+async def main(args: argparse.Namespace) -> int:
+    report = await repair_counters(storage.db)
+    for collection, corrected in report.items():
+        print(f"{collection}: {corrected} corrected")
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recomputes the file counters of users and projects"
+    )
+
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,91 @@
+import asyncio
+from logging import getLogger
+from typing import Dict, Optional
+
+from core.config import settings
+from core.storage import storage
+
+
+class DeletionWorker:
+    """
+    Background worker removing the projects and files left behind by
+    deleted users and projects. Work is persisted as deletion jobs and
+    done in batches of DELETION_BATCH_SIZE files, pausing
+    DELETION_BATCH_DELAY seconds between batches so live traffic is not
+    starved. A job left by a dead worker is resumed once its lease expires.
+    """
+
+    def __init__(self) -> None:
+        self.completed = 0
+        self.batches = 0
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def wake(self):
+        """Wakes the worker up to pick up a new job"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        """Starts the worker on the running event loop"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the worker, leaving its job to be resumed later"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        logger = getLogger(__name__ + ".DeletionWorker")
+
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await storage.deletion_claim_record()
+                if job is not None:
+                    await self._process(job)
+                    continue
+            except Exception as ex:
+                logger.error(ex)
+
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(),
+                    timeout=settings.DELETION_POLL_INTERVAL,
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process(self, job: Dict):
+        target_id = await storage.deletion_resolve_record(job)
+
+        while target_id is not None:
+            if job["kind"] == "user":
+                done = await storage.user_purge_step(
+                    target_id, limit=settings.DELETION_BATCH_SIZE
+                )
+            else:
+                done = await storage.project_purge_step(
+                    target_id,
+                    job["filter"].get("user_id"),
+                    limit=settings.DELETION_BATCH_SIZE,
+                )
+            self.batches += 1
+
+            if done:
+                break
+
+            await storage.deletion_renew_record(job["_id"])
+            await asyncio.sleep(settings.DELETION_BATCH_DELAY)
+
+        await storage.deletion_delete_record(str(job["_id"]))
+        self.completed += 1
+
+
+deletion_worker = DeletionWorker()
@@ -0,0 +1,620 @@
+import asyncio
+import os
+from datetime import UTC, datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import (
+    AsyncIterator,
+    BinaryIO,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+from core.authentication.signed_url import SignedDownload
+from core.blobstore import (
+    BlobNotFound,
+    BlobReader,
+    GridFSStore,
+    bytes_read,
+    close_reader,
+    count_read,
+)
+from core.cache import blob_cache
+from core.config import settings
+from core.images import get_variant, negotiate_format
+from core.storage import storage
+from fastapi import HTTPException, Request, status
+from fastapi.responses import Response, StreamingResponse
+from schemas.file import File
+from starlette.types import Receive, Scope, Send
+
+
+def parse_range_header(
+    header: Optional[str], size: int
+) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parses a bytes Range header
+
+    Args:
+        header: the value of the Range header
+        size: the size of the requested resource in bytes
+
+    Returns:
+        The satisfiable (start, end) byte ranges, with end inclusive,
+        or None if the header is absent or malformed and should be ignored
+
+    Raises:
+        HTTPException: 416 if none of the ranges can be satisfied
+    """
+    if not header:
+        return None
+
+    unit, _, ranges_spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not ranges_spec.strip():
+        return None
+
+    ranges = []
+    for spec in ranges_spec.split(","):
+        first, sep, last = spec.strip().partition("-")
+        if not sep:
+            return None
+
+        try:
+            if first == "":
+                # suffix range: the last N bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last != "" else size - 1
+        except ValueError:
+            return None
+
+        if start >= size:
+            continue
+        if end < start:
+            return None
+
+        ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+
+    return ranges
+
+
+def _utc(date: datetime) -> datetime:
+    # mongo hands back naive datetimes in UTC
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=UTC)
+    return date.replace(microsecond=0)
+
+
+def if_range_matches(
+    header: Optional[str],
+    etag: Optional[str] = None,
+    last_modified: Optional[datetime] = None,
+) -> bool:
+    """
+    Checks whether a Range request's If-Range precondition holds.
+    A missing header always holds. An entity tag must match the strong
+    etag and an HTTP date must match the last modified time.
+    """
+    if not header:
+        return True
+
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"):
+        return etag is not None and header == etag
+
+    if last_modified is None:
+        return False
+
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+
+    return since == _utc(last_modified)
+
+
+def file_etag(file: File) -> str:
+    """
+    Gets the strong entity tag of a file's data: its content hash, or
+    for data stored before hashing, the id of its immutable blob
+    """
+    return f'"{file.sha256 or file.gridfs_id}"'
+
+
+def is_not_modified(
+    headers: Mapping[str, str],
+    etag: str,
+    last_modified: Optional[datetime] = None,
+) -> bool:
+    """
+    Checks a GET request's If-None-Match or, failing that,
+    If-Modified-Since precondition against the current validators
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # weak comparison, as for any GET
+        return "*" in tags or any(
+            tag.removeprefix("W/") == etag for tag in tags
+        )
+
+    if_modified_since = headers.get("if-modified-since")
+    if not if_modified_since or last_modified is None:
+        return False
+
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        return False
+
+    return _utc(last_modified) <= since
+
+
+def cache_headers(
+    etag: str,
+    last_modified: Optional[datetime],
+    public: bool,
+    max_age: Optional[int] = None,
+) -> Dict[str, str]:
+    """
+    Gets the validator and Cache-Control headers of a download.
+    Public data is cached for a year without revalidation, as the data
+    behind a file id never changes. Restricted data is revalidated on
+    every use, or kept privately for max_age seconds if it is set.
+    """
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(
+            _utc(last_modified), usegmt=True
+        )
+    if public:
+        headers["Cache-Control"] = (
+            f"public, max-age={settings.PUBLIC_CACHE_MAX_AGE}, immutable"
+        )
+    elif max_age is not None:
+        headers["Cache-Control"] = f"private, max-age={max_age}"
+    else:
+        headers["Cache-Control"] = "private, no-cache"
+
+    return headers
+
+
+async def iter_grid_out(
+    grid_out: BlobReader,
+    start: int,
+    end: int,
+    read_ahead: int = settings.DOWNLOAD_READ_AHEAD_CHUNKS,
+) -> AsyncIterator[bytes]:
+    """
+    Streams the bytes start..end (inclusive) of a blob chunk by chunk.
+    Up to read_ahead chunks are fetched while earlier ones are being sent.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(read_ahead, 1))
+
+    async def read_chunks():
+        try:
+            grid_out.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await grid_out.readchunk()
+                if not chunk:
+                    break
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+                count_read(grid_out, len(chunk))
+                await queue.put(chunk)
+            await queue.put(None)
+        except Exception as ex:
+            await queue.put(ex)
+
+    reader = asyncio.create_task(read_chunks())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        reader.cancel()
+
+
+def select_range(
+    request: Request,
+    size: int,
+    headers: Dict[str, str],
+    etag: Optional[str] = None,
+    last_modified: Optional[datetime] = None,
+) -> Tuple[int, int, int]:
+    """
+    Picks the bytes of a resource to send, honouring Range and If-Range.
+    A single satisfiable range is sent as 206 partial content, multiple
+    ranges as the full representation. Content-Range and Content-Length
+    are set in headers.
+
+    Returns:
+        The status code and the first and last (inclusive) byte to send
+    """
+    status_code = status.HTTP_200_OK
+    start, end = 0, size - 1
+
+    ranges = None
+    if if_range_matches(
+        request.headers.get("if-range"),
+        etag=etag,
+        last_modified=last_modified,
+    ):
+        ranges = parse_range_header(request.headers.get("range"), size)
+
+    if ranges is not None and len(ranges) == 1:
+        start, end = ranges[0]
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    headers["Accept-Ranges"] = "bytes"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return status_code, start, end
+
+
+class FileRangeResponse(Response):
+    """
+    Sends bytes start..end (inclusive) of an open file. Uses the ASGI
+    zero-copy send extension, i.e. sendfile, when the server offers it
+    and reads the file in chunks otherwise.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        start: int,
+        end: int,
+        status_code: int,
+        headers: Dict[str, str],
+        media_type: str,
+    ) -> None:
+        super().__init__(
+            status_code=status_code, headers=headers, media_type=media_type
+        )
+        self.file = file
+        self.start = start
+        self.end = end
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            if scope["method"] == "HEAD":
+                return
+
+            count = self.end - self.start + 1
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": self.file,
+                        "offset": self.start,
+                        "count": count,
+                    }
+                )
+                return
+
+            self.file.seek(self.start)
+            while count > 0:
+                chunk = await asyncio.to_thread(
+                    self.file.read, min(self.chunk_size, count)
+                )
+                if not chunk:
+                    break
+                count -= len(chunk)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": True,
+                    }
+                )
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            self.file.close()
+
+
+class BlobRangeResponse(StreamingResponse):
+    """
+    Streams bytes start..end (inclusive) of an open blob. The blob is
+    closed once the response is sent or abandoned.
+    """
+
+    def __init__(
+        self,
+        grid_out: BlobReader,
+        start: int,
+        end: int,
+        status_code: int,
+        headers: Dict[str, str],
+        media_type: str,
+    ) -> None:
+        super().__init__(
+            iter_grid_out(grid_out, start, end),
+            status_code=status_code,
+            media_type=media_type,
+            headers=headers,
+        )
+        self.grid_out = grid_out
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await close_reader(self.grid_out)
+
+
+async def grid_out_response(
+    request: Request,
+    grid_out: BlobReader,
+    media_type: str,
+    etag: Optional[str] = None,
+    last_modified: Optional[datetime] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> StreamingResponse:
+    """
+    Builds a streaming response for the data of an open blob, which
+    is closed once it is sent
+    """
+    headers = dict(headers or {})
+    try:
+        status_code, start, end = select_range(
+            request, grid_out.length, headers, etag, last_modified
+        )
+    except BaseException:
+        await close_reader(grid_out)
+        raise
+
+    return BlobRangeResponse(
+        grid_out, start, end, status_code, headers, media_type
+    )
+
+
+def data_not_found() -> HTTPException:
+    """Gets the error answered when a record's blob has no data left"""
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND, detail="File data not found"
+    )
+
+
+async def open_blob(gridfs_id: str, backend: Optional[str]) -> BlobReader:
+    """
+    Opens a stream over the data of a blob being downloaded
+
+    Raises:
+        HTTPException: 404 if no engine has the data
+    """
+    try:
+        return await storage.file_open_data(gridfs_id, backend)
+    except BlobNotFound:
+        raise data_not_found()
+
+
+async def blob_response(
+    request: Request,
+    gridfs_id: str,
+    backend: Optional[str],
+    media_type: str,
+    etag: Optional[str] = None,
+    last_modified: Optional[datetime] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """
+    Builds a response for the data of a blob. Blobs kept as local files
+    are sent straight from them. Others are served from the blob cache
+    when they fit in it and streamed from their engine otherwise.
+    """
+    headers = dict(headers or {})
+
+    store = storage.blob_stores[backend or GridFSStore.name]
+    path = store.path(gridfs_id)
+    if path is not None:
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            # moved to another engine since the record was read
+            pass
+        else:
+            try:
+                status_code, start, end = select_range(
+                    request,
+                    os.fstat(file.fileno()).st_size,
+                    headers,
+                    etag,
+                    last_modified,
+                )
+            except BaseException:
+                file.close()
+                raise
+            bytes_read[store.name].inc(end - start + 1)
+            return FileRangeResponse(
+                file, start, end, status_code, headers, media_type
+            )
+
+    blob = await blob_cache.load(
+        gridfs_id, lambda: open_blob(gridfs_id, backend)
+    )
+    if blob is None or blob.reader is not None:
+        reader = (
+            blob.reader
+            if blob is not None
+            else await open_blob(gridfs_id, backend)
+        )
+        return await grid_out_response(
+            request, reader, media_type, etag, last_modified, headers
+        )
+
+    status_code, start, end = select_range(
+        request, blob.size, headers, etag, last_modified
+    )
+
+    if blob.data is not None:
+        blob_cache.served(blob, end - start + 1)
+        return Response(
+            blob.data[start : end + 1],
+            status_code=status_code,
+            media_type=media_type,
+            headers=headers,
+        )
+
+    try:
+        file = open(blob.path, "rb")
+    except FileNotFoundError:
+        # evicted since it was looked up
+        reader = await open_blob(gridfs_id, backend)
+        return BlobRangeResponse(
+            reader, start, end, status_code, headers, media_type
+        )
+
+    blob_cache.served(blob, end - start + 1)
+    return FileRangeResponse(
+        file, start, end, status_code, headers, media_type
+    )
+
+
+async def file_response(request: Request, file: File) -> Response:
+    """
+    Builds a streaming response for a file's data.
+    A request whose cached copy is still current gets 304
+    without any of the data being read.
+    """
+    etag = file_etag(file)
+    headers = cache_headers(
+        etag, file.date_modified, public=not file.restrict_access
+    )
+
+    if is_not_modified(request.headers, etag, file.date_modified):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+        )
+
+    return await blob_response(
+        request,
+        file.gridfs_id,
+        file.backend,
+        media_type="application/octet-stream",
+        etag=etag,
+        last_modified=file.date_modified,
+        headers={
+            **headers,
+            "Content-Disposition": f"attachment; filename={file.filename}",
+        },
+    )
+
+
+async def signed_file_response(
+    request: Request, download: SignedDownload
+) -> Response:
+    """
+    Builds a streaming response for the data behind a signed download
+    link. Everything needed is in the link, so no record is read.
+    The response may be kept privately until the link expires.
+    """
+    # blobs are immutable, so their id is a strong validator
+    etag = f'"{download.gridfs_id}"'
+    headers = cache_headers(
+        etag, None, public=False, max_age=download.remaining()
+    )
+
+    if is_not_modified(request.headers, etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+        )
+
+    return await blob_response(
+        request,
+        download.gridfs_id,
+        download.backend,
+        media_type="application/octet-stream",
+        etag=etag,
+        headers=headers,
+    )
+
+
+async def variant_response(
+    request: Request, file: File, name: str
+) -> Response:
+    """
+    Builds a streaming response for a variant of a file's image,
+    in the best format the client's Accept header allows.
+    A request whose cached copy is still current gets 304
+    without any of the data being read.
+    """
+    return await source_variant_response(
+        request,
+        file.gridfs_id,
+        file.backend,
+        name,
+        public=not file.restrict_access,
+    )
+
+
+async def source_variant_response(
+    request: Request,
+    source_id: str,
+    backend: Optional[str],
+    name: str,
+    public: bool,
+    max_age: Optional[int] = None,
+) -> Response:
+    """
+    Builds a streaming response for a variant of the image in a blob,
+    cached as cache_headers describes
+    """
+    format = negotiate_format(request.headers.get("accept"))
+    try:
+        variant = await get_variant(source_id, backend, name, format)
+    except BlobNotFound:
+        raise data_not_found()
+
+    # each stored variant is its own immutable blob
+    etag = f'"{variant["gridfs_id"]}"'
+    headers = {
+        **cache_headers(
+            etag, variant["date_created"], public=public, max_age=max_age
+        ),
+        "Vary": "Accept",
+    }
+
+    if is_not_modified(request.headers, etag, variant["date_created"]):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+        )
+
+    return await blob_response(
+        request,
+        variant["gridfs_id"],
+        variant.get("backend"),
+        media_type=variant["media_type"],
+        etag=etag,
+        last_modified=variant["date_created"],
+        headers=headers,
+    )
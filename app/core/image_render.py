@@ -0,0 +1,48 @@
+import io
+from typing import Tuple
+
+from PIL import Image, ImageOps
+
+# Kept apart from core.images so the spawned image pool processes only
+# import PIL, not the app's settings, storage and database client.
+
+# JPEG, or PNG for images with transparency, for every other client
+FALLBACK = "fallback"
+
+MEDIA_TYPES = {
+    "avif": "image/avif",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+}
+
+
+def render_variant(
+    data: bytes, size: int, format: str, quality: int
+) -> Tuple[bytes, str]:
+    """
+    Fits an image in a size x size box and encodes it.
+    Runs in the image pool.
+
+    Returns:
+        The encoded image and its media type
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((size, size))
+
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or (
+        image.mode == "P" and "transparency" in image.info
+    )
+    if format == FALLBACK:
+        format = "png" if has_alpha else "jpeg"
+
+    if format == "jpeg":
+        image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+    output = io.BytesIO()
+    image.save(output, format=format.upper(), quality=quality)
+
+    return output.getvalue(), MEDIA_TYPES[format]
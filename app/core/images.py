@@ -0,0 +1,181 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from typing import Dict, List, Optional, Tuple
+
+from core.blobstore import closing_reader, count_read
+from core.config import settings
+from core.image_render import FALLBACK, MEDIA_TYPES, render_variant
+from core.storage import storage
+from fastapi import HTTPException, status
+from PIL import Image, UnidentifiedImageError
+from schemas.file import File
+
+# variant names and the box, in pixels, their images are fitted in
+VARIANTS: Dict[str, int] = {
+    name.strip(): int(size)
+    for name, size in (
+        variant.split(":")
+        for variant in settings.IMAGE_VARIANTS.split(",")
+        if variant.strip()
+    )
+}
+
+# encodings offered to clients that accept them, in order of preference
+FORMATS: List[str] = [
+    format.strip().lower()
+    for format in settings.IMAGE_VARIANT_FORMATS.split(",")
+    if format.strip()
+]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pending = 0
+_generating: Dict[Tuple[str, str, str], asyncio.Task] = {}
+
+
+def negotiate_format(
+    accept: Optional[str], formats: List[str] = FORMATS
+) -> str:
+    """
+    Picks the preferred format a client's Accept header names.
+    Wildcards are not taken as support for newer formats, as browsers
+    send image/* and */* whether or not they can decode them.
+    """
+    accepted = set()
+    for entry in (accept or "").split(","):
+        media_type, *params = entry.strip().split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(media_type.strip().lower())
+
+    for format in formats:
+        if MEDIA_TYPES.get(format) in accepted:
+            return format
+
+    return FALLBACK
+
+
+def get_image_pool() -> ProcessPoolExecutor:
+    """Gets the process pool images are rendered in"""
+    global _pool
+
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    return _pool
+
+
+def shutdown_image_pool():
+    """Stops the image rendering processes"""
+    global _pool
+
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def _run_in_image_pool(func, *args):
+    """
+    Runs an image function in the process pool.
+    Fails fast with 503 once IMAGE_QUEUE_LIMIT jobs are already
+    running or waiting, instead of queueing without bound.
+    """
+    global _pending
+
+    if _pending >= settings.IMAGE_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_image_pool(), func, *args)
+    finally:
+        _pending -= 1
+
+
+async def _create_variant(
+    source_id: str, backend: Optional[str], name: str, format: str
+) -> Dict:
+    reader = await storage.file_open_data(source_id, backend)
+    async with closing_reader(reader):
+        data = await reader.read()
+        count_read(reader, len(data))
+
+    try:
+        content, media_type = await _run_in_image_pool(
+            render_variant,
+            data,
+            VARIANTS[name],
+            format,
+            settings.IMAGE_VARIANT_QUALITY,
+        )
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="File is not a supported image",
+        )
+
+    return await storage.variant_create_record(
+        source_id, name, format, content, media_type
+    )
+
+
+async def get_variant(
+    source_id: str, backend: Optional[str], name: str, format: str
+) -> Dict:
+    """
+    Gets a variant of the image in a blob, rendering and storing it on
+    first request. Concurrent requests for a missing variant share
+    one rendering.
+
+    Raises:
+        HTTPException: 404 if the variant name is not configured
+    """
+    if name not in VARIANTS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Variant not found",
+        )
+
+    variant = await storage.variant_get_record(source_id, name, format)
+    if variant is not None:
+        return variant
+
+    key = (source_id, name, format)
+    task = _generating.get(key)
+    if task is None:
+        task = asyncio.create_task(
+            _create_variant(source_id, backend, name, format)
+        )
+        _generating[key] = task
+        task.add_done_callback(lambda _: _generating.pop(key, None))
+
+    return await asyncio.shield(task)
+
+
+async def create_variants(file: File):
+    """Renders every variant of a new image in its preferred formats"""
+    logger = getLogger(__name__ + ".create_variants")
+
+    for name in VARIANTS:
+        for format in FORMATS or [FALLBACK]:
+            try:
+                await get_variant(file.gridfs_id, file.backend, name, format)
+            except Exception as ex:
+                logger.error(ex)
+                continue
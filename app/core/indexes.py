@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import sys
+from datetime import UTC, datetime
+from typing import Any, Dict, Iterator, List, Mapping, NamedTuple, Optional
+
+from bson.objectid import ObjectId
+from core.storage import storage
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+# every index the storage queries rely on, by collection
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True),
+    ],
+    "projects": [
+        IndexModel([("user_id", ASCENDING), ("name", ASCENDING)], unique=True),
+        IndexModel(
+            [
+                ("user_id", ASCENDING),
+                ("date_modified", DESCENDING),
+                ("_id", DESCENDING),
+            ]
+        ),
+        # multikey, one entry per user a project is shared with
+        IndexModel(
+            [
+                ("access_list", ASCENDING),
+                ("date_modified", DESCENDING),
+                ("_id", DESCENDING),
+            ]
+        ),
+    ],
+    "files": [
+        IndexModel(
+            [
+                ("project_id", ASCENDING),
+                ("user_id", ASCENDING),
+                ("date_created", DESCENDING),
+                ("_id", DESCENDING),
+            ]
+        ),
+        IndexModel(
+            [
+                ("project_id", ASCENDING),
+                ("user_id", ASCENDING),
+                ("group", ASCENDING),
+                ("date_created", DESCENDING),
+                ("_id", DESCENDING),
+            ]
+        ),
+        IndexModel([("gridfs_id", ASCENDING)]),
+    ],
+    "blobs": [
+        IndexModel([("gridfs_id", ASCENDING)], unique=True),
+    ],
+    "variants": [
+        IndexModel(
+            [
+                ("source_id", ASCENDING),
+                ("name", ASCENDING),
+                ("format", ASCENDING),
+            ],
+            unique=True,
+        ),
+        IndexModel([("gridfs_id", ASCENDING)]),
+    ],
+    "outbox": [
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+        # only sent and failed records have expire_at
+        IndexModel([("expire_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "deletions": [
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)]),
+    ],
+}
+
+
+# fields index_information reports that do not change how an index works
+INFO_FIELDS = ("v", "ns", "name", "background")
+
+
+class QueryShape(NamedTuple):
+    """A query MongoStorage issues, with placeholder values"""
+
+    collection: str
+    filter: Dict[str, Any]
+    sort: Optional[List] = None
+
+
+_id = ObjectId()
+_date = datetime.now(UTC)
+
+# every query shape MongoStorage issues, checked by verify_query_plans
+QUERY_SHAPES: List[QueryShape] = [
+    QueryShape("users", {"_id": _id}),
+    QueryShape("users", {"email": ""}),
+    QueryShape("projects", {"_id": _id, "user_id": ""}),
+    QueryShape(
+        "projects",
+        {"_id": _id, "$or": [{"user_id": ""}, {"access_list": ""}]},
+    ),
+    QueryShape("projects", {"user_id": ""}, [("date_modified", DESCENDING)]),
+    QueryShape(
+        "projects",
+        {
+            "user_id": "",
+            "$or": [
+                {"date_modified": {"$lt": _date}},
+                {"date_modified": _date, "_id": {"$lt": _id}},
+            ],
+        },
+        [("date_modified", DESCENDING), ("_id", DESCENDING)],
+    ),
+    QueryShape(
+        "projects",
+        {
+            "access_list": "",
+            "$or": [
+                {"date_modified": {"$lt": _date}},
+                {"date_modified": _date, "_id": {"$lt": _id}},
+            ],
+        },
+        [("date_modified", DESCENDING), ("_id", DESCENDING)],
+    ),
+    QueryShape("files", {"_id": _id}),
+    QueryShape("files", {"_id": _id, "user_id": ""}),
+    QueryShape("files", {"_id": _id, "project_id": "", "user_id": ""}),
+    QueryShape("files", {"project_id": "", "user_id": ""}),
+    QueryShape("files", {"project_id": ""}),
+    QueryShape("files", {"gridfs_id": ""}),
+    QueryShape(
+        "files", {"gridfs_id": {"$gt": ""}}, [("gridfs_id", ASCENDING)]
+    ),
+    QueryShape(
+        "files",
+        {
+            "project_id": "",
+            "user_id": "",
+            "group": "",
+            "restrict_access": True,
+            "$or": [
+                {"date_created": {"$lt": _date}},
+                {"date_created": _date, "_id": {"$lt": _id}},
+            ],
+        },
+        [("date_created", DESCENDING), ("_id", DESCENDING)],
+    ),
+    QueryShape(
+        "files",
+        {
+            "project_id": "",
+            "user_id": "",
+            "group": "",
+            "restrict_access": False,
+        },
+        [("date_created", ASCENDING), ("_id", ASCENDING)],
+    ),
+    QueryShape("blobs", {"_id": "", "ref_count": {"$gt": 0}}),
+    QueryShape("blobs", {"gridfs_id": ""}),
+    QueryShape(
+        "blobs", {"gridfs_id": {"$gt": ""}}, [("gridfs_id", ASCENDING)]
+    ),
+    QueryShape("variants", {"source_id": "", "name": "", "format": ""}),
+    QueryShape("variants", {"source_id": {"$in": [""]}}),
+    QueryShape(
+        "variants", {"gridfs_id": {"$gt": ""}}, [("gridfs_id", ASCENDING)]
+    ),
+    QueryShape(
+        "outbox",
+        {
+            "$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": _date}},
+                {"status": "sending", "lease_until": {"$lte": _date}},
+            ]
+        },
+        [("next_attempt_at", ASCENDING)],
+    ),
+    QueryShape(
+        "deletions",
+        {
+            "$or": [
+                {"status": "pending"},
+                {"status": "running", "lease_until": {"$lte": _date}},
+            ]
+        },
+        [("date_created", ASCENDING)],
+    ),
+]
+
+
+def index_options(spec: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Normalizes an index, as declared or as index_information reports
+    it, to its key and the options that change how it works
+    """
+    key = spec["key"]
+    options = {
+        option: value
+        for option, value in spec.items()
+        # False is the default of the boolean options, e.g. unique
+        if option not in INFO_FIELDS and value is not False
+    }
+    options["key"] = list(key.items() if isinstance(key, Mapping) else key)
+
+    return options
+
+
+async def apply_indexes(
+    db: AsyncIOMotorDatabase, prune: bool = False
+) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Creates the declared indexes that are missing. Safe to run repeatedly.
+    Indexes whose key or options changed are rebuilt, apart from a
+    changed TTL, which is modified in place.
+
+    Args:
+        db: the database to apply the indexes to
+        prune: whether to drop indexes that are not declared
+
+    Returns:
+        The names of the created, modified, rebuilt, dropped and
+        undeclared indexes of each collection
+    """
+    report = {}
+
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        result = {
+            "created": [],
+            "modified": [],
+            "rebuilt": [],
+            "dropped": [],
+            "unknown": [],
+        }
+
+        declared = {model.document["name"]: model for model in models}
+        for name in existing:
+            if name == "_id_" or name in declared:
+                continue
+            if prune:
+                await collection.drop_index(name)
+                result["dropped"].append(name)
+            else:
+                result["unknown"].append(name)
+
+        for name, model in declared.items():
+            if name in existing:
+                current = index_options(existing[name])
+                wanted = index_options(model.document)
+                if current == wanted:
+                    continue
+                ttl = wanted.pop("expireAfterSeconds", None)
+                if (
+                    ttl is not None
+                    and current.pop("expireAfterSeconds", None) is not None
+                    and current == wanted
+                ):
+                    await db.command(
+                        "collMod",
+                        collection_name,
+                        index={"name": name, "expireAfterSeconds": ttl},
+                    )
+                    result["modified"].append(name)
+                    continue
+                await collection.drop_index(name)
+                result["rebuilt"].append(name)
+            else:
+                result["created"].append(name)
+            await collection.create_indexes([model])
+
+        report[collection_name] = result
+
+    return report
+
+
+def plan_stages(plan: Dict[str, Any]) -> Iterator[str]:
+    """Yields the stage names of a query plan tree"""
+    plan = plan.get("queryPlan", plan)
+    if "stage" in plan:
+        yield plan["stage"]
+
+    if "inputStage" in plan:
+        yield from plan_stages(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        yield from plan_stages(child)
+
+
+async def verify_query_plans(db: AsyncIOMotorDatabase) -> List[QueryShape]:
+    """
+    Explains every query shape MongoStorage issues
+
+    Returns:
+        The shapes whose winning plan scans a whole collection
+    """
+    collscans = []
+
+    for shape in QUERY_SHAPES:
+        cursor = db[shape.collection].find(shape.filter)
+        if shape.sort:
+            cursor = cursor.sort(shape.sort)
+
+        explained = await cursor.explain()
+        winning_plan = explained["queryPlanner"]["winningPlan"]
+        if "COLLSCAN" in plan_stages(winning_plan):
+            collscans.append(shape)
+
+    return collscans
+
+
+async def main(args: argparse.Namespace) -> int:
+    if args.command == "migrate":
+        report = await apply_indexes(storage.db, prune=args.prune)
+        for collection, result in report.items():
+            for action, names in result.items():
+                for name in names:
+                    print(f"{collection}.{name}: {action}")
+        return 0
+
+    collscans = await verify_query_plans(storage.db)
+    for shape in collscans:
+        print(f"COLLSCAN on {shape.collection}: {shape.filter} {shape.sort}")
+    print(f"{len(QUERY_SHAPES) - len(collscans)}/{len(QUERY_SHAPES)} ok")
+
+    return 1 if collscans else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manages database indexes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser(
+        "migrate", help="create the declared indexes"
+    )
+    migrate.add_argument(
+        "--prune", action="store_true", help="drop undeclared indexes"
+    )
+    commands.add_parser(
+        "verify", help="fail if any storage query scans a whole collection"
+    )
+
+    sys.exit(asyncio.run(main(parser.parse_args())))
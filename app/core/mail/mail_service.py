@@ -1,11 +1,6 @@
-import smtplib
-import ssl
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from logging import getLogger
 from os import getenv
 
-from core.config import settings
+from core.mail.outbox import outbox
 
 # def send_email(subject: str, body: str, receiver_email: str) -> None:
 #     """
@@ -53,44 +48,19 @@ from core.config import settings
 #         server.quit()
 
 
-def send_email(subject: str, body: str, receiver_email: str) -> None:
+async def send_email(subject: str, body: str, receiver_email: str) -> None:
     """
-    Sends an email to a receiver
+    Queues an email to a receiver. It is sent by the outbox worker.
 
     Args:
         subject: the email subject
         body: the email body
         receiver_email: the receiver email
     """
-    logger = getLogger(__name__ + ".send_email")
-    try:
-        sender_email = settings.SMTP_USERNAME
-        sender_password = settings.SMTP_PASSWORD
-        server = settings.SMTP_SERVER
-        port = settings.SMTP_PORT
+    await outbox.enqueue(subject, body, receiver_email)
 
-        html_body = body
-        # Set up the MIME
-        email_msg = MIMEMultipart()
-        email_msg["From"] = sender_email
-        email_msg["To"] = receiver_email
-        email_msg["Subject"] = subject
 
-        # Attach the message to the email
-        email_msg.attach(MIMEText(html_body, "html"))
-
-        context = ssl.create_default_context()
-
-        with smtplib.SMTP_SSL(server, port, context=context) as server:
-            server.login(sender_email, sender_password)
-            text = email_msg.as_string()
-            server.sendmail(sender_email, receiver_email, text)
-    except Exception as ex:
-        logger.error(ex)
-        raise ex
-
-
-def send_email_verification(receiver_email: str, token: str) -> None:
+async def send_email_verification(receiver_email: str, token: str) -> None:
 
     url = f"{getenv('VERIFY_EMAIL_URL')}?token={token}"
     sender_email = getenv("EMAIL_ACCOUNT")
@@ -106,10 +76,10 @@ def send_email_verification(receiver_email: str, token: str) -> None:
   </body>
 </html>
 """
-    send_email(subject, html_body, receiver_email)
+    await send_email(subject, html_body, receiver_email)
 
 
-def send_reset_email(receiver_email: str, token: str) -> None:
+async def send_reset_email(receiver_email: str, token: str) -> None:
 
     url = f"{getenv('RESET_PASSWORD_URL')}?token={token}"
     sender_email = getenv("EMAIL_ACCOUNT")
@@ -125,4 +95,4 @@ def send_reset_email(receiver_email: str, token: str) -> None:
   </body>
 </html>
 """
-    send_email(subject, html_body, receiver_email)
+    await send_email(subject, html_body, receiver_email)
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from datetime import UTC, datetime, timedelta
+from logging import getLogger
+from typing import Any, Dict, Optional
+
+from core.config import settings
+from core.mail.smtp import SMTPSender
+from core.storage import storage
+
+
+class MailOutbox:
+    """
+    Durable email queue. Messages are persisted in the outbox collection
+    and sent in batches by a background worker over a pooled SMTP
+    connection, retrying failures with exponential backoff.
+    """
+
+    def __init__(self) -> None:
+        self.sender = SMTPSender()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.send_seconds = 0.0
+        self.last_send_seconds = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def enqueue(self, subject: str, body: str, receiver_email: str):
+        """Persists an email and wakes the worker up to send it"""
+        id = await storage.outbox_create_record(
+            subject=subject, body=body, receiver_email=receiver_email
+        )
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+        return id
+
+    def start(self):
+        """Starts the worker on the running event loop"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the worker and closes the SMTP connection"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await asyncio.to_thread(self.sender.close)
+
+    async def _run(self):
+        logger = getLogger(__name__ + ".MailOutbox")
+
+        while True:
+            # cleared before claiming so an enqueue during the claim
+            # is not missed
+            self._wakeup.clear()
+            try:
+                claimed = await self.send_due()
+            except Exception as ex:
+                logger.error(ex)
+                claimed = 0
+
+            if not claimed:
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(),
+                        timeout=settings.MAIL_POLL_INTERVAL,
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+    async def send_due(self) -> int:
+        """
+        Claims up to MAIL_BATCH_SIZE messages that are due and sends them
+
+        Returns:
+            The number of messages claimed
+        """
+        logger = getLogger(__name__ + ".MailOutbox")
+        messages = await storage.outbox_claim_records(
+            limit=settings.MAIL_BATCH_SIZE
+        )
+        if not messages:
+            return 0
+
+        start = time.perf_counter()
+        errors = await asyncio.to_thread(self.sender.send_batch, messages)
+        self.last_send_seconds = (time.perf_counter() - start) / len(messages)
+
+        for message, error in zip(messages, errors):
+            try:
+                await self._record_result(message, error)
+            except Exception as ex:
+                logger.error(ex)
+
+        return len(messages)
+
+    async def _record_result(
+        self, message: Dict[str, Any], error: Optional[Exception]
+    ):
+        if error is None:
+            await storage.outbox_complete_record(message["_id"])
+            self.sent += 1
+            self.send_seconds += self.last_send_seconds
+            return
+
+        if message["attempts"] >= settings.MAIL_MAX_ATTEMPTS:
+            await storage.outbox_fail_record(message["_id"], error=str(error))
+            self.failed += 1
+            return
+
+        delay = settings.MAIL_RETRY_BASE_SECONDS * 2 ** (
+            message["attempts"] - 1
+        )
+        await storage.outbox_retry_record(
+            message["_id"],
+            error=str(error),
+            next_attempt_at=datetime.now(UTC) + timedelta(seconds=delay),
+        )
+        self.retried += 1
+
+    async def stats(self) -> Dict[str, Any]:
+        """Gets the queue depth and send counters of the outbox"""
+        return {
+            "queue_depth": await storage.outbox_count_records(
+                {"status": {"$in": ["pending", "sending"]}}
+            ),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "last_send_seconds": self.last_send_seconds,
+            "avg_send_seconds": (
+                self.send_seconds / self.sent if self.sent else 0.0
+            ),
+        }
+
+
+outbox = MailOutbox()
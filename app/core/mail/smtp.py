@@ -0,0 +1,135 @@
+import smtplib
+import ssl
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from logging import getLogger
+from typing import Any, Dict, List, Optional
+
+from core.config import settings
+
+
+def build_message(subject: str, body: str, receiver_email: str) -> str:
+    """
+    Builds an html email message
+
+    Args:
+        subject: the email subject
+        body: the email body
+        receiver_email: the receiver email
+
+    Returns:
+        The message ready to be sent
+    """
+    html_body = body
+    # Set up the MIME
+    email_msg = MIMEMultipart()
+    email_msg["From"] = settings.SMTP_USERNAME
+    email_msg["To"] = receiver_email
+    email_msg["Subject"] = subject
+
+    # Attach the message to the email
+    email_msg.attach(MIMEText(html_body, "html"))
+
+    return email_msg.as_string()
+
+
+class SMTPSender:
+    """
+    Sends emails over one SMTP connection that is kept open and
+    authenticated between sends and closed after being idle.
+    Not thread safe, meant to be used by a single worker.
+    """
+
+    def __init__(self) -> None:
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        """Opens and authenticates a connection to the mail server"""
+        context = ssl.create_default_context()
+
+        if settings.SMTP_SECURITY == "ssl":
+            server = smtplib.SMTP_SSL(
+                settings.SMTP_SERVER,
+                settings.SMTP_PORT,
+                context=context,
+                timeout=settings.SMTP_TIMEOUT,
+            )
+        else:
+            server = smtplib.SMTP(
+                settings.SMTP_SERVER,
+                settings.SMTP_PORT,
+                timeout=settings.SMTP_TIMEOUT,
+            )
+            if settings.SMTP_SECURITY == "starttls":
+                server.starttls(context=context)
+
+        if settings.SMTP_SECURITY != "none":
+            server.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
+
+        return server
+
+    def _connection(self) -> smtplib.SMTP:
+        if (
+            self._server is not None
+            and time.monotonic() - self._last_used > settings.SMTP_IDLE_TIMEOUT
+        ):
+            self.close()
+
+        if self._server is None:
+            self._server = self._connect()
+
+        return self._server
+
+    def send(self, receiver_email: str, message: str) -> None:
+        """Sends a message, reconnecting once if the connection dropped"""
+        try:
+            self._connection().sendmail(
+                settings.SMTP_USERNAME, receiver_email, message
+            )
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            self._connection().sendmail(
+                settings.SMTP_USERNAME, receiver_email, message
+            )
+        self._last_used = time.monotonic()
+
+    def send_batch(
+        self, messages: List[Dict[str, Any]]
+    ) -> List[Optional[Exception]]:
+        """
+        Sends a batch of outbox messages
+
+        Returns:
+            The error raised for each message, None where it was sent
+        """
+        logger = getLogger(__name__ + ".SMTPSender.send_batch")
+        errors: List[Optional[Exception]] = []
+
+        for message in messages:
+            try:
+                self.send(
+                    message["receiver_email"],
+                    build_message(
+                        message["subject"],
+                        message["body"],
+                        message["receiver_email"],
+                    ),
+                )
+                errors.append(None)
+            except (smtplib.SMTPException, OSError) as ex:
+                logger.error(ex)
+                errors.append(ex)
+                self.close()
+
+        return errors
+
+    def close(self) -> None:
+        """Closes the connection to the mail server"""
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
@@ -0,0 +1,284 @@
+import time
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Tuple
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import (
+    CounterMetricFamily,
+    GaugeMetricFamily,
+    Metric,
+)
+from prometheus_client.registry import Collector
+from pymongo import monitoring
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# route label of requests no route matched, e.g. 404s for unknown paths
+UNMATCHED = "unmatched"
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request to sending the last of its response",
+    ["method", "route", "status"],
+)
+
+MONGO_COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds",
+    "Duration of Mongo commands, by command and collection",
+    ["command", "collection"],
+    buckets=(
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+    ),
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongo_command_failures_total",
+    "Mongo commands that failed, by command and collection",
+    ["command", "collection"],
+)
+
+MONGO_POOL_CHECKOUT_WAIT = Histogram(
+    "mongo_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "mongo_pool_checkout_failures_total",
+    "Connection check outs that failed, by reason",
+    ["reason"],
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    "mongo_pool_connections", "Connections open in the pool"
+)
+MONGO_POOL_CHECKED_OUT = Gauge(
+    "mongo_pool_checked_out_connections",
+    "Connections checked out of the pool",
+)
+
+BLOB_BYTES_READ = Counter(
+    "blob_bytes_read_total",
+    "Bytes of blob data read from storage, by engine",
+    ["backend"],
+)
+BLOB_BYTES_WRITTEN = Counter(
+    "blob_bytes_written_total",
+    "Bytes of blob data written to storage, by engine",
+    ["backend"],
+)
+
+# requests being handled, by the id of their ASGI scope. Their route is
+# looked up when metrics are collected, once the router has set it.
+_in_flight: Dict[int, Scope] = {}
+
+
+# the request being handled by the current task. Motor copies the
+# context into its executor, so command listeners can see it too.
+_current_request: ContextVar[Optional[Scope]] = ContextVar(
+    "current_request", default=None
+)
+
+
+def _route(scope: Scope) -> str:
+    route = scope.get("route")
+    return route.path if route is not None else UNMATCHED
+
+
+def current_route() -> Optional[str]:
+    """Gets the method and route of the request being handled, if any"""
+    scope = _current_request.get()
+    if scope is None:
+        return None
+
+    return f"{scope['method']} {_route(scope)}"
+
+
+class MetricsMiddleware:
+    """
+    Times each HTTP request by the route template it matched, so
+    paths with ids do not each make their own series
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        key = id(scope)
+        _in_flight[key] = scope
+        token = _current_request.set(scope)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            _current_request.reset(token)
+            del _in_flight[key]
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"], _route(scope), str(status_code)
+            ).observe(time.perf_counter() - start)
+
+
+class InFlightCollector(Collector):
+    """Counts the requests being handled by method and route"""
+
+    def describe(self) -> Iterator[Metric]:
+        yield self._gauge()
+
+    def collect(self) -> Iterator[Metric]:
+        counts: Dict[Tuple[str, str], int] = {}
+        for scope in list(_in_flight.values()):
+            key = (scope["method"], _route(scope))
+            counts[key] = counts.get(key, 0) + 1
+
+        gauge = self._gauge()
+        for (method, route), count in counts.items():
+            gauge.add_metric([method, route], count)
+
+        yield gauge
+
+    @staticmethod
+    def _gauge() -> GaugeMetricFamily:
+        return GaugeMetricFamily(
+            "http_requests_in_progress",
+            "Requests being handled, by method and route",
+            labels=["method", "route"],
+        )
+
+
+class CacheCollector(Collector):
+    """Reports the counters of the in-process caches when scraped"""
+
+    def describe(self) -> Iterator[Metric]:
+        # described up front so registering does not build the caches
+        yield from self._families()
+
+    def collect(self) -> Iterator[Metric]:
+        # imported here as the caches are built after the metrics
+        from core.cache import caches
+
+        hits, misses, ratio, size = families = self._families()
+        for name, cache in caches.items():
+            stats = cache.stats()
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            ratio.add_metric([name], stats["hit_ratio"])
+            size.add_metric([name], stats["size"])
+
+        yield from families
+
+    @staticmethod
+    def _families() -> Tuple[Metric, ...]:
+        return (
+            CounterMetricFamily(
+                "cache_hits", "Cache lookups answered", labels=["cache"]
+            ),
+            CounterMetricFamily(
+                "cache_misses", "Cache lookups not answered", labels=["cache"]
+            ),
+            GaugeMetricFamily(
+                "cache_hit_ratio",
+                "Share of cache lookups answered since start",
+                labels=["cache"],
+            ),
+            GaugeMetricFamily(
+                "cache_entries", "Entries held in the cache", labels=["cache"]
+            ),
+        )
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Times Mongo commands by command name and collection"""
+
+    def __init__(self) -> None:
+        # the collection of each command in flight, as only the started
+        # event carries the command itself
+        self._collections: Dict[Tuple, str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        name = event.command_name
+        collection = event.command.get(
+            "collection" if name == "getMore" else name
+        )
+        self._collections[(event.connection_id, event.request_id)] = (
+            collection if isinstance(collection, str) else ""
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        collection = self._collections.pop(
+            (event.connection_id, event.request_id), ""
+        )
+        MONGO_COMMAND_DURATION.labels(event.command_name, collection).observe(
+            event.duration_micros / 1e6
+        )
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        collection = self._collections.pop(
+            (event.connection_id, event.request_id), ""
+        )
+        MONGO_COMMAND_DURATION.labels(event.command_name, collection).observe(
+            event.duration_micros / 1e6
+        )
+        MONGO_COMMAND_FAILURES.labels(event.command_name, collection).inc()
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Tracks connection pool size, use and check out waits"""
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_WAIT.observe(event.duration)
+        MONGO_POOL_CHECKOUT_FAILURES.labels(event.reason).inc()
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_CHECKOUT_WAIT.observe(event.duration)
+        MONGO_POOL_CHECKED_OUT.inc()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec()
+
+
+REGISTRY.register(InFlightCollector())
+REGISTRY.register(CacheCollector())
@@ -0,0 +1,113 @@
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from core.cache import count_cache
+from fastapi import HTTPException, status
+from fastapi_pagination.api import create_page
+from fastapi_pagination.bases import AbstractParams
+from fastapi_pagination.utils import verify_params
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import DESCENDING
+
+
+def encode_keyset_cursor(value: datetime, id: ObjectId) -> str:
+    """Encodes the sort key of the last item of a page"""
+    return f"{value.isoformat()}|{id}"
+
+
+def decode_keyset_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """Decodes a cursor made by encode_keyset_cursor"""
+    try:
+        value, id = cursor.split("|")
+        return datetime.fromisoformat(value), ObjectId(id)
+    except (ValueError, InvalidId):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor value",
+        )
+
+
+async def paginate_keyset(
+    collection: AsyncIOMotorCollection,
+    query_filter: Dict,
+    sort_field: str,
+    direction: int = DESCENDING,
+    params: Optional[AbstractParams] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    include_total: bool = False,
+    transformer: Optional[Callable[[Dict], Any]] = None,
+) -> Any:
+    """
+    Gets a cursor page of documents sorted by (sort_field, _id).
+    Each page is read with a range query after the previous page's last
+    key, so deep pages cost the same as the first one and documents
+    inserted in the meantime do not shift or repeat items.
+
+    Args:
+        collection: the collection to read from
+        query_filter: filter selecting the documents to page through
+        sort_field: datetime field the documents are ordered by
+        direction: DESCENDING or ASCENDING
+        params: the cursor params, resolved from the request if omitted
+        projection: optional projection applied to the documents
+        include_total: whether to count the matching documents. The
+            count is cached for COUNT_CACHE_TTL seconds, so paging
+            through a listing counts it once and the total may lag
+            behind recent changes by that long.
+        transformer: optional function building each item from a document
+
+    Returns:
+        A CursorPage of the items
+    """
+    params, raw_params = verify_params(params, "cursor")
+    comparison = "$lt" if direction == DESCENDING else "$gt"
+
+    page_filter = dict(query_filter)
+    if raw_params.cursor:
+        value, id = decode_keyset_cursor(raw_params.cursor)
+        page_filter["$or"] = [
+            {sort_field: {comparison: value}},
+            {sort_field: value, "_id": {comparison: id}},
+        ]
+
+    # an inclusion projection must keep the sort key for the cursor
+    if projection is not None and any(
+        value for key, value in projection.items() if key != "_id"
+    ):
+        projection = {**projection, sort_field: 1}
+
+    documents = (
+        await collection.find(page_filter, projection)
+        .sort([(sort_field, direction), ("_id", direction)])
+        .limit(raw_params.size + 1)
+        .to_list(length=raw_params.size + 1)
+    )
+
+    next_cursor = None
+    if len(documents) > raw_params.size:
+        documents = documents[: raw_params.size]
+        last = documents[-1]
+        next_cursor = encode_keyset_cursor(last[sort_field], last["_id"])
+
+    total = None
+    if include_total:
+        key = (collection.name, repr(query_filter))
+        total = count_cache.get(key)
+        if total is None:
+            total = await collection.count_documents(query_filter)
+            count_cache.set(key, total)
+
+    items = [
+        transformer(document) if transformer else document
+        for document in documents
+    ]
+
+    return create_page(
+        items,
+        total=total,
+        params=params,
+        current=raw_params.cursor,
+        next_=next_cursor,
+    )
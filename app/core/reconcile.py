@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import sys
+from datetime import UTC, datetime, timedelta
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from bson.objectid import ObjectId
+from core.blobstore import GridFSStore
+from core.config import settings
+from core.storage import storage
+from pymongo import ASCENDING
+
+CHECKPOINT = "gridfs_reconcile"
+
+
+class Orphan(NamedTuple):
+    """
+    A GridFS id whose data and metadata disagree.
+
+    Kinds:
+        unreferenced_data: GridFS data no blob, file or variant refers to
+        leaked_blob: a blob with data but no file referring to it
+        dangling_blob: a blob whose GridFS data is missing
+        dangling_file: a file whose GridFS data is missing
+        dangling_variant: an image variant whose GridFS data is missing
+    """
+
+    kind: str
+    gridfs_id: str
+    repaired: bool = False
+
+
+async def align(
+    *streams: AsyncIterator[Tuple[str, Dict[str, Any]]]
+) -> AsyncIterator[Tuple[str, List[Optional[Dict[str, Any]]]]]:
+    """
+    Merges streams of (key, document) sorted by key, holding only the
+    current document of each stream in memory
+
+    Yields:
+        Each key once with, per stream, its first document with that key
+        or None if the stream does not have it
+    """
+    heads = [await anext(stream, None) for stream in streams]
+
+    while any(head is not None for head in heads):
+        key = min(head[0] for head in heads if head is not None)
+        documents = []
+        for i, stream in enumerate(streams):
+            document = None
+            while heads[i] is not None and heads[i][0] == key:
+                if document is None:
+                    document = heads[i][1]
+                heads[i] = await anext(stream, None)
+            documents.append(document)
+
+        yield key, documents
+
+
+async def _keyed(
+    cursor, field: str
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    async for document in cursor:
+        yield str(document[field]), document
+
+
+def _is_settled(date: Optional[datetime], settled_before: datetime) -> bool:
+    if date is None:
+        return True
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=UTC)
+    return date < settled_before
+
+
+async def _repair(
+    orphan: Orphan,
+    fs_file: Optional[Dict],
+    blob: Optional[Dict],
+    variant: Optional[Dict],
+) -> bool:
+    db = storage.db
+    gridfs_id = orphan.gridfs_id
+
+    # state is checked again as uploads and deletes may have moved on
+    # since the scan read it
+    if orphan.kind == "unreferenced_data":
+        if await db["blobs"].find_one({"gridfs_id": gridfs_id}):
+            return False
+        if await db["files"].find_one({"gridfs_id": gridfs_id}):
+            return False
+        if await db["variants"].find_one({"gridfs_id": gridfs_id}):
+            return False
+        await storage.blob_delete_data([gridfs_id])
+        return True
+
+    if orphan.kind == "leaked_blob":
+        if await db["files"].find_one({"gridfs_id": gridfs_id}):
+            return False
+        result = await db["blobs"].delete_one(
+            {
+                "_id": blob["_id"],
+                "gridfs_id": gridfs_id,
+                "ref_count": blob["ref_count"],
+            }
+        )
+        if not result.deleted_count:
+            return False
+        await storage.blob_delete_data([gridfs_id])
+        return True
+
+    if orphan.kind == "dangling_blob":
+        if await db["fs.files"].find_one({"_id": ObjectId(gridfs_id)}):
+            return False
+        result = await db["blobs"].delete_one(
+            {"_id": blob["_id"], "gridfs_id": gridfs_id}
+        )
+        return bool(result.deleted_count)
+
+    if orphan.kind == "dangling_variant":
+        # deleted variants are rendered again on their next request
+        if await db["fs.files"].find_one({"_id": ObjectId(gridfs_id)}):
+            return False
+        result = await db["variants"].delete_one(
+            {"_id": variant["_id"], "gridfs_id": gridfs_id}
+        )
+        return bool(result.deleted_count)
+
+    # file records are left for their owners and only reported
+    return False
+
+
+async def reconcile_gridfs(
+    dry_run: bool = False,
+    limit: Optional[int] = None,
+    restart: bool = False,
+    grace_seconds: int = settings.RECONCILE_GRACE_SECONDS,
+) -> Tuple[List[Orphan], Optional[str]]:
+    """
+    Compares GridFS data with the blobs, files and image variants that
+    refer to it. All four are streamed in GridFS id order and merged,
+    so none of them is loaded into memory. Data and blobs younger than
+    grace_seconds are skipped as their upload may still be in progress.
+
+    Args:
+        dry_run: report orphans without repairing them or saving progress
+        limit: the number of GridFS ids to check in this run,
+            resuming from the last checkpoint
+        restart: ignore the checkpoint and start from the beginning
+        grace_seconds: the age below which data is not considered orphaned
+
+    Returns:
+        The orphans found and the id to resume from,
+        or None if the scan reached the end
+    """
+    db = storage.db
+    settled_before = datetime.now(UTC) - timedelta(seconds=grace_seconds)
+
+    after = None
+    if not restart:
+        checkpoint = await storage.checkpoint_get_record(CHECKPOINT)
+        after = checkpoint["after"] if checkpoint else None
+
+    fs_filter = {"_id": {"$gt": ObjectId(after)}} if after else {}
+    # blobs kept by other engines are not in fs.files
+    ref_filter = {
+        "gridfs_id": {"$gt": after or ""},
+        "backend": {"$in": [None, GridFSStore.name]},
+    }
+
+    fs_files = db["fs.files"].find(fs_filter, {"uploadDate": 1})
+    blobs = db["blobs"].find(
+        ref_filter, {"gridfs_id": 1, "ref_count": 1, "date_created": 1}
+    )
+    files = db["files"].find(ref_filter, {"_id": 0, "gridfs_id": 1})
+    variants = db["variants"].find(ref_filter, {"gridfs_id": 1})
+
+    merged = align(
+        _keyed(fs_files.sort("_id", ASCENDING), "_id"),
+        _keyed(blobs.sort("gridfs_id", ASCENDING), "gridfs_id"),
+        _keyed(files.sort("gridfs_id", ASCENDING), "gridfs_id"),
+        _keyed(variants.sort("gridfs_id", ASCENDING), "gridfs_id"),
+    )
+
+    orphans = []
+    checked = 0
+    last = None
+    async for gridfs_id, (fs_file, blob, file, variant) in merged:
+        kind = None
+        if fs_file is None:
+            if blob is not None:
+                kind = "dangling_blob"
+            elif file is not None:
+                kind = "dangling_file"
+            else:
+                kind = "dangling_variant"
+        elif file is None and blob is None and variant is None:
+            if _is_settled(fs_file.get("uploadDate"), settled_before):
+                kind = "unreferenced_data"
+        elif file is None and blob is not None:
+            if _is_settled(blob.get("date_created"), settled_before):
+                kind = "leaked_blob"
+
+        if kind is not None:
+            orphan = Orphan(kind, gridfs_id)
+            if not dry_run:
+                orphan = orphan._replace(
+                    repaired=await _repair(orphan, fs_file, blob, variant)
+                )
+            orphans.append(orphan)
+
+        checked += 1
+        last = gridfs_id
+        if limit is not None and checked >= limit:
+            break
+    else:
+        last = None
+
+    if not dry_run:
+        await storage.checkpoint_set_record(CHECKPOINT, {"after": last})
+
+    return orphans, last
+
+
+async def main(args: argparse.Namespace) -> int:
+    orphans, last = await reconcile_gridfs(
+        dry_run=args.dry_run, limit=args.limit, restart=args.restart
+    )
+
+    for orphan in orphans:
+        action = "repaired" if orphan.repaired else "reported"
+        print(f"{orphan.kind} {orphan.gridfs_id}: {action}")
+    print(f"{len(orphans)} orphans")
+    print(f"resume after {last}" if last else "scan complete")
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Finds and repairs GridFS data out of step with files"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="report orphans without repairing them",
+    )
+    parser.add_argument(
+        "--limit", type=int, help="the number of GridFS ids to check"
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="start over instead of resuming from the checkpoint",
+    )
+
+    sys.exit(asyncio.run(main(parser.parse_args())))
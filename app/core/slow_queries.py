@@ -0,0 +1,269 @@
+import asyncio
+import json
+import time
+from logging import getLogger
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from core.config import settings
+from core.metrics import current_route
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+logger = getLogger(__name__)
+
+# where each command keeps its filter and sort
+FILTER_FIELDS = {
+    "find": ("filter", "sort"),
+    "count": ("query", None),
+    "distinct": ("query", None),
+    "findAndModify": ("query", "sort"),
+    "aggregate": ("pipeline", None),
+}
+# write commands keep theirs in the first of their statements
+STATEMENT_FIELDS = {"update": ("updates", "q"), "delete": ("deletes", "q")}
+# commands explain can be run for without side effects
+EXPLAINABLE = {"find", "count", "distinct", "aggregate"}
+# fields the driver adds to a command, which explain does not accept
+DRIVER_FIELDS = {"lsid", "txnNumber", "cursor"}
+EXPLAIN_QUEUE_SIZE = 16
+
+
+def filter_shape(value: Any) -> Any:
+    """
+    Replaces the values in a filter with "?", keeping field names and
+    operators. Repeated list items such as the values of $in collapse
+    into one, so filters differing only in values share a shape.
+    """
+    if isinstance(value, dict):
+        return {key: filter_shape(item) for key, item in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        shapes: List[Any] = []
+        for item in value:
+            shape = filter_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+
+    return "?"
+
+
+def returned_count(command_name: str, reply: Dict) -> Optional[int]:
+    """Gets the number of documents a command returned or changed"""
+    if "cursor" in reply:
+        cursor = reply["cursor"]
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if command_name == "distinct":
+        return len(reply.get("values", []))
+    if command_name == "findAndModify":
+        return 0 if reply.get("value") is None else 1
+
+    return reply.get("n")
+
+
+def _find(document: Any, key: str) -> Optional[Dict]:
+    """Finds the first value of key in nested explain output"""
+    if isinstance(document, dict):
+        if key in document:
+            return document[key]
+        items = document.values()
+    elif isinstance(document, list):
+        items = document
+    else:
+        return None
+
+    for item in items:
+        found = _find(item, key)
+        if found is not None:
+            return found
+
+    return None
+
+
+def plan_summary(explain: Dict) -> Dict:
+    """
+    Condenses explain output to the stages of the winning plan, the
+    indexes it used and the work it did
+    """
+    winning_plan = _find(explain, "winningPlan") or {}
+    # plans run by the slot based engine are nested one level down
+    stage = winning_plan.get("queryPlan", winning_plan)
+
+    stages, indexes = [], []
+    while stage:
+        stages.append(stage.get("stage", "?"))
+        if "indexName" in stage:
+            indexes.append(stage["indexName"])
+        stage = stage.get("inputStage") or next(
+            iter(stage.get("inputStages", [])), None
+        )
+
+    stats = _find(explain, "executionStats") or {}
+
+    return {
+        "stages": " <- ".join(stages),
+        "indexes": indexes,
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "returned": stats.get("nReturned"),
+    }
+
+
+class SlowQuery(NamedTuple):
+    database: str
+    command: Dict
+    shape: str
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    """
+    Logs Mongo queries taking SLOW_QUERY_MS or longer with the route
+    that issued them, their filter shape, duration and the number of
+    documents returned. The plan of a slow query is then captured with
+    explain in the background, at most once every
+    SLOW_QUERY_EXPLAIN_INTERVAL seconds per shape.
+    """
+
+    def __init__(
+        self,
+        threshold_ms: int = settings.SLOW_QUERY_MS,
+        explain_interval: int = settings.SLOW_QUERY_EXPLAIN_INTERVAL,
+    ) -> None:
+        self.threshold_micros = threshold_ms * 1000
+        self.explain_interval = explain_interval
+        self.slow = 0
+        self.explained = 0
+        # the commands in flight, as only the started event has them
+        self._commands: Dict[Tuple, Tuple[str, Dict]] = {}
+        self._explained_at: Dict[str, float] = {}
+        self._client: Optional[AsyncIOMotorClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, client: AsyncIOMotorClient):
+        """Starts capturing query plans on the running event loop"""
+        self._client = client
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=EXPLAIN_QUEUE_SIZE)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops capturing query plans, dropping those not captured yet"""
+        self._loop = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if self.threshold_micros > 0 and (
+            event.command_name in FILTER_FIELDS
+            or event.command_name in STATEMENT_FIELDS
+        ):
+            key = (event.connection_id, event.request_id)
+            self._commands[key] = (event.database_name, event.command)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        started = self._commands.pop(
+            (event.connection_id, event.request_id), None
+        )
+        if started is None or event.duration_micros < self.threshold_micros:
+            return
+
+        database, command = started
+        name = event.command_name
+        collection = command.get(name)
+        if name in STATEMENT_FIELDS:
+            field, filter_field = STATEMENT_FIELDS[name]
+            statement = (command.get(field) or [{}])[0]
+            filter, sort = statement.get(filter_field), None
+        else:
+            filter_field, sort_field = FILTER_FIELDS[name]
+            filter = command.get(filter_field)
+            sort = command.get(sort_field) if sort_field else None
+
+        shape = json.dumps(
+            {
+                "collection": collection,
+                "command": name,
+                "filter": filter_shape(filter or {}),
+                "sort": sort,
+            },
+            default=str,
+        )
+
+        self.slow += 1
+        logger.warning(
+            f"Slow {name} on {collection} took "
+            f"{event.duration_micros / 1000:.1f} ms, "
+            f"route {current_route() or '-'}, "
+            f"returned {returned_count(name, event.reply)}, "
+            f"query {shape}"
+        )
+
+        if name in EXPLAINABLE and self._loop is not None:
+            query = SlowQuery(database, command, shape)
+            try:
+                self._loop.call_soon_threadsafe(self._enqueue, query)
+            except RuntimeError:
+                # the loop closed meanwhile
+                pass
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._commands.pop((event.connection_id, event.request_id), None)
+
+    def _enqueue(self, query: SlowQuery):
+        now = time.monotonic()
+        explained_at = self._explained_at.get(query.shape)
+        if explained_at is not None and (
+            now - explained_at < self.explain_interval
+        ):
+            return
+
+        try:
+            self._queue.put_nowait(query)
+        except asyncio.QueueFull:
+            return
+        self._explained_at[query.shape] = now
+
+    async def _run(self):
+        while True:
+            query = await self._queue.get()
+            try:
+                await self._explain(query)
+            except Exception as ex:
+                logger.error(f"Explain of {query.shape} failed: {ex}")
+
+    async def _explain(self, query: SlowQuery):
+        command = {
+            key: value
+            for key, value in query.command.items()
+            if not key.startswith("$") and key not in DRIVER_FIELDS
+        }
+        if "pipeline" in command:
+            command["cursor"] = {}
+
+        explain = await self._client[query.database].command(
+            {"explain": command, "verbosity": "executionStats"}
+        )
+        summary = plan_summary(explain)
+
+        self.explained += 1
+        # a collection scan is what these logs are most often read for
+        log = (
+            logger.warning if "COLLSCAN" in summary["stages"] else logger.info
+        )
+        log(
+            f"Plan of {query.shape}: {summary['stages']}, "
+            f"indexes {summary['indexes']}, "
+            f"examined {summary['docs_examined']} docs and "
+            f"{summary['keys_examined']} keys, "
+            f"returned {summary['returned']}"
+        )
+
+
+slow_query_log = SlowQueryLog()
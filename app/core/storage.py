@@ -1,17 +1,36 @@
-from datetime import UTC, datetime
-from typing import Dict, List, Optional
+import asyncio
+import hashlib
+from collections import Counter
+from datetime import UTC, datetime, timedelta
+from typing import Dict, List, Optional, Union
 
-import gridfs
 import schemas.file as s_file
 import schemas.project as s_project
 import schemas.user as s_user
 from bson.objectid import ObjectId
-from core.authentication.hashing import hash_bcrypt
+from core.authentication.hashing import hash_password
+from core.blobstore import (
+    BlobNotFound,
+    BlobReader,
+    BlobStore,
+    GridFSStore,
+    LocalStore,
+    closing_reader,
+    count_read,
+)
+from core.cache import blob_cache, permission_cache, user_cache
 from core.config import settings
-from fastapi import HTTPException, status
+from core.metrics import CommandMetricsListener, PoolMetricsListener
+from core.pagination import paginate_keyset
+from core.slow_queries import slow_query_log
+from core.upload import CATEGORY_MAX_SIZES
+from fastapi import HTTPException, UploadFile, status
 from fastapi_pagination import Page
-from fastapi_pagination.ext.pymongo import paginate
-from pymongo import ASCENDING, DESCENDING, MongoClient
+from fastapi_pagination.cursor import CursorPage
+from fastapi_pagination.ext.motor import paginate
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 # DB_NAME = "mannequins"
 
@@ -24,17 +43,28 @@ class MongoStorage:
         Storage object with methods to Create, Read, Update,
         Delete (CRUD) objects in the mongo database.
         """
-        self.client = MongoClient(settings.MONGO_URI)
-        self.db = self.client[settings.DB_NAME]
-        self.fs = gridfs.GridFS(self.db)
-
-        self.db["users"].create_index([("email", ASCENDING)], unique=True)
-        self.db["projects"].create_index(
-            [("title", ASCENDING), "user_id"], unique=True
+        self.client = AsyncIOMotorClient(
+            settings.MONGO_URI,
+            event_listeners=[
+                CommandMetricsListener(),
+                PoolMetricsListener(),
+                slow_query_log,
+            ],
         )
+        self.db = self.client[settings.DB_NAME]
+        self.blob_stores: Dict[str, BlobStore] = {
+            GridFSStore.name: GridFSStore(
+                self.db, chunk_size=settings.UPLOAD_CHUNK_SIZE
+            ),
+            LocalStore.name: LocalStore(
+                settings.LOCAL_BLOB_DIR, chunk_size=settings.UPLOAD_CHUNK_SIZE
+            ),
+        }
+        # the engine new blobs are written to
+        self.blob_store = self.blob_stores[settings.BLOB_BACKEND]
 
     # users
-    def user_create_record(
+    async def user_create_record(
         self,
         user_data: s_user.UserIn,
         role: s_user.Roles = "user",
@@ -45,12 +75,6 @@ class MongoStorage:
 
         users_table = self.db["users"]
 
-        if users_table.find_one({"email": user_data.email}):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already taken",
-            )
-
         if len(user_data.password) < 8:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -60,34 +84,42 @@ class MongoStorage:
 
         date = datetime.now(UTC)
         user = user_data.model_dump()
-        user["password"] = hash_bcrypt(user_data.password)
+        user["password"] = await hash_password(user_data.password)
         user["role"] = role
+        user["file_count"] = 0
         user["figure_count"] = 0
+        user["bytes_used"] = 0
         user["sign_in_type"] = sign_in_type
         user["verified"] = verified
         user["status"] = s_user.UserStatus.ENABLED
         user["date_created"] = date
         user["date_modified"] = date
 
-        id = str(users_table.insert_one(user).inserted_id)
+        try:
+            id = str((await users_table.insert_one(user)).inserted_id)
+        except DuplicateKeyError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already taken",
+            )
 
         return id
 
-    def user_get_record(self, filter: Dict) -> Optional[s_user.User]:
+    async def user_get_record(self, filter: Dict) -> Optional[s_user.User]:
         """Gets a user record from the db using the supplied filter"""
         users = self.db["users"]
 
         if "_id" in filter and type(filter["_id"]) is str:
             filter["_id"] = ObjectId(filter["_id"])
 
-        user = users.find_one(filter)
+        user = await users.find_one(filter)
 
         if user:
             user = s_user.User(**user)
 
         return user
 
-    def user_get_all_records(self, filter: Dict) -> List[s_user.User]:
+    async def user_get_all_records(self, filter: Dict) -> List[s_user.User]:
         """Gets all user records from the db using the supplied filter"""
         users = self.db["users"]
 
@@ -96,17 +128,17 @@ class MongoStorage:
 
         users_list = users.find(filter)
 
-        users_list = [s_user.User(**user) for user in users_list]
+        users_list = [s_user.User(**user) async for user in users_list]
 
         return users_list
 
-    def user_verify_record(self, filter: Dict) -> s_user.User:
+    async def user_verify_record(self, filter: Dict) -> s_user.User:
         """
         Gets a user record using the filter
         and raises an error if a matching record is not found
         """
 
-        user = self.user_get_record(filter)
+        user = await self.user_get_record(filter)
 
         if user is None:
             raise HTTPException(
@@ -115,25 +147,81 @@ class MongoStorage:
 
         return user
 
-    def user_update_record(self, filter: Dict, update: Dict):
-        """Updates a user record"""
-        self.user_verify_record(filter)
-
+    async def user_update_record(
+        self, filter: Dict, update: Dict
+    ) -> s_user.User:
+        """Updates a user record and returns the updated user"""
         for key in ["_id", "email"]:
             if key in update:
                 raise KeyError(f"Invalid Key. KEY {key} cannot be changed")
         update["date_modified"] = datetime.now(UTC)
 
-        return self.db["users"].update_one(filter, {"$set": update})
+        if "_id" in filter and type(filter["_id"]) is str:
+            filter["_id"] = ObjectId(filter["_id"])
+
+        user = await self.db["users"].find_one_and_update(
+            filter, {"$set": update}, return_document=ReturnDocument.AFTER
+        )
+
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+            )
+
+        user = s_user.User(**user)
+        user_cache.pop(user.id)
+
+        return user
+
+    async def user_delete_record(self, filter: Dict) -> s_user.User:
+        """Deletes a user record and returns the deleted user"""
+        if "_id" in filter and type(filter["_id"]) is str:
+            filter["_id"] = ObjectId(filter["_id"])
+
+        job_id = await self.deletion_create_record("user", filter)
+        user = await self.db["users"].find_one_and_delete(filter)
+
+        if user is None:
+            await self.deletion_delete_record(job_id)
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+            )
+
+        user = s_user.User(**user)
+        user_cache.pop(user.id)
+        # the user's projects and files are removed by the deletion worker
+        await self.deletion_release_record(job_id, user.id)
+
+        return user
+
+    async def user_reserve_usage(self, user_id: str, usage: Dict[str, int]):
+        """
+        Adds a file's usage to a user's counters, enforcing the storage
+        quota in the same conditional update
+
+        Raises:
+            HTTPException: 413 if the file would take the user over
+                USER_STORAGE_QUOTA
+        """
+        filter = {"_id": ObjectId(user_id)}
+        quota = settings.USER_STORAGE_QUOTA
+        if quota > 0:
+            # also matches users stored before bytes_used was counted
+            filter["bytes_used"] = {
+                "$not": {"$gt": quota - usage["bytes_used"]}
+            }
 
-    def user_delete_record(self, filter: Dict):
-        """Deletes a user record"""
-        self.user_verify_record(filter)
+        result = await self.db["users"].update_one(filter, {"$inc": usage})
 
-        self.db["users"].delete_one(filter)
+        if not result.matched_count:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Storage quota exceeded",
+            )
+        user_cache.pop(user_id)
 
     # projects
-    def project_create_record(
+    async def project_create_record(
         self,
         project_data: s_project.ProjectIn,
         user_id: str,
@@ -142,40 +230,44 @@ class MongoStorage:
 
         projects_table = self.db["projects"]
 
-        if projects_table.find_one(
-            {"name": project_data.name, "user_id": user_id}
-        ):
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Project name already exists",
-            )
-
         date = datetime.now(UTC)
         project = project_data.model_dump()
         project["user_id"] = user_id
+        project["file_count"] = 0
         project["figure_count"] = 0
+        project["bytes_used"] = 0
         project["date_created"] = date
         project["date_modified"] = date
 
-        id = str(projects_table.insert_one(project).inserted_id)
+        try:
+            id = str((await projects_table.insert_one(project)).inserted_id)
+        except DuplicateKeyError:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Project name already exists",
+            )
 
         return id
 
-    def project_get_record(self, filter: Dict) -> Optional[s_project.Project]:
+    async def project_get_record(
+        self, filter: Dict
+    ) -> Optional[s_project.Project]:
         """Gets a project record from the db using the supplied filter"""
         projects = self.db["projects"]
 
         if "_id" in filter and type(filter["_id"]) is str:
             filter["_id"] = ObjectId(filter["_id"])
 
-        project = projects.find_one(filter)
+        project = await projects.find_one(filter)
 
         if project:
             project = s_project.Project(**project)
 
         return project
 
-    def project_get_all_records(self, filter: Dict) -> List[s_project.Project]:
+    async def project_get_all_records(
+        self, filter: Dict
+    ) -> List[s_project.Project]:
         """Gets all project records from the db using the supplied filter"""
         projects = self.db["projects"]
 
@@ -187,7 +279,7 @@ class MongoStorage:
         )
         projects_out = []
 
-        for project in projects_list:
+        async for project in projects_list:
 
             project = s_project.Project(**project)
 
@@ -199,7 +291,7 @@ class MongoStorage:
 
         return projects_out
 
-    def project_get_page(self, filter: Dict) -> Page[s_project.Project]:
+    async def project_get_page(self, filter: Dict) -> Page[s_project.Project]:
         """Gets a page of project records from
         the db using the supplied filter"""
         projects = self.db["projects"]
@@ -207,7 +299,7 @@ class MongoStorage:
         if "_id" in filter and type(filter["_id"]) is str:
             filter["_id"] = ObjectId(filter["_id"])
 
-        page: Page[s_project.Project] = paginate(
+        page: Page[s_project.Project] = await paginate(
             collection=projects,
             query_filter=filter,
             sort={"date_modified": DESCENDING},
@@ -222,13 +314,37 @@ class MongoStorage:
 
         return page
 
-    def project_verify_record(self, filter: Dict) -> s_project.Project:
+    async def project_get_cursor_page(
+        self,
+        filter: Dict,
+        include_total: bool = False,
+        projection: Optional[Dict] = None,
+    ) -> CursorPage[s_project.Project]:
+        """Gets a cursor page of project records from
+        the db using the supplied filter and projection"""
+        projects = self.db["projects"]
+
+        if "_id" in filter and type(filter["_id"]) is str:
+            filter["_id"] = ObjectId(filter["_id"])
+
+        page: CursorPage[s_project.Project] = await paginate_keyset(
+            collection=projects,
+            query_filter=filter,
+            sort_field="date_modified",
+            projection=projection,
+            include_total=include_total,
+            transformer=lambda project: s_project.Project(**project),
+        )
+
+        return page
+
+    async def project_verify_record(self, filter: Dict) -> s_project.Project:
         """
         Gets a project record using the filter
         and raises an error if a matching record is not found
         """
 
-        project = self.project_get_record(filter)
+        project = await self.project_get_record(filter)
 
         if project is None:
             raise HTTPException(
@@ -238,106 +354,454 @@ class MongoStorage:
 
         return project
 
-    def project_update_record(self, filter: Dict, update: Dict):
-        """Updates a project record"""
-        self.project_verify_record(filter)
-
+    async def project_update_record(
+        self, filter: Dict, update: Dict
+    ) -> s_project.Project:
+        """Updates a project record and returns the updated project"""
         for key in ["_id", "user_id"]:
             if key in update:
                 raise KeyError(f"Invalid Key. KEY {key} cannot be changed")
-        update["date_modified"] = datetime.now(UTC)
-
-        self.db["projects"].update_one(filter, {"$set": update})
 
-    def project_advanced_update_record(self, filter: Dict, update: Dict):
-        """Updates a project record with more complex parameters"""
-        self.project_verify_record(filter)
+        return await self.project_advanced_update_record(
+            filter, {"$set": update}
+        )
 
+    async def project_advanced_update_record(
+        self, filter: Dict, update: Dict
+    ) -> s_project.Project:
+        """
+        Updates a project record with more complex parameters
+        and returns the updated project
+        """
         if "$set" in update:
             update["$set"]["date_modified"] = datetime.now(UTC)
         else:
             update["$set"] = {"date_modified": datetime.now(UTC)}
 
-        return self.db["projects"].update_one(filter, update)
+        if "_id" in filter and type(filter["_id"]) is str:
+            filter["_id"] = ObjectId(filter["_id"])
 
-    def project_delete_record(self, filter: Dict):
-        """Deletes a project record"""
-        project = self.project_verify_record(filter)
+        try:
+            project = await self.db["projects"].find_one_and_update(
+                filter, update, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Project name already exists",
+            )
 
-        self.db["projects"].delete_one(filter)
+        if project is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Project not found",
+            )
+
+        return s_project.Project(**project)
+
+    async def project_share_record(
+        self, filter: Dict, user_id: str
+    ) -> s_project.Project:
+        """Adds a user to a project's access list"""
+        project = await self.project_advanced_update_record(
+            filter, {"$addToSet": {"access_list": user_id}}
+        )
+        permission_cache.pop((user_id, project.id))
+
+        return project
+
+    async def project_unshare_record(
+        self, filter: Dict, user_id: str
+    ) -> s_project.Project:
+        """Removes a user from a project's access list"""
+        project = await self.project_advanced_update_record(
+            filter, {"$pull": {"access_list": user_id}}
+        )
+        permission_cache.pop((user_id, project.id))
+
+        return project
+
+    async def project_check_access(
+        self, project_id: str, user_id: str
+    ) -> bool:
+        """
+        Checks whether a user owns a project or is on its access list.
+        Answers are cached per user and project, and dropped when the
+        access list changes.
+        """
+        key = (user_id, project_id)
+        allowed = permission_cache.get(key)
+
+        if allowed is None:
+            allowed = (
+                await self.db["projects"].find_one(
+                    {
+                        "_id": ObjectId(project_id),
+                        "$or": [
+                            {"user_id": user_id},
+                            {"access_list": user_id},
+                        ],
+                    },
+                    {"_id": 1},
+                )
+                is not None
+            )
+            permission_cache.set(key, allowed)
 
-        # for file in project.files:
-        #     self.file_delete_record({"_id": file.id})
+        return allowed
+
+    async def project_delete_record(self, filter: Dict) -> s_project.Project:
+        """Deletes a project record and returns the deleted project"""
+        if "_id" in filter and type(filter["_id"]) is str:
+            filter["_id"] = ObjectId(filter["_id"])
+
+        job_id = await self.deletion_create_record("project", filter)
+        project = await self.db["projects"].find_one_and_delete(filter)
+
+        if project is None:
+            await self.deletion_delete_record(job_id)
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Project not found",
+            )
+
+        project = s_project.Project(**project)
+        for user_id in [project.user_id, *project.access_list]:
+            permission_cache.pop((user_id, project.id))
+        # the project's files are removed by the deletion worker
+        await self.deletion_release_record(job_id, project.id)
+
+        return project
 
     # files
-    def file_create_record(
+    async def file_create_record(
         self,
-        data: bytes,
+        source: UploadFile,
         file_data: s_file.FileMetadata,
-    ) -> str:
-        """Creates a file record"""
+    ) -> s_file.File:
+        """
+        Creates a file record. The data is stored as a content addressed
+        blob, so identical uploads share one stored copy.
+        """
         files_table = self.db["files"]
 
-        gridfs_id = str(self.fs.put(data, **file_data.model_dump()))
+        blob = await self.blob_create_record(
+            source, max_size=CATEGORY_MAX_SIZES.get(file_data.category)
+        )
+
+        file = self._file_document(file_data, blob)
+
+        try:
+            await self.user_reserve_usage(
+                file["user_id"], self.file_usage(file)
+            )
+        except BaseException:
+            await self.blob_release_record(blob["gridfs_id"])
+            raise
+
+        project_counted = False
+        try:
+            if file["project_id"] is not None:
+                await self.db["projects"].update_one(
+                    {"_id": ObjectId(file["project_id"])},
+                    {"$inc": self.file_usage(file)},
+                )
+                project_counted = True
+            file["_id"] = (await files_table.insert_one(file)).inserted_id
+        except BaseException:
+            # only the counters already added to are taken off again
+            await self.file_usage_release([file], projects=project_counted)
+            await self.blob_release_record(blob["gridfs_id"])
+            raise
+
+        return self._file_with_link(file)
+
+    async def file_create_records(
+        self, sources: List[UploadFile], file_data: s_file.FileMetadata
+    ) -> List[Union[s_file.File, Exception]]:
+        """
+        Creates file records for a batch of uploads sharing the same
+        details apart from their filename. Blobs are stored concurrently,
+        UPLOAD_BATCH_CONCURRENCY at a time, the quota is reserved and the
+        project counted once for the batch and the records are inserted
+        with one insert_many. Each upload succeeds or fails on its own.
+
+        Returns:
+            Per upload, in order, its file or the exception it failed with
+        """
+        results: List[Union[s_file.File, Exception, None]] = [None] * len(
+            sources
+        )
+        # blobs stored for uploads that have no file record yet
+        pending: Dict[int, Dict] = {}
+        semaphore = asyncio.Semaphore(settings.UPLOAD_BATCH_CONCURRENCY)
+        max_size = CATEGORY_MAX_SIZES.get(file_data.category)
+
+        async def store(index: int, source: UploadFile):
+            async with semaphore:
+                try:
+                    pending[index] = await self.blob_create_record(
+                        source, max_size=max_size
+                    )
+                except Exception as ex:
+                    results[index] = ex
+
+        def fail(indexes: List[int], ex: Exception) -> List[str]:
+            for index in indexes:
+                results[index] = ex
+            return [pending.pop(index)["gridfs_id"] for index in indexes]
+
+        try:
+            await asyncio.gather(
+                *[store(i, source) for i, source in enumerate(sources)]
+            )
+
+            files = {
+                index: self._file_document(
+                    file_data.model_copy(
+                        update={"filename": sources[index].filename}
+                    ),
+                    blob,
+                )
+                for index, blob in sorted(pending.items())
+            }
+            if not files:
+                return results
+
+            # the files the user's counters hold so far, and whether the
+            # project's do, so a failure only takes those off again
+            counted: List[Dict] = []
+            project_counted = False
+            try:
+                try:
+                    await self.user_reserve_usage(
+                        file_data.user_id, self._batch_usage(files.values())
+                    )
+                    counted = list(files.values())
+                except HTTPException:
+                    # over quota as a whole, so take in as many as still fit
+                    released = []
+                    for index in list(files):
+                        try:
+                            await self.user_reserve_usage(
+                                file_data.user_id,
+                                self.file_usage(files[index]),
+                            )
+                            counted.append(files[index])
+                        except HTTPException as ex:
+                            del files[index]
+                            released += fail([index], ex)
+                    await self.blob_release_records(released)
+                    if not files:
+                        return results
+
+                indexes = list(files)
+                if file_data.project_id is not None:
+                    await self.db["projects"].update_one(
+                        {"_id": ObjectId(file_data.project_id)},
+                        {"$inc": self._batch_usage(files.values())},
+                    )
+                    project_counted = True
+                await self.db["files"].insert_many(
+                    list(files.values()), ordered=False
+                )
+            except BulkWriteError as ex:
+                failed = [
+                    indexes[e["index"]] for e in ex.details["writeErrors"]
+                ]
+                await self.file_usage_release([files[i] for i in failed])
+                await self.blob_release_records(
+                    fail(
+                        failed,
+                        HTTPException(
+                            status_code=500, detail="File could not be saved"
+                        ),
+                    )
+                )
+            except BaseException:
+                await self.file_usage_release(
+                    counted, projects=project_counted
+                )
+                raise
+
+            for index in indexes:
+                if index in pending:
+                    del pending[index]
+                    results[index] = self._file_with_link(files[index])
+        finally:
+            # left when the batch as a whole failed or was cancelled
+            await self.blob_release_records(
+                [blob["gridfs_id"] for blob in pending.values()]
+            )
+
+        return results
+
+    @staticmethod
+    def _file_document(file_data: s_file.FileMetadata, blob: Dict) -> Dict:
+        """Builds the document of a new file stored as blob"""
         date = datetime.now(UTC)
         file = file_data.model_dump()
-        file["gridfs_id"] = gridfs_id
+        file["gridfs_id"] = blob["gridfs_id"]
+        file["backend"] = blob.get("backend", GridFSStore.name)
+        file["size"] = blob["size"]
+        file["sha256"] = blob["_id"]
         file["date_created"] = date
         file["date_modified"] = date
 
-        id = str(files_table.insert_one(file).inserted_id)
+        return file
 
-        return id
+    def _batch_usage(self, files) -> Dict[str, int]:
+        """Sums the counter increments of adding files"""
+        usage = Counter()
+        for file in files:
+            usage.update(self.file_usage(file))
+
+        return dict(usage)
+
+    @staticmethod
+    def file_usage(file: Dict, sign: int = 1) -> Dict[str, int]:
+        """Gets the counter increments of adding (1) or removing (-1) a file"""
+        is_figure = file["category"] == s_file.FileCategory.PROJECT_FILE
+
+        return {
+            "file_count": sign,
+            "figure_count": sign if is_figure else 0,
+            "bytes_used": sign * (file.get("size") or 0),
+        }
+
+    async def file_usage_release(
+        self, files: List[Dict], projects: bool = True
+    ):
+        """
+        Takes files off the counters of their users and projects,
+        with one bulk update per collection
 
-    def file_get_record(self, filter: Dict) -> Optional[s_file.File]:
+        Args:
+            files: the file documents
+            projects: whether their projects' counters hold them too
+        """
+        owners = {"users": {}, "projects": {}}
+        for file in files:
+            usage = self.file_usage(file, sign=-1)
+            for collection, id in (
+                ("users", file.get("user_id")),
+                ("projects", file.get("project_id") if projects else None),
+            ):
+                if id is None:
+                    continue
+                total = owners[collection].setdefault(
+                    id, dict.fromkeys(usage, 0)
+                )
+                for counter, value in usage.items():
+                    total[counter] += value
+
+        for collection, totals in owners.items():
+            if totals:
+                await self.db[collection].bulk_write(
+                    [
+                        UpdateOne({"_id": ObjectId(id)}, {"$inc": usage})
+                        for id, usage in totals.items()
+                    ],
+                    ordered=False,
+                )
+        for id in owners["users"]:
+            user_cache.pop(id)
+
+    def _file_with_link(self, document: Dict) -> s_file.File:
+        """Builds a file model with its download link from a document"""
+        file = s_file.File(**document)
+        if file.restrict_access:
+            file.download_link = f"/api/v1/files/{file.id}/download"
+        else:
+            file.download_link = (
+                f"/api/v1/files/{file.id}/unrestricted/download"
+            )
+
+        return file
+
+    async def file_get_record(self, filter: Dict) -> Optional[s_file.File]:
         """Gets a file record from the db using the supplied filter"""
         files = self.db["files"]
 
         if "_id" in filter and type(filter["_id"]) is str:
             filter["_id"] = ObjectId(filter["_id"])
 
-        file = files.find_one(filter)
+        file = await files.find_one(filter)
 
         if file:
-            file = s_file.File(**file)
-            if file.restrict_access:
-                file.download_link = f"/api/v1/files/{file.id}/download"
-            else:
-                file.download_link = (
-                    f"/api/v1/files/{file.id}/unrestricted/download"
-                )
+            file = self._file_with_link(file)
 
         return file
 
-    def file_get_all_records(self, filter: Dict) -> List[s_file.File]:
+    async def file_get_all_records(
+        self, filter: Dict, sort: Optional[List] = None
+    ) -> List[s_file.File]:
         """Gets all file records from the db using the supplied filter"""
         files = self.db["files"]
 
         if "_id" in filter and type(filter["_id"]) is str:
             filter["_id"] = ObjectId(filter["_id"])
 
-        files_list = files.find(filter)
+        files_list = files.find(filter, sort=sort)
         files_output = []
 
-        for file in files_list:
-            file = s_file.File(**file)
-            if file.restrict_access:
-                file.download_link = f"/api/v1/files/{file.id}/download"
-            else:
-                file.download_link = (
-                    f"/api/v1/files/{file.id}/unrestricted/download"
-                )
-            files_output.append(file)
+        async for file in files_list:
+            files_output.append(self._file_with_link(file))
 
         return files_output
 
-    def file_verify_record(self, filter: Dict) -> s_file.File:
+    async def file_get_cursor_page(
+        self,
+        filter: Dict,
+        fields: Optional[List[s_file.FileField]] = None,
+        direction: int = DESCENDING,
+    ) -> CursorPage[s_file.FileListItem]:
+        """
+        Gets a cursor page of file records ordered by date_created.
+        Only the requested fields are read from the db.
+        """
+        files = self.db["files"]
+
+        if "_id" in filter and type(filter["_id"]) is str:
+            filter["_id"] = ObjectId(filter["_id"])
+
+        projection = None
+        if fields:
+            # restrict_access is needed to build the download link
+            projection = {field.value: 1 for field in fields}
+            projection["restrict_access"] = 1
+
+        page: CursorPage[s_file.FileListItem] = await paginate_keyset(
+            collection=files,
+            query_filter=filter,
+            sort_field="date_created",
+            direction=direction,
+            projection=projection,
+            transformer=self._file_list_item,
+        )
+
+        return page
+
+    def _file_list_item(self, document: Dict) -> s_file.FileListItem:
+        """Builds a file list item with its download link from a document"""
+        file = s_file.FileListItem(**document)
+
+        if file.restrict_access:
+            file.download_link = f"/api/v1/files/{file.id}/download"
+        elif file.restrict_access is not None:
+            file.download_link = (
+                f"/api/v1/files/{file.id}/unrestricted/download"
+            )
+
+        return file
+
+    async def file_verify_record(self, filter: Dict) -> s_file.File:
         """
         Gets a file record using the filter
         and raises an error if a matching record is not found
         """
 
-        file = self.file_get_record(filter)
+        file = await self.file_get_record(filter)
 
         if file is None:
             raise HTTPException(
@@ -347,41 +811,639 @@ class MongoStorage:
 
         return file
 
-    def file_get_data(self, file_id: str) -> bytes:
+    async def file_get_data(self, file_id: str) -> bytes:
         """Gets the data of a file"""
 
-        file = storage.file_verify_record({"_id": file_id})
+        file = await self.file_verify_record({"_id": file_id})
+        reader = await self.file_open_data(file.gridfs_id, file.backend)
+        async with closing_reader(reader):
+            data = await reader.read()
+            count_read(reader, len(data))
 
-        return self.fs.get(file_id=ObjectId(file.gridfs_id)).read()
-
-    def file_update_record(self, filter: Dict, update: Dict):
-        """Updates a file record"""
-        self.file_verify_record(filter)
+        return data
 
+    async def file_open_data(
+        self, gridfs_id: str, backend: Optional[str] = None
+    ) -> BlobReader:
+        """
+        Opens a stream over the data of a file. The other engines are
+        tried when the data is not in backend, as a migration may have
+        moved it since the record was read.
+        """
+        preferred = self.blob_stores[backend or GridFSStore.name]
+        others = [
+            store
+            for store in self.blob_stores.values()
+            if store is not preferred
+        ]
+
+        for store in [preferred, *others]:
+            try:
+                return await store.open(gridfs_id)
+            except BlobNotFound:
+                continue
+
+        raise BlobNotFound(gridfs_id)
+
+    async def file_update_record(
+        self, filter: Dict, update: Dict
+    ) -> s_file.File:
+        """Updates a file record and returns the updated file"""
         for key in ["_id", "user_id", "project_id", "gridfs_id"]:
             if key in update:
                 raise KeyError(f"Invalid Key. KEY {key} cannot be changed")
-        update["date_modified"] = datetime.now(UTC)
-
-        self.db["files"].update_one(filter, {"$set": update})
 
-    def file_advanced_update_record(self, filter: Dict, update: Dict):
-        """Updates a file record with more complex parameters"""
-        self.file_verify_record(filter)
+        return await self.file_advanced_update_record(filter, {"$set": update})
 
+    async def file_advanced_update_record(
+        self, filter: Dict, update: Dict
+    ) -> s_file.File:
+        """
+        Updates a file record with more complex parameters
+        and returns the updated file
+        """
         if "$set" in update:
             update["$set"]["date_modified"] = datetime.now(UTC)
         else:
             update["$set"] = {"date_modified": datetime.now(UTC)}
 
-        return self.db["files"].update_one(filter, update)
+        if "_id" in filter and type(filter["_id"]) is str:
+            filter["_id"] = ObjectId(filter["_id"])
+
+        file = await self.db["files"].find_one_and_update(
+            filter, update, return_document=ReturnDocument.AFTER
+        )
+
+        if file is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found",
+            )
+
+        return self._file_with_link(file)
+
+    async def file_delete_record(self, filter: Dict) -> s_file.File:
+        """Deletes a file record and returns the deleted file"""
+        if "_id" in filter and type(filter["_id"]) is str:
+            filter["_id"] = ObjectId(filter["_id"])
+
+        file = await self.db["files"].find_one_and_delete(filter)
+
+        if file is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found",
+            )
+
+        await self.file_usage_release([file])
+        file = self._file_with_link(file)
+        await self.blob_release_record(file.gridfs_id)
 
-    def file_delete_record(self, filter: Dict):
-        """Deletes a file record"""
-        file = self.file_verify_record(filter)
+        return file
+
+    # blobs
+    async def blob_create_record(
+        self, source: UploadFile, max_size: Optional[int] = None
+    ) -> Dict:
+        """
+        Stores the data in source as a blob keyed by its SHA-256 hash.
+        If a blob with the same content exists its reference count is
+        incremented instead, and no data is written.
+
+        Returns:
+            The blob document with its hash as _id, gridfs_id and size
+        """
+        blobs = self.db["blobs"]
+
+        checksum = hashlib.sha256()
+        size = 0
+        while chunk := await source.read(settings.UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail="File too large",
+                )
+            checksum.update(chunk)
+        sha256 = checksum.hexdigest()
+
+        gridfs_id = None
+        try:
+            for _ in range(settings.BLOB_CREATE_ATTEMPTS):
+                # blobs whose count reached 0 are being deleted
+                blob = await blobs.find_one_and_update(
+                    {"_id": sha256, "ref_count": {"$gt": 0}},
+                    {"$inc": {"ref_count": 1}},
+                    return_document=ReturnDocument.AFTER,
+                )
+                if blob:
+                    return blob
+
+                if gridfs_id is None:
+                    await source.seek(0)
+                    gridfs_id = await self.blob_store.put(
+                        source.file, sha256, metadata={"sha256": sha256}
+                    )
+
+                blob = {
+                    "_id": sha256,
+                    "gridfs_id": gridfs_id,
+                    "backend": self.blob_store.name,
+                    "size": size,
+                    "ref_count": 1,
+                    "date_created": datetime.now(UTC),
+                }
+                try:
+                    await blobs.insert_one(blob)
+                except DuplicateKeyError:
+                    # take over a blob left behind at a count of 0
+                    old = await blobs.find_one_and_replace(
+                        {"_id": sha256, "ref_count": {"$lte": 0}}, blob
+                    )
+                    if old:
+                        gridfs_id = None
+                        # the releaser's delete is guarded on the old
+                        # gridfs_id, so it no longer removes that data
+                        if old["gridfs_id"] != blob["gridfs_id"]:
+                            await self.blob_delete_data([old["gridfs_id"]])
+                        return blob
+                    continue
+
+                gridfs_id = None
+                return blob
+        finally:
+            if gridfs_id is not None:
+                await self.blob_store.delete([gridfs_id])
+
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="File is being modified by another request",
+        )
+
+    async def blob_release_record(self, gridfs_id: str):
+        """
+        Drops a reference to a blob and removes its data once no file
+        refers to it anymore
+        """
+        await self.blob_release_records([gridfs_id])
+
+    async def blob_release_records(self, gridfs_ids: List[str]):
+        """
+        Drops one blob reference per entry of gridfs_ids and removes,
+        in bulk, the data no file refers to anymore
+        """
+        if not gridfs_ids:
+            return
+
+        blobs = self.db["blobs"]
+        references = Counter(gridfs_ids)
+
+        shared = [
+            blob["gridfs_id"]
+            async for blob in blobs.find(
+                {"gridfs_id": {"$in": list(references)}}, {"gridfs_id": 1}
+            )
+        ]
+        # data stored before blobs were shared has a single owner
+        unused = [id for id in references if id not in shared]
+
+        if shared:
+            await blobs.bulk_write(
+                [
+                    UpdateOne(
+                        {"gridfs_id": id},
+                        {"$inc": {"ref_count": -references[id]}},
+                    )
+                    for id in shared
+                ],
+                ordered=False,
+            )
+
+            released = [
+                blob
+                async for blob in blobs.find(
+                    {"gridfs_id": {"$in": shared}, "ref_count": {"$lte": 0}}
+                )
+            ]
+            # only the caller that removes the blob record removes its data
+            results = await asyncio.gather(
+                *[
+                    blobs.delete_one(
+                        {
+                            "_id": blob["_id"],
+                            "gridfs_id": blob["gridfs_id"],
+                            "ref_count": {"$lte": 0},
+                        }
+                    )
+                    for blob in released
+                ]
+            )
+            unused.extend(
+                blob["gridfs_id"]
+                for blob, result in zip(released, results)
+                if result.deleted_count
+            )
+
+        await self.blob_delete_data(unused)
+
+    async def blob_delete_data(self, gridfs_ids: List[str]):
+        """
+        Deletes blob data, and the image variants rendered from it,
+        from every engine in bulk
+        """
+        if not gridfs_ids:
+            return
+
+        variants = self.db["variants"]
+        variant_filter = {"source_id": {"$in": list(gridfs_ids)}}
+        variant_ids = [
+            variant["gridfs_id"]
+            async for variant in variants.find(
+                variant_filter, {"gridfs_id": 1}
+            )
+        ]
+        await variants.delete_many(variant_filter)
+
+        ids = [*gridfs_ids, *variant_ids]
+        blob_cache.discard(ids)
+        for store in self.blob_stores.values():
+            await store.delete(ids)
+
+    # variants
+    async def variant_get_record(
+        self, source_id: str, name: str, format: str
+    ) -> Optional[Dict]:
+        """Gets a stored variant of the image in a blob"""
+        return await self.db["variants"].find_one(
+            {"source_id": source_id, "name": name, "format": format}
+        )
+
+    async def variant_create_record(
+        self,
+        source_id: str,
+        name: str,
+        format: str,
+        content: bytes,
+        media_type: str,
+    ) -> Dict:
+        """
+        Stores a rendered variant of the image in a blob.
+        If another process stored the same variant first, that one is
+        kept and returned.
+        """
+        gridfs_id = await self.blob_store.put(
+            content,
+            f"{source_id}-{name}.{format}",
+            metadata={"source_id": source_id, "media_type": media_type},
+        )
+
+        variant = {
+            "source_id": source_id,
+            "name": name,
+            "format": format,
+            "gridfs_id": gridfs_id,
+            "backend": self.blob_store.name,
+            "media_type": media_type,
+            "size": len(content),
+            "date_created": datetime.now(UTC),
+        }
+
+        try:
+            variant["_id"] = (
+                await self.db["variants"].insert_one(variant)
+            ).inserted_id
+        except DuplicateKeyError:
+            await self.blob_store.delete([gridfs_id])
+            return await self.variant_get_record(source_id, name, format)
+        except BaseException:
+            await self.blob_store.delete([gridfs_id])
+            raise
+
+        return variant
+
+    # deletions
+    async def deletion_create_record(self, kind: str, filter: Dict) -> str:
+        """
+        Creates a deletion job for the user or project matching the filter.
+        The job is recorded before the root record is deleted so its files
+        are still removed if the process dies in between. It is leased to
+        the caller until handed over with deletion_release_record, so the
+        worker only takes it over if the caller dies before that.
+        """
+        date = datetime.now(UTC)
+        job = {
+            "kind": kind,
+            "filter": filter,
+            "target_id": None,
+            "status": "running",
+            "lease_until": date
+            + timedelta(seconds=settings.DELETION_LEASE_SECONDS),
+            "date_created": date,
+            "date_modified": date,
+        }
+
+        id = str((await self.db["deletions"].insert_one(job)).inserted_id)
+
+        return id
+
+    async def deletion_update_record(self, id: str, data: Dict):
+        """Updates a deletion job"""
+        data["date_modified"] = datetime.now(UTC)
+
+        await self.db["deletions"].update_one(
+            {"_id": ObjectId(id)}, {"$set": data}
+        )
+
+    async def deletion_release_record(self, id: str, target_id: str):
+        """Hands a deletion job over to the worker once its root is deleted"""
+        await self.deletion_update_record(
+            id,
+            {"target_id": target_id, "status": "pending", "lease_until": None},
+        )
+
+    async def deletion_delete_record(self, id: str):
+        """Deletes a deletion job"""
+        await self.db["deletions"].delete_one({"_id": ObjectId(id)})
+
+    async def deletion_claim_record(self) -> Optional[Dict]:
+        """
+        Claims a deletion job that is pending or whose worker died.
+        The job is leased for DELETION_LEASE_SECONDS and the lease must be
+        renewed with deletion_renew_record while the job runs.
+        """
+        date = datetime.now(UTC)
+
+        return await self.db["deletions"].find_one_and_update(
+            {
+                "$or": [
+                    {"status": "pending"},
+                    {"status": "running", "lease_until": {"$lte": date}},
+                ]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "lease_until": date
+                    + timedelta(seconds=settings.DELETION_LEASE_SECONDS),
+                    "date_modified": date,
+                }
+            },
+            sort=[("date_created", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def deletion_renew_record(self, id: ObjectId):
+        """Extends the lease of a running deletion job"""
+        date = datetime.now(UTC)
+
+        await self.db["deletions"].update_one(
+            {"_id": id},
+            {
+                "$set": {
+                    "lease_until": date
+                    + timedelta(seconds=settings.DELETION_LEASE_SECONDS),
+                    "date_modified": date,
+                }
+            },
+        )
+
+    async def deletion_resolve_record(self, job: Dict) -> Optional[str]:
+        """
+        Gets the id of the record a deletion job removes, deleting the
+        record if the request that created the job did not get to it
+
+        Returns:
+            The id of the deleted record or None if it cannot be known
+        """
+        if job["target_id"] is not None:
+            return job["target_id"]
+
+        collection = {"user": "users", "project": "projects"}[job["kind"]]
+        root = await self.db[collection].find_one_and_delete(job["filter"])
+        if root is None:
+            return None
+
+        target_id = str(root["_id"])
+        await self.deletion_update_record(
+            str(job["_id"]), {"target_id": target_id}
+        )
+
+        return target_id
+
+    async def file_purge_records(self, filter: Dict, limit: int) -> int:
+        """
+        Deletes up to limit file records matching the filter and
+        releases their blobs in bulk
+
+        Returns:
+            The number of file records found
+        """
+        files = self.db["files"]
+
+        ids = [
+            file["_id"]
+            async for file in files.find(filter, {"_id": 1}).limit(limit)
+        ]
+        # blobs are released only for the files deleted here, so a file
+        # removed concurrently is not released twice
+        deleted = await asyncio.gather(
+            *[
+                files.find_one_and_delete(
+                    {"_id": id},
+                    {
+                        "gridfs_id": 1,
+                        "user_id": 1,
+                        "project_id": 1,
+                        "category": 1,
+                        "size": 1,
+                    },
+                )
+                for id in ids
+            ]
+        )
+        deleted = [file for file in deleted if file is not None]
+        await self.file_usage_release(deleted)
+        await self.blob_release_records(
+            [file["gridfs_id"] for file in deleted]
+        )
+
+        return len(ids)
+
+    async def project_purge_step(
+        self, project_id: str, user_id: Optional[str], limit: int
+    ) -> bool:
+        """
+        Deletes a batch of the files of a deleted project
+
+        Returns:
+            True once the project has no files left
+        """
+        filter = {"project_id": project_id}
+        if user_id is not None:
+            filter["user_id"] = user_id
+
+        if await self.file_purge_records(filter, limit):
+            return False
+
+        await self.db["projects"].delete_one({"_id": ObjectId(project_id)})
+
+        return True
+
+    async def user_purge_step(self, user_id: str, limit: int) -> bool:
+        """
+        Deletes a batch of the files of a deleted user, one project at
+        a time, removing each project once it is empty
+
+        Returns:
+            True once the user has no projects left
+        """
+        project = await self.db["projects"].find_one(
+            {"user_id": user_id}, {"_id": 1}
+        )
+        if project is None:
+            return True
+
+        await self.project_purge_step(str(project["_id"]), user_id, limit)
+
+        return False
+
+    # checkpoints
+    async def checkpoint_get_record(self, name: str) -> Optional[Dict]:
+        """Gets the saved progress of a resumable job"""
+        return await self.db["checkpoints"].find_one({"_id": name})
+
+    async def checkpoint_set_record(self, name: str, data: Dict):
+        """Saves the progress of a resumable job"""
+        data["date_modified"] = datetime.now(UTC)
+
+        await self.db["checkpoints"].update_one(
+            {"_id": name}, {"$set": data}, upsert=True
+        )
+
+    # outbox
+    async def outbox_create_record(
+        self, subject: str, body: str, receiver_email: str
+    ) -> str:
+        """Creates an outbox record for an email waiting to be sent"""
+        date = datetime.now(UTC)
+        message = {
+            "subject": subject,
+            "body": body,
+            "receiver_email": receiver_email,
+            "status": "pending",
+            "attempts": 0,
+            "last_error": None,
+            "next_attempt_at": date,
+            "lease_until": None,
+            "date_created": date,
+            "date_modified": date,
+        }
+
+        id = str((await self.db["outbox"].insert_one(message)).inserted_id)
+
+        return id
+
+    async def outbox_claim_records(self, limit: int) -> List[Dict]:
+        """
+        Claims up to limit outbox records that are due to be sent.
+        Claimed records are leased for MAIL_LEASE_SECONDS, after which
+        they can be claimed again if the claiming worker died.
+        """
+        outbox = self.db["outbox"]
+        messages = []
+
+        for _ in range(limit):
+            date = datetime.now(UTC)
+            message = await outbox.find_one_and_update(
+                {
+                    "$or": [
+                        {
+                            "status": "pending",
+                            "next_attempt_at": {"$lte": date},
+                        },
+                        {"status": "sending", "lease_until": {"$lte": date}},
+                    ]
+                },
+                {
+                    "$set": {
+                        "status": "sending",
+                        "lease_until": date
+                        + timedelta(seconds=settings.MAIL_LEASE_SECONDS),
+                        "date_modified": date,
+                    },
+                    "$inc": {"attempts": 1},
+                },
+                sort=[("next_attempt_at", ASCENDING)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if message is None:
+                break
+            messages.append(message)
+
+        return messages
+
+    async def outbox_complete_record(self, id: ObjectId):
+        """
+        Marks an outbox record as sent. Its body, which can hold links
+        carrying tokens, is dropped and the record expires after
+        MAIL_RETENTION_SECONDS.
+        """
+        date = datetime.now(UTC)
+
+        await self.db["outbox"].update_one(
+            {"_id": id},
+            {
+                "$set": {
+                    "status": "sent",
+                    "date_sent": date,
+                    "date_modified": date,
+                    "expire_at": date
+                    + timedelta(seconds=settings.MAIL_RETENTION_SECONDS),
+                },
+                "$unset": {"body": ""},
+            },
+        )
+
+    async def outbox_retry_record(
+        self, id: ObjectId, error: str, next_attempt_at: datetime
+    ):
+        """Puts an outbox record back in the queue after a failed send"""
+        await self.db["outbox"].update_one(
+            {"_id": id},
+            {
+                "$set": {
+                    "status": "pending",
+                    "last_error": error,
+                    "next_attempt_at": next_attempt_at,
+                    "date_modified": datetime.now(UTC),
+                }
+            },
+        )
+
+    async def outbox_fail_record(self, id: ObjectId, error: str):
+        """
+        Marks an outbox record as failed for good. Like a sent record,
+        it loses its body and expires after MAIL_RETENTION_SECONDS.
+        """
+        date = datetime.now(UTC)
+
+        await self.db["outbox"].update_one(
+            {"_id": id},
+            {
+                "$set": {
+                    "status": "failed",
+                    "last_error": error,
+                    "date_modified": date,
+                    "expire_at": date
+                    + timedelta(seconds=settings.MAIL_RETENTION_SECONDS),
+                },
+                "$unset": {"body": ""},
+            },
+        )
 
-        self.db["files"].delete_one(filter)
-        self.fs.delete(file_id=ObjectId(file.gridfs_id))
+    async def outbox_count_records(self, filter: Dict) -> int:
+        """Counts the outbox records matching the filter"""
+        return await self.db["outbox"].count_documents(filter)
 
 
 storage = MongoStorage()
@@ -0,0 +1,82 @@
+import re
+from typing import Dict, Optional, Pattern
+
+from core.config import settings
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from schemas.file import FileCategory
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CATEGORY_MAX_SIZES: Dict[FileCategory, int] = {
+    FileCategory.PROJECT_FILE: settings.PROJECT_FILE_MAX_SIZE,
+}
+
+# routes that take more than one file per request
+ROUTE_MAX_SIZES: Dict[Pattern, int] = {
+    re.compile(r"/projects/[^/]+/files/batch$"): (
+        settings.MAX_BATCH_UPLOAD_SIZE
+    ),
+}
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects request bodies larger than max_size with 413, or than the
+    limit of the first route_max_sizes pattern the path matches.
+    A declared Content-Length is checked before any of the body is read,
+    bodies without one are counted as they arrive.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_size: int = settings.MAX_UPLOAD_SIZE,
+        route_max_sizes: Optional[Dict[Pattern, int]] = None,
+    ) -> None:
+        self.app = app
+        self.max_size = max_size
+        self.route_max_sizes = (
+            ROUTE_MAX_SIZES if route_max_sizes is None else route_max_sizes
+        )
+
+    def _max_size(self, path: str) -> int:
+        for pattern, max_size in self.route_max_sizes.items():
+            if pattern.search(path):
+                return max_size
+        return self.max_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] not in (
+            "POST",
+            "PUT",
+            "PATCH",
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        max_size = self._max_size(scope["path"])
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > max_size:
+            response = JSONResponse(
+                {"detail": "Request body too large"},
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_size:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail="Request body too large",
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -1,13 +1,52 @@
-from api.v1.routers import file, forgot, health, login, project, register, user
+from contextlib import asynccontextmanager
+
+from api.v1.routers import (
+    admin,
+    file,
+    forgot,
+    health,
+    login,
+    project,
+    register,
+    user,
+)
+from core.authentication.hashing import shutdown_hash_pool
+from core.cache import blob_cache
 from core.config import settings
+from core.deletion import deletion_worker
+from core.images import shutdown_image_pool
+from core.mail.outbox import outbox
+from core.metrics import MetricsMiddleware
+from core.slow_queries import slow_query_log
+from core.storage import storage
+from core.upload import UploadSizeLimitMiddleware
 from fastapi import FastAPI, responses
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_pagination import add_pagination
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await blob_cache.index_disk()
+    outbox.start()
+    deletion_worker.start()
+    slow_query_log.start(storage.client)
+    yield
+    await slow_query_log.stop()
+    await deletion_worker.stop()
+    await outbox.stop()
+    shutdown_hash_pool()
+    shutdown_image_pool()
+
 
 app = FastAPI(
     title="Mannequins API",
     version=settings.releaseId,
+    lifespan=lifespan,
 )
+app.add_middleware(UploadSizeLimitMiddleware)
+
 origins = ["*"]
 app.add_middleware(
     CORSMiddleware,
@@ -16,8 +55,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-add_pagination(app)
+# outermost, so the time spent in the other middleware is counted
+app.add_middleware(MetricsMiddleware)
 
 
 app.include_router(health.router, tags=["health"], prefix=settings.API_V1_STR)
@@ -35,12 +74,24 @@ app.include_router(
 
 app.include_router(file.router, tags=["file"], prefix=settings.API_V1_STR)
 
+app.include_router(admin.router, tags=["admin"], prefix=settings.API_V1_STR)
+
+# after the routers, so their pages are set up without the lifespan running
+add_pagination(app)
+
 
 @app.get("/", include_in_schema=False)
 async def index() -> responses.RedirectResponse:
     return responses.RedirectResponse(url="/docs")
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics() -> responses.Response:
+    return responses.Response(
+        generate_latest(), media_type=CONTENT_TYPE_LATEST
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
 
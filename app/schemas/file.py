@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 from schemas.base import PyObjectId
@@ -19,6 +19,21 @@ class FileMetadata(BaseModel):
     restrict_access: bool = True
 
 
+class FileField(str, Enum):
+    GRIDFS_ID = "gridfs_id"
+    BACKEND = "backend"
+    FILENAME = "filename"
+    USER_ID = "user_id"
+    PROJECT_ID = "project_id"
+    GROUP = "group"
+    CATEGORY = "category"
+    RESTRICT_ACCESS = "restrict_access"
+    SIZE = "size"
+    SHA256 = "sha256"
+    DATE_CREATED = "date_created"
+    DATE_MODIFIED = "date_modified"
+
+
 class FileUpdate(BaseModel):
     filename: Optional[str] = None
     group: Optional[str] = None
@@ -28,12 +43,50 @@ class FileUpdate(BaseModel):
 class File(BaseModel):
     id: PyObjectId = Field(validation_alias="_id")
     gridfs_id: str
+    backend: Optional[str] = None
     filename: str
     user_id: str
     project_id: Optional[str] = None
     group: Optional[str] = None
     category: FileCategory
     restrict_access: bool
+    size: Optional[int] = None
+    sha256: Optional[str] = None
     download_link: Optional[str] = None
     date_created: datetime
     date_modified: datetime
+
+
+class FileListItem(BaseModel):
+    id: PyObjectId = Field(validation_alias="_id")
+    gridfs_id: Optional[str] = None
+    backend: Optional[str] = None
+    filename: Optional[str] = None
+    user_id: Optional[str] = None
+    project_id: Optional[str] = None
+    group: Optional[str] = None
+    category: Optional[FileCategory] = None
+    restrict_access: Optional[bool] = None
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    download_link: Optional[str] = None
+    date_created: Optional[datetime] = None
+    date_modified: Optional[datetime] = None
+
+
+class FileBatchItem(BaseModel):
+    filename: Optional[str] = None
+    status_code: int
+    file: Optional[File] = None
+    detail: Optional[str] = None
+
+
+class FileBatchResult(BaseModel):
+    created: int
+    failed: int
+    files: List[FileBatchItem]
+
+
+class SignedUrl(BaseModel):
+    url: str
+    expires_at: datetime
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 from schemas.base import PyObjectId
@@ -10,7 +10,10 @@ class Project(BaseModel):
     user_id: str
     name: str
     description: str
+    file_count: int = 0
     figure_count: int
+    bytes_used: int = 0
+    access_list: List[str] = []
     date_created: datetime
     date_modified: datetime
 
@@ -23,3 +26,7 @@ class ProjectIn(BaseModel):
 class ProjectUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
+
+
+class ProjectShare(BaseModel):
+    email: str
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -10,6 +12,7 @@ class TokenData(BaseModel):
     id: str
     email: str
     type: str
+    exp: Optional[int] = None
 
 
 class EmailVerificationToken(BaseModel):
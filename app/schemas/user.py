@@ -61,7 +61,9 @@ class User(BaseModel):
     status: UserStatus = UserStatus.ENABLED
     sign_in_type: SignInType = "NORMAL"
     verified: bool
+    file_count: int = 0
     figure_count: int
+    bytes_used: int = 0
     date_created: datetime
     date_modified: datetime
 
@@ -74,6 +76,8 @@ class UserOut(BaseModel):
     status: Optional[UserStatus] = UserStatus.ENABLED
     sign_in_type: Optional[SignInType] = "NORMAL"
     verified: bool
+    file_count: int = 0
     figure_count: int
+    bytes_used: int = 0
     date_created: datetime
     date_modified: datetime
@@ -0,0 +1,68 @@
+from datetime import UTC, datetime
+from typing import Callable, Iterator
+
+import pytest
+from bson.objectid import ObjectId
+from core.blobstore import LocalStore
+from core.cache import caches
+from core.storage import storage
+from schemas.user import User
+from tests.fake_mongo import FakeDatabase
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path) -> Iterator[FakeDatabase]:
+    """Points storage at an in-memory database and a local blob store"""
+    database = FakeDatabase(
+        unique_keys={"users": ["email"], "blobs": ["gridfs_id"]}
+    )
+    store = LocalStore(str(tmp_path / "blobs"), chunk_size=4)
+    monkeypatch.setattr(storage, "db", database)
+    monkeypatch.setattr(storage, "blob_stores", {store.name: store})
+    monkeypatch.setattr(storage, "blob_store", store)
+
+    for name in ("token", "user", "permission", "count"):
+        caches[name].clear()
+    yield database
+    for name in ("token", "user", "permission", "count"):
+        caches[name].clear()
+
+
+@pytest.fixture
+def make_user(db) -> Callable[..., User]:
+    """Adds a verified user to the database"""
+
+    def make(email: str = "owner@example.com", **fields) -> User:
+        date = datetime.now(UTC)
+        document = {
+            "_id": ObjectId(),
+            "username": email.split("@")[0],
+            "email": email,
+            "password": "",
+            "role": "user",
+            "verified": True,
+            "status": "enabled",
+            "file_count": 0,
+            "figure_count": 0,
+            "bytes_used": 0,
+            "date_created": date,
+            "date_modified": date,
+            **fields,
+        }
+        db["users"].documents.append(document)
+        return User(**document)
+
+    return make
+
+
+@pytest.fixture
+def login_as():
+    """Overrides the authenticated user of the API app"""
+    from core.authentication.auth_middleware import get_current_user
+    from main import app
+
+    def login(user: User):
+        app.dependency_overrides[get_current_user] = lambda: user
+
+    yield login
+    app.dependency_overrides.clear()
@@ -0,0 +1,547 @@
+"""
+In-memory stand-in for the parts of motor the storage layer uses, so
+storage code can be tested without a mongod. Supports the query and
+update operators MongoStorage issues, not the full query language.
+"""
+
+import copy
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson.objectid import ObjectId
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+MISSING = object()
+
+
+def _get(document: Dict, key: str) -> Any:
+    value: Any = document
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+
+    return value
+
+
+def _set(document: Dict, key: str, value: Any):
+    *parents, last = key.split(".")
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[last] = value
+
+
+def _unset(document: Dict, key: str):
+    *parents, last = key.split(".")
+    for part in parents:
+        document = document.get(part, {})
+    document.pop(last, None)
+
+
+def _equals(value: Any, expected: Any) -> bool:
+    if value is MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+
+    return value == expected
+
+
+def _compare(value: Any, operator: str, argument: Any) -> bool:
+    if operator == "$eq":
+        return _equals(value, argument)
+    if operator == "$ne":
+        return not _equals(value, argument)
+    if operator == "$in":
+        return any(_equals(value, item) for item in argument)
+    if operator == "$nin":
+        return not any(_equals(value, item) for item in argument)
+    if operator == "$exists":
+        return (value is not MISSING) == bool(argument)
+    if operator == "$not":
+        return not _matches_value(value, argument)
+
+    comparisons = {
+        "$gt": lambda a, b: a > b,
+        "$gte": lambda a, b: a >= b,
+        "$lt": lambda a, b: a < b,
+        "$lte": lambda a, b: a <= b,
+    }
+    if operator not in comparisons:
+        raise NotImplementedError(operator)
+
+    values = value if isinstance(value, list) else [value]
+    for item in values:
+        # like mongo, only values of a comparable type match
+        if item is MISSING or item is None:
+            continue
+        try:
+            if comparisons[operator](item, argument):
+                return True
+        except TypeError:
+            continue
+
+    return False
+
+
+def _is_operator_dict(condition: Any) -> bool:
+    return (
+        isinstance(condition, dict)
+        and bool(condition)
+        and all(key.startswith("$") for key in condition)
+    )
+
+
+def _matches_value(value: Any, condition: Any) -> bool:
+    if _is_operator_dict(condition):
+        return all(
+            _compare(value, operator, argument)
+            for operator, argument in condition.items()
+        )
+
+    return _equals(value, condition)
+
+
+def matches(document: Dict, filter: Optional[Dict]) -> bool:
+    """Checks whether a document matches a query filter"""
+    for key, condition in (filter or {}).items():
+        if key == "$or":
+            if not any(matches(document, branch) for branch in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, branch) for branch in condition):
+                return False
+        elif not _matches_value(_get(document, key), condition):
+            return False
+
+    return True
+
+
+def apply_update(document: Dict, update: Dict, inserting: bool = False):
+    """Applies update operators to a document in place"""
+    for operator, fields in update.items():
+        for key, argument in fields.items():
+            current = _get(document, key)
+            if operator == "$set":
+                _set(document, key, copy.deepcopy(argument))
+            elif operator == "$setOnInsert":
+                if inserting:
+                    _set(document, key, copy.deepcopy(argument))
+            elif operator == "$unset":
+                _unset(document, key)
+            elif operator == "$inc":
+                base = 0 if current is MISSING else current
+                _set(document, key, base + argument)
+            elif operator == "$addToSet":
+                items = [] if current is MISSING else current
+                if argument not in items:
+                    items.append(argument)
+                _set(document, key, items)
+            elif operator == "$push":
+                items = [] if current is MISSING else current
+                items.append(argument)
+                _set(document, key, items)
+            elif operator == "$pull":
+                if current is not MISSING:
+                    _set(
+                        document,
+                        key,
+                        [
+                            item
+                            for item in current
+                            if not _matches_value(item, argument)
+                        ],
+                    )
+            else:
+                raise NotImplementedError(operator)
+
+
+def _sort_keys(sort: Any) -> List:
+    if sort is None:
+        return []
+    if isinstance(sort, dict):
+        return list(sort.items())
+    if isinstance(sort, str):
+        return [(sort, 1)]
+
+    return list(sort)
+
+
+def sort_documents(documents: List[Dict], sort: Any) -> List[Dict]:
+    """Sorts documents by a mongo sort specification"""
+    documents = list(documents)
+    # stable sorts applied from the least to the most significant key
+    for key, direction in reversed(_sort_keys(sort)):
+
+        def sort_key(document, key=key):
+            value = _get(document, key)
+            missing = value is MISSING or value is None
+            return (not missing, None if missing else value)
+
+        documents.sort(key=sort_key, reverse=direction < 0)
+
+    return documents
+
+
+def project(document: Dict, projection: Optional[Dict]) -> Dict:
+    """Applies an inclusion or exclusion projection to a document"""
+    document = copy.deepcopy(document)
+    if not projection:
+        return document
+
+    included = [key for key, value in projection.items() if value]
+    if included:
+        projected = {key: document[key] for key in included if key in document}
+        if projection.get("_id", 1) and "_id" in document:
+            projected["_id"] = document["_id"]
+        return projected
+
+    for key, value in projection.items():
+        if not value:
+            document.pop(key, None)
+
+    return document
+
+
+def evaluate(document: Dict, expression: Any) -> Any:
+    """Evaluates the aggregation expressions MongoStorage uses"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get(document, expression[1:])
+        return None if value is MISSING else value
+    if not isinstance(expression, dict):
+        return expression
+
+    [(operator, arguments)] = expression.items()
+    values = [evaluate(document, argument) for argument in arguments]
+    if operator == "$eq":
+        return values[0] == values[1]
+    if operator == "$cond":
+        return values[1] if values[0] else values[2]
+    if operator == "$ifNull":
+        return values[1] if values[0] is None else values[0]
+
+    raise NotImplementedError(operator)
+
+
+def group(documents: List[Dict], spec: Dict) -> List[Dict]:
+    """Applies a $group stage whose accumulators are all $sum"""
+    groups: Dict[Any, Dict] = {}
+    for document in documents:
+        key = evaluate(document, spec["_id"])
+        result = groups.setdefault(key, {"_id": key})
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            [(operator, expression)] = accumulator.items()
+            if operator != "$sum":
+                raise NotImplementedError(operator)
+            result[field] = result.get(field, 0) + evaluate(
+                document, expression
+            )
+
+    return list(groups.values())
+
+
+class FakeCursor:
+    def __init__(self, documents: List[Dict], projection: Optional[Dict]):
+        self._documents = documents
+        self._projection = projection
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key: Any, direction: Optional[int] = None):
+        if direction is not None:
+            key = [(key, direction)]
+        self._documents = sort_documents(self._documents, key)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def _results(self) -> List[Dict]:
+        documents = self._documents[self._skip :]
+        if self._limit:
+            documents = documents[: self._limit]
+        return [project(document, self._projection) for document in documents]
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict]:
+        results = self._results()
+        return results if length is None else results[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._results():
+            yield document
+
+
+class FakeCollection:
+    """A collection held in a list, unique on _id and unique_keys"""
+
+    def __init__(self, name: str, unique_keys: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documents: List[Dict] = []
+        self.unique_keys = list(unique_keys)
+        # as index_information reports them, not enforced
+        self.indexes: Dict[str, Dict] = {}
+
+    def _find(self, filter: Optional[Dict], sort: Any = None) -> List[Dict]:
+        found = [doc for doc in self.documents if matches(doc, filter)]
+        return sort_documents(found, sort) if sort else found
+
+    def _check_unique(self, document: Dict, ignore: Optional[Dict] = None):
+        for key in ["_id", *self.unique_keys]:
+            value = _get(document, key)
+            if value is MISSING:
+                continue
+            for other in self.documents:
+                if other is not ignore and _get(other, key) == value:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: "
+                        f"{self.name} index: {key}"
+                    )
+
+    def _insert(self, document: Dict) -> Any:
+        # like pymongo, the _id is added to the caller's document
+        document.setdefault("_id", ObjectId())
+        stored = copy.deepcopy(document)
+        self._check_unique(stored)
+        self.documents.append(stored)
+        return document["_id"]
+
+    def _update(
+        self, filter: Dict, update: Dict, upsert: bool, sort: Any = None
+    ):
+        """Updates the first match, returning it before and after"""
+        found = self._find(filter, sort)
+        if found:
+            target = found[0]
+            before = copy.deepcopy(target)
+            updated = copy.deepcopy(target)
+            apply_update(updated, update)
+            self._check_unique(updated, ignore=target)
+            target.clear()
+            target.update(updated)
+            return before, target, None
+
+        if not upsert:
+            return None, None, None
+
+        document = {
+            key: value
+            for key, value in filter.items()
+            if not key.startswith("$") and not _is_operator_dict(value)
+        }
+        apply_update(document, update, inserting=True)
+        id = self._insert(document)
+        return None, self.documents[-1], id
+
+    async def insert_one(self, document: Dict) -> SimpleNamespace:
+        return SimpleNamespace(inserted_id=self._insert(document))
+
+    async def insert_many(
+        self, documents: List[Dict], ordered: bool = True
+    ) -> SimpleNamespace:
+        ids, errors = [], []
+        for index, document in enumerate(documents):
+            try:
+                ids.append(self._insert(document))
+            except DuplicateKeyError as ex:
+                errors.append({"index": index, "code": 11000, "errmsg": ex})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError(
+                {"writeErrors": errors, "nInserted": len(ids)}
+            )
+
+        return SimpleNamespace(inserted_ids=ids)
+
+    async def find_one(
+        self,
+        filter: Optional[Dict] = None,
+        projection: Optional[Dict] = None,
+        sort: Any = None,
+    ) -> Optional[Dict]:
+        found = self._find(filter, sort)
+        return project(found[0], projection) if found else None
+
+    def find(
+        self,
+        filter: Optional[Dict] = None,
+        projection: Optional[Dict] = None,
+        sort: Any = None,
+    ) -> FakeCursor:
+        cursor = FakeCursor(self._find(filter), projection)
+        return cursor.sort(sort) if sort else cursor
+
+    async def find_one_and_update(
+        self,
+        filter: Dict,
+        update: Dict,
+        projection: Optional[Dict] = None,
+        sort: Any = None,
+        upsert: bool = False,
+        return_document: bool = ReturnDocument.BEFORE,
+    ) -> Optional[Dict]:
+        before, after, _ = self._update(filter, update, upsert, sort)
+        document = after if return_document == ReturnDocument.AFTER else before
+        return None if document is None else project(document, projection)
+
+    async def find_one_and_replace(
+        self,
+        filter: Dict,
+        replacement: Dict,
+        projection: Optional[Dict] = None,
+        sort: Any = None,
+        return_document: bool = ReturnDocument.BEFORE,
+    ) -> Optional[Dict]:
+        found = self._find(filter, sort)
+        if not found:
+            return None
+
+        target = found[0]
+        before = copy.deepcopy(target)
+        replaced = copy.deepcopy(replacement)
+        replaced["_id"] = target["_id"]
+        self._check_unique(replaced, ignore=target)
+        target.clear()
+        target.update(replaced)
+
+        document = (
+            target if return_document == ReturnDocument.AFTER else before
+        )
+        return project(document, projection)
+
+    async def find_one_and_delete(
+        self,
+        filter: Dict,
+        projection: Optional[Dict] = None,
+        sort: Any = None,
+    ) -> Optional[Dict]:
+        found = self._find(filter, sort)
+        if not found:
+            return None
+
+        self.documents.remove(found[0])
+        return project(found[0], projection)
+
+    async def update_one(
+        self, filter: Dict, update: Dict, upsert: bool = False
+    ) -> SimpleNamespace:
+        before, after, upserted_id = self._update(filter, update, upsert)
+        return SimpleNamespace(
+            matched_count=int(before is not None),
+            modified_count=int(before is not None and before != after),
+            upserted_id=upserted_id,
+        )
+
+    async def update_many(
+        self, filter: Dict, update: Dict, upsert: bool = False
+    ) -> SimpleNamespace:
+        found = self._find(filter)
+        for document in found:
+            apply_update(document, update)
+        return SimpleNamespace(
+            matched_count=len(found), modified_count=len(found)
+        )
+
+    async def delete_one(self, filter: Dict) -> SimpleNamespace:
+        found = self._find(filter)
+        if found:
+            self.documents.remove(found[0])
+        return SimpleNamespace(deleted_count=int(bool(found)))
+
+    async def delete_many(self, filter: Dict) -> SimpleNamespace:
+        found = self._find(filter)
+        for document in found:
+            self.documents.remove(document)
+        return SimpleNamespace(deleted_count=len(found))
+
+    async def bulk_write(
+        self, requests: List[Any], ordered: bool = True
+    ) -> SimpleNamespace:
+        # unaffected by tests patching the single document methods
+        modified = 0
+        for request in requests:
+            if isinstance(request, UpdateOne):
+                result = await FakeCollection.update_one(
+                    self, request._filter, request._doc, bool(request._upsert)
+                )
+                modified += result.modified_count
+            elif isinstance(request, DeleteOne):
+                await FakeCollection.delete_one(self, request._filter)
+            elif isinstance(request, InsertOne):
+                await FakeCollection.insert_one(self, request._doc)
+            else:
+                raise NotImplementedError(type(request).__name__)
+
+        return SimpleNamespace(acknowledged=True, modified_count=modified)
+
+    def aggregate(self, pipeline: List[Dict]) -> FakeCursor:
+        documents = copy.deepcopy(self.documents)
+        for stage in pipeline:
+            [(name, spec)] = stage.items()
+            if name == "$match":
+                documents = [doc for doc in documents if matches(doc, spec)]
+            elif name == "$group":
+                documents = group(documents, spec)
+            else:
+                raise NotImplementedError(name)
+
+        return FakeCursor(documents, None)
+
+    async def index_information(self) -> Dict[str, Dict]:
+        return {
+            "_id_": {"v": 2, "key": [("_id", 1)]},
+            **copy.deepcopy(self.indexes),
+        }
+
+    async def create_indexes(self, models: List[Any]) -> List[str]:
+        names = []
+        for model in models:
+            spec = copy.deepcopy(model.document)
+            name = spec.pop("name")
+            spec["key"] = list(spec["key"].items())
+            self.indexes[name] = {"v": 2, **spec}
+            names.append(name)
+        return names
+
+    async def drop_index(self, name: str):
+        del self.indexes[name]
+
+    async def count_documents(self, filter: Dict) -> int:
+        return len(self._find(filter))
+
+    async def estimated_document_count(self) -> int:
+        return len(self.documents)
+
+
+class FakeDatabase:
+    """A database of FakeCollections, created on first use"""
+
+    def __init__(self, unique_keys: Optional[Dict[str, List[str]]] = None):
+        self.collections: Dict[str, FakeCollection] = {}
+        self.unique_keys = unique_keys or {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(
+                name, self.unique_keys.get(name, ())
+            )
+        return self.collections[name]
+
+    async def command(self, command: str, value: Any = 1, **kwargs) -> Dict:
+        if command == "collMod" and "index" in kwargs:
+            index = dict(kwargs["index"])
+            self[value].indexes[index.pop("name")].update(index)
+            return {"ok": 1.0}
+
+        raise NotImplementedError(command)
@@ -0,0 +1,114 @@
+import asyncio
+import io
+import zipfile
+from datetime import datetime
+
+import main
+from core.archive import ArchiveEntry, ZipStream, archive_name
+from core.blobstore import LocalBlobReader
+from core.storage import storage
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+from schemas.file import FileCategory, FileMetadata
+from schemas.project import ProjectIn
+
+
+def _build(tmp_path, contents, zip64_limit=0xFFFFFFFF):
+    entries = []
+    for i, data in enumerate(contents):
+        path = tmp_path / str(i)
+        path.write_bytes(data)
+
+        async def open_data(path=str(path)):
+            return LocalBlobReader(path, chunk_size=3)
+
+        entries.append(
+            ArchiveEntry(
+                name=f"{i}.png",
+                size=len(data),
+                date=datetime(2024, 5, 6, 7, 8, 10),
+                open_data=open_data,
+            )
+        )
+    stream = ZipStream(entries, zip64_limit=zip64_limit)
+
+    async def collect():
+        return b"".join([chunk async for chunk in stream])
+
+    return stream, asyncio.run(collect())
+
+
+def test_zip_stream_matches_announced_size(tmp_path) -> None:
+    contents = [b"first image", b"", b"\x89PNG" * 100]
+
+    stream, data = _build(tmp_path, contents)
+
+    assert len(data) == stream.size()
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert [archive.read(f"{i}.png") for i in range(3)] == contents
+        info = archive.getinfo("0.png")
+        assert info.compress_type == zipfile.ZIP_STORED
+        assert info.date_time == (2024, 5, 6, 7, 8, 10)
+
+
+def test_zip_stream_zip64_fields(tmp_path) -> None:
+    contents = [b"a" * 20, b"b" * 5, b"c" * 30]
+
+    # entries, offsets and the directory past the limit all need ZIP64
+    stream, data = _build(tmp_path, contents, zip64_limit=16)
+
+    assert len(data) == stream.size()
+    assert b"PK\x06\x06" in data
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert [archive.read(f"{i}.png") for i in range(3)] == contents
+
+
+def test_archive_name() -> None:
+    taken = set()
+
+    assert archive_name("plot.png", taken) == "plot.png"
+    assert archive_name("Plot.png", taken) == "Plot (1).png"
+    assert archive_name("plot.png", taken) == "plot (2).png"
+    assert archive_name("../etc/passwd", taken) == "_/etc/passwd"
+    assert archive_name("/", taken) == "file"
+    assert archive_name("a\\b", taken) == "a_b"
+
+
+def test_project_archive_is_hidden_from_strangers(
+    db, make_user, login_as
+) -> None:
+    owner = make_user()
+    friend = make_user("friend@example.com")
+    stranger = make_user("stranger@example.com")
+    project_id = asyncio.run(
+        storage.project_create_record(ProjectIn(name="Thesis"), owner.id)
+    )
+    asyncio.run(
+        storage.file_create_record(
+            UploadFile(io.BytesIO(b"figure"), filename="figure.png"),
+            FileMetadata(
+                filename="figure.png",
+                user_id=owner.id,
+                project_id=project_id,
+                category=FileCategory.PROJECT_FILE,
+            ),
+        )
+    )
+    db["projects"].documents[0]["access_list"] = [friend.id]
+    api = TestClient(main.app)
+    url = f"/api/v1/projects/{project_id}/files/archive"
+
+    for user in (owner, friend):
+        login_as(user)
+        response = api.get(url)
+        assert response.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            assert archive.namelist() == ["figure.png"]
+
+    login_as(stranger)
+    for method in ("GET", "HEAD"):
+        response = api.request(method, url)
+        assert response.status_code == 404
+        assert "Content-Disposition" not in response.headers
@@ -0,0 +1,42 @@
+import os
+
+from benchmarks.compare import compare
+from benchmarks.latency import percentile
+from benchmarks.suite import read_rss
+
+
+def test_percentile() -> None:
+    samples = [float(i) for i in range(1, 101)]
+
+    assert percentile(samples, 50) == 50.0
+    assert percentile(samples, 99) == 99.0
+    assert percentile([], 95) == 0.0
+
+
+def test_compare_flags_regressions() -> None:
+    baseline = {
+        "download": {"throughput": 100, "p95_ms": 20, "errors": 0},
+        "login": {"throughput": 10, "p95_ms": 300, "peak_rss_mb": None},
+    }
+    current = {
+        "download": {"throughput": 85, "p95_ms": 21, "errors": 2},
+        "login": {"throughput": 12, "p95_ms": 360, "peak_rss_mb": 120},
+    }
+
+    regressed = {
+        (change.scenario, change.metric)
+        for change in compare(baseline, current, threshold=10)
+        if change.regressed
+    }
+
+    assert regressed == {
+        ("download", "throughput"),
+        ("download", "errors"),
+        ("login", "p95_ms"),
+    }
+
+
+def test_read_rss() -> None:
+    rss = read_rss(os.getpid())
+
+    assert rss is None or rss > 0
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from bson.objectid import ObjectId
+from core.blob_migration import migrate_blobs
+from core.blobstore import LocalStore
+from core.storage import storage
+
+
+class SourceStore(LocalStore):
+    """A second engine for the blobs to be moved out of"""
+
+    name = "gridfs"
+
+
+@pytest.fixture
+def source(db, monkeypatch, tmp_path) -> SourceStore:
+    store = SourceStore(str(tmp_path / "source"), chunk_size=4)
+    monkeypatch.setitem(storage.blob_stores, store.name, store)
+    return store
+
+
+def add_blob(db, store, data: bytes) -> str:
+    gridfs_id = asyncio.run(store.put(data, "name"))
+    db["blobs"].documents.append(
+        {"_id": f"sha-{gridfs_id}", "gridfs_id": gridfs_id, "ref_count": 1}
+    )
+    db["files"].documents.append({"_id": ObjectId(), "gridfs_id": gridfs_id})
+    return gridfs_id
+
+
+def stored(store, gridfs_id: str):
+    return asyncio.run(store.stat(gridfs_id))
+
+
+def backends(db):
+    return {
+        collection: [
+            document.get("backend") for document in db[collection].documents
+        ]
+        for collection in ("blobs", "files")
+    }
+
+
+def test_migrate_blobs_moves_data(db, source) -> None:
+    target = storage.blob_stores["local"]
+    ids = [add_blob(db, source, data) for data in (b"first", b"second")]
+    db["variants"].documents.append(
+        {"_id": ObjectId(), "gridfs_id": ids[1], "backend": "gridfs"}
+    )
+
+    report = asyncio.run(migrate_blobs("local"))
+
+    assert report == {"moved": 2, "deleted": 0, "failed": 0}
+    assert [stored(target, id) for id in ids] == [5, 6]
+    assert [stored(source, id) for id in ids] == [None, None]
+    assert backends(db) == {
+        "blobs": ["local", "local"],
+        "files": ["local", "local"],
+    }
+    assert db["variants"].documents[0]["backend"] == "local"
+
+
+def test_failed_copy_keeps_the_source(db, source, monkeypatch) -> None:
+    target = storage.blob_stores["local"]
+    gridfs_id = add_blob(db, source, b"figure")
+    put = target.put
+
+    async def truncating(data, filename, metadata=None, id=None):
+        return await put(data[:3], filename, metadata, id)
+
+    monkeypatch.setattr(target, "put", truncating)
+
+    report = asyncio.run(migrate_blobs("local"))
+
+    assert report == {"moved": 0, "deleted": 0, "failed": 1}
+    assert stored(source, gridfs_id) == 6
+    assert stored(target, gridfs_id) is None
+    assert backends(db) == {"blobs": [None], "files": [None]}
+
+
+def test_interrupted_migration_is_resumed(db, source) -> None:
+    target = storage.blob_stores["local"]
+    ids = sorted(add_blob(db, source, b"figure") for _ in range(3))
+
+    assert asyncio.run(migrate_blobs("local", limit=1))["moved"] == 1
+    # stopped after copying the next blob, before its records were moved
+    asyncio.run(target.put(b"figure", "name", id=ids[1]))
+
+    report = asyncio.run(migrate_blobs("local"))
+
+    assert report == {"moved": 2, "deleted": 0, "failed": 0}
+    assert [stored(target, id) for id in ids] == [6, 6, 6]
+    assert [stored(source, id) for id in ids] == [None, None, None]
+    assert asyncio.run(migrate_blobs("local"))["moved"] == 0
@@ -0,0 +1,57 @@
+import asyncio
+import hashlib
+import io
+
+from core.storage import storage
+from fastapi import UploadFile
+
+
+def upload(data: bytes) -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename="figure.png")
+
+
+def test_identical_uploads_share_a_blob(db) -> None:
+    first = asyncio.run(storage.blob_create_record(upload(b"figure")))
+    second = asyncio.run(storage.blob_create_record(upload(b"figure")))
+
+    assert second["gridfs_id"] == first["gridfs_id"]
+    assert second["ref_count"] == 2
+    assert len(db["blobs"].documents) == 1
+    assert first["_id"] == hashlib.sha256(b"figure").hexdigest()
+
+
+def test_release_to_zero_deletes_the_data(db) -> None:
+    blob = asyncio.run(storage.blob_create_record(upload(b"figure")))
+    asyncio.run(storage.blob_create_record(upload(b"figure")))
+    gridfs_id = blob["gridfs_id"]
+
+    asyncio.run(storage.blob_release_record(gridfs_id))
+
+    assert db["blobs"].documents[0]["ref_count"] == 1
+    assert asyncio.run(storage.blob_store.stat(gridfs_id)) == 6
+
+    asyncio.run(storage.blob_release_record(gridfs_id))
+
+    assert db["blobs"].documents == []
+    assert asyncio.run(storage.blob_store.stat(gridfs_id)) is None
+
+
+def test_blob_left_at_zero_is_taken_over(db) -> None:
+    old = asyncio.run(storage.blob_create_record(upload(b"figure")))
+    # a releaser dropped the last reference but has not deleted it yet
+    db["blobs"].documents[0]["ref_count"] = 0
+
+    blob = asyncio.run(storage.blob_create_record(upload(b"figure")))
+
+    assert blob["gridfs_id"] != old["gridfs_id"]
+    assert db["blobs"].documents == [blob]
+    assert asyncio.run(storage.blob_store.stat(blob["gridfs_id"])) == 6
+    assert asyncio.run(storage.blob_store.stat(old["gridfs_id"])) is None
+
+    # the releaser's guarded delete leaves the new blob alone
+    result = asyncio.run(
+        db["blobs"].delete_one(
+            {"_id": old["_id"], "gridfs_id": old["gridfs_id"]}
+        )
+    )
+    assert result.deleted_count == 0
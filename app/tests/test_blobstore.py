@@ -0,0 +1,52 @@
+import asyncio
+import io
+import os
+
+import pytest
+from core.blobstore import BlobNotFound, BlobStore, LocalStore
+
+
+def test_local_store_round_trip(tmp_path) -> None:
+    store = LocalStore(str(tmp_path), chunk_size=4)
+
+    async def round_trip():
+        id = await store.put(io.BytesIO(b"0123456789"), "name")
+        with await store.open(id) as reader:
+            reader.seek(6)
+            chunk = await reader.readchunk()
+        return id, reader, chunk
+
+    id, reader, chunk = asyncio.run(round_trip())
+    length = reader.length
+    assert reader._file.closed
+
+    assert length == 10
+    assert chunk == b"6789"
+    assert store.path(id) == os.path.join(str(tmp_path), id[-2:], id)
+    assert asyncio.run(store.stat(id)) == 10
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+def test_local_store_put_with_id_and_delete(tmp_path) -> None:
+    store = LocalStore(str(tmp_path), chunk_size=4)
+    id = "65a1b2c3d4e5f6a7b8c9d0e1"
+
+    assert asyncio.run(store.put(b"data", "name", id=id)) == id
+    assert asyncio.run(store.stat(id)) == 4
+
+    asyncio.run(store.delete([id, id]))
+
+    assert asyncio.run(store.stat(id)) is None
+    with pytest.raises(BlobNotFound):
+        asyncio.run(store.open(id))
+
+
+def test_incomplete_store_cannot_be_made() -> None:
+    class WriteOnlyStore(BlobStore):
+        name = "write-only"
+
+        async def put(self, source, filename, metadata=None, id=None):
+            return id
+
+    with pytest.raises(TypeError, match="delete, open, stat"):
+        WriteOnlyStore()
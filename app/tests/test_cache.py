@@ -0,0 +1,191 @@
+import asyncio
+import time
+
+from core.cache import BlobCache, TTLCache
+
+
+def test_ttl_cache_get_set() -> None:
+    cache = TTLCache(maxsize=2, ttl=60)
+
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_ttl_cache_evicts_least_recently_used() -> None:
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_ttl_cache_expiry() -> None:
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=0.01)
+    cache.set("b", 2, ttl=-1)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_pop() -> None:
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+
+    assert cache.pop("a") == 1
+    assert cache.pop("a") is None
+
+
+class _GridOut:
+    def __init__(self, data: bytes) -> None:
+        self.length = len(data)
+        self._chunks = [data[i : i + 4] for i in range(0, len(data), 4)]
+        self.reads = 0
+        self.closed = False
+
+    async def read(self) -> bytes:
+        self.reads += 1
+        return b"".join(self._chunks)
+
+    async def readchunk(self) -> bytes:
+        self.reads += 1
+        return self._chunks.pop(0) if self._chunks else b""
+
+    def close(self):
+        self.closed = True
+
+
+def _blob_cache(directory) -> BlobCache:
+    return BlobCache(
+        directory=str(directory),
+        memory_size=16,
+        memory_item_size=8,
+        disk_size=32,
+        disk_item_size=20,
+    )
+
+
+def test_blob_cache_tiers(tmp_path) -> None:
+    cache = _blob_cache(tmp_path)
+
+    opened = []
+
+    async def load(key, data):
+        async def open_data():
+            opened.append(_GridOut(data))
+            return opened[-1]
+
+        return await cache.load(key, open_data)
+
+    small = asyncio.run(load("a1", b"small"))
+    assert small.data == b"small"
+
+    large = asyncio.run(load("b2", b"0123456789abcdef"))
+    assert large.data is None
+    with open(large.path, "rb") as handle:
+        assert handle.read() == b"0123456789abcdef"
+
+    # too large to cache, so the opened stream is handed back
+    huge = asyncio.run(load("c3", b"x" * 21))
+    assert (huge.size, huge.data, huge.path) == (21, None, None)
+    assert huge.reader.reads == 0
+    # only the streams that were read in are closed
+    assert [reader.closed for reader in opened] == [True, True, False]
+    assert cache.get("c3") is None
+
+    assert cache.get("a1").data == b"small"
+    assert cache.get("b2").size == 16
+    assert cache.stats()["hits"] == 2
+
+    # a new cache picks up the disk tier
+    assert _blob_cache(tmp_path).get("b2").path == large.path
+
+
+def test_blob_cache_coalesces_misses(tmp_path) -> None:
+    cache = _blob_cache(tmp_path)
+    opened = []
+
+    async def open_data():
+        opened.append(1)
+        await asyncio.sleep(0.01)
+        return _GridOut(b"data")
+
+    async def load_many():
+        return await asyncio.gather(
+            *[cache.load("d4", open_data) for _ in range(5)]
+        )
+
+    blobs = asyncio.run(load_many())
+
+    assert len(opened) == 1
+    assert all(blob.data == b"data" for blob in blobs)
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_blob_cache_evicts_by_size(tmp_path) -> None:
+    cache = _blob_cache(tmp_path)
+
+    cache._store_memory("a", b"12345678")
+    cache._store_memory("b", b"12345678")
+    cache.get("a")
+    cache._store_memory("c", b"12345678")
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["memory_evictions"] == 1
+
+    cache.discard(["a"])
+    assert cache.get("a") is None
+
+
+def test_blob_cache_hands_back_one_stream(tmp_path) -> None:
+    cache = _blob_cache(tmp_path)
+    opened = []
+
+    async def open_data():
+        opened.append(1)
+        await asyncio.sleep(0.01)
+        return _GridOut(b"x" * 21)
+
+    async def load_many():
+        return await asyncio.gather(
+            *[cache.load("e5", open_data) for _ in range(3)]
+        )
+
+    first, *others = asyncio.run(load_many())
+
+    assert len(opened) == 1
+    assert first.reader is not None
+    assert others == [None, None]
+
+
+def test_blob_cache_indexes_disk_off_the_loop(tmp_path, monkeypatch) -> None:
+    shard = tmp_path / "f6"
+    shard.mkdir()
+    (shard / "00f6").write_bytes(b"data")
+    cache = _blob_cache(tmp_path)
+    threads = []
+    to_thread = asyncio.to_thread
+
+    async def recording(func, *args):
+        threads.append(func)
+        return await to_thread(func, *args)
+
+    monkeypatch.setattr(asyncio, "to_thread", recording)
+
+    asyncio.run(cache.index_disk())
+
+    assert threads == [cache._disk_index]
+    assert cache.stats()["disk_bytes"] == 4
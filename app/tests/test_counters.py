@@ -0,0 +1,76 @@
+import asyncio
+
+from bson.objectid import ObjectId
+from core.counters import ZERO, repair_counters
+from core.storage import MongoStorage
+from schemas.file import FileCategory
+
+
+def test_file_usage() -> None:
+    file = {"category": FileCategory.PROJECT_FILE, "size": 120}
+
+    assert MongoStorage.file_usage(file) == {
+        "file_count": 1,
+        "figure_count": 1,
+        "bytes_used": 120,
+    }
+    assert MongoStorage.file_usage(file, sign=-1) == {
+        "file_count": -1,
+        "figure_count": -1,
+        "bytes_used": -120,
+    }
+
+
+def test_file_usage_without_size() -> None:
+    file = {"category": FileCategory.PROJECT_FILE.value, "size": None}
+
+    assert MongoStorage.file_usage(file)["bytes_used"] == 0
+
+
+def test_repair_counters_corrects_drift(db, make_user) -> None:
+    owner = make_user(file_count=5, figure_count=5, bytes_used=999)
+    # stored before the counters existed
+    other = make_user("other@example.com")
+    for field in ZERO:
+        del db["users"].documents[-1][field]
+    make_user("idle@example.com", file_count=2, bytes_used=10)
+    project_id = ObjectId()
+    db["projects"].documents.append(
+        {"_id": project_id, "file_count": 0, "figure_count": 1}
+    )
+    files = [
+        (owner.id, str(project_id), FileCategory.PROJECT_FILE.value, 100),
+        (owner.id, str(project_id), "other", 20),
+        (owner.id, None, "other", None),
+        (other.id, None, FileCategory.PROJECT_FILE.value, 7),
+    ]
+    for user_id, file_project_id, category, size in files:
+        db["files"].documents.append(
+            {
+                "_id": ObjectId(),
+                "user_id": user_id,
+                "project_id": file_project_id,
+                "category": category,
+                "size": size,
+            }
+        )
+
+    report = asyncio.run(repair_counters(db))
+
+    def counters(collection):
+        return [
+            {field: document.get(field) for field in ZERO}
+            for document in db[collection].documents
+        ]
+
+    assert counters("users") == [
+        {"file_count": 3, "figure_count": 1, "bytes_used": 120},
+        {"file_count": 1, "figure_count": 1, "bytes_used": 7},
+        ZERO,
+    ]
+    assert counters("projects") == [
+        {"file_count": 2, "figure_count": 1, "bytes_used": 120}
+    ]
+    assert report == {"users": 3, "projects": 1}
+    # counters that are right are left alone
+    assert asyncio.run(repair_counters(db)) == {"users": 0, "projects": 0}
@@ -0,0 +1,119 @@
+import asyncio
+import io
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+from core.config import settings
+from core.deletion import DeletionWorker
+from core.storage import storage
+from fastapi import UploadFile
+from schemas.file import FileCategory, FileMetadata
+from schemas.project import ProjectIn
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "DELETION_BATCH_SIZE", 2)
+    monkeypatch.setattr(settings, "DELETION_BATCH_DELAY", 0)
+
+
+def make_project(user_id: str, files: int, name: str = "Thesis") -> str:
+    async def create():
+        project_id = await storage.project_create_record(
+            ProjectIn(name=name), user_id
+        )
+        for i in range(files):
+            await storage.file_create_record(
+                UploadFile(io.BytesIO(f"{name} {i}".encode())),
+                FileMetadata(
+                    filename=f"figure{i}.png",
+                    user_id=user_id,
+                    project_id=project_id,
+                    category=FileCategory.PROJECT_FILE,
+                ),
+            )
+        return project_id
+
+    return asyncio.run(create())
+
+
+def run_worker(worker: DeletionWorker) -> int:
+    async def run():
+        jobs = 0
+        while (job := await storage.deletion_claim_record()) is not None:
+            await worker._process(job)
+            jobs += 1
+        return jobs
+
+    return asyncio.run(run())
+
+
+def test_deleted_project_is_purged_in_batches(db, make_user) -> None:
+    user = make_user()
+    project_id = make_project(user.id, files=5)
+    make_project(user.id, files=1, name="Other")
+
+    asyncio.run(storage.project_delete_record({"_id": project_id}))
+
+    [job] = db["deletions"].documents
+    assert (job["status"], job["target_id"]) == ("pending", project_id)
+    assert job["lease_until"] is None
+
+    worker = DeletionWorker()
+    assert run_worker(worker) == 1
+
+    assert worker.batches == 4
+    assert db["deletions"].documents == []
+    assert [file["filename"] for file in db["files"].documents] == [
+        "figure0.png"
+    ]
+    assert len(db["blobs"].documents) == 1
+    user_doc = db["users"].documents[0]
+    assert (user_doc["file_count"], user_doc["bytes_used"]) == (1, 7)
+
+
+def test_deleted_user_is_purged(db, make_user) -> None:
+    user = make_user()
+    make_project(user.id, files=3)
+    make_project(user.id, files=1, name="Other")
+
+    asyncio.run(storage.user_delete_record({"_id": user.id}))
+    run_worker(DeletionWorker())
+
+    for collection in ("users", "projects", "files", "blobs", "deletions"):
+        assert db[collection].documents == []
+
+
+def test_job_is_leased_until_its_root_is_deleted(db, make_user) -> None:
+    user = make_user()
+    project_id = make_project(user.id, files=1)
+
+    # the request died between recording the job and deleting the project
+    asyncio.run(
+        storage.deletion_create_record(
+            "project", {"_id": ObjectId(project_id)}
+        )
+    )
+
+    assert asyncio.run(storage.deletion_claim_record()) is None
+    assert len(db["projects"].documents) == 1
+
+    job = db["deletions"].documents[0]
+    job["lease_until"] = datetime.now(UTC) - timedelta(seconds=1)
+
+    assert run_worker(DeletionWorker()) == 1
+    for collection in ("projects", "files", "deletions"):
+        assert db[collection].documents == []
+
+
+def test_running_job_is_not_claimed_twice(db, make_user) -> None:
+    user = make_user()
+    project_id = make_project(user.id, files=1)
+    asyncio.run(storage.project_delete_record({"_id": project_id}))
+
+    job = asyncio.run(storage.deletion_claim_record())
+
+    assert job["status"] == "running"
+    assert job["lease_until"] > datetime.now(UTC)
+    assert asyncio.run(storage.deletion_claim_record()) is None
@@ -0,0 +1,144 @@
+from datetime import datetime
+
+import pytest
+from core.blobstore import LocalBlobReader
+from core.download import (
+    BlobRangeResponse,
+    FileRangeResponse,
+    cache_headers,
+    if_range_matches,
+    is_not_modified,
+    parse_range_header,
+)
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+
+def test_parse_range_header() -> None:
+    assert parse_range_header(None, 100) is None
+    assert parse_range_header("bytes=0-9", 100) == [(0, 9)]
+    assert parse_range_header("bytes=90-", 100) == [(90, 99)]
+    assert parse_range_header("bytes=-10", 100) == [(90, 99)]
+    assert parse_range_header("bytes=50-500", 100) == [(50, 99)]
+    assert parse_range_header("bytes=0-1,5-6", 100) == [(0, 1), (5, 6)]
+
+
+def test_parse_range_header_ignores_malformed() -> None:
+    assert parse_range_header("items=0-9", 100) is None
+    assert parse_range_header("bytes=9-0", 100) is None
+    assert parse_range_header("bytes=a-b", 100) is None
+
+
+def test_parse_range_header_unsatisfiable() -> None:
+    with pytest.raises(HTTPException) as ex:
+        parse_range_header("bytes=100-", 100)
+
+    assert ex.value.status_code == 416
+    assert ex.value.headers["Content-Range"] == "bytes */100"
+
+
+def test_if_range_matches() -> None:
+    modified = datetime(2024, 8, 1, 12, 30, 15, 250000)
+
+    assert if_range_matches(None)
+    assert if_range_matches(
+        "Thu, 01 Aug 2024 12:30:15 GMT", last_modified=modified
+    )
+    assert not if_range_matches(
+        "Thu, 01 Aug 2024 12:30:16 GMT", last_modified=modified
+    )
+    assert if_range_matches('"abc"', etag='"abc"')
+    assert not if_range_matches('"abc"', last_modified=modified)
+
+
+def test_is_not_modified() -> None:
+    modified = datetime(2024, 1, 2, 3, 4, 5, 600000)
+    etag = '"abc"'
+
+    assert is_not_modified({"if-none-match": '"abc"'}, etag)
+    assert is_not_modified({"if-none-match": 'W/"abc", "def"'}, etag)
+    assert is_not_modified({"if-none-match": "*"}, etag)
+    assert not is_not_modified({"if-none-match": '"def"'}, etag)
+
+    since = "Tue, 02 Jan 2024 03:04:05 GMT"
+    assert is_not_modified({"if-modified-since": since}, etag, modified)
+    assert not is_not_modified(
+        {"if-modified-since": "Tue, 02 Jan 2024 03:04:04 GMT"},
+        etag,
+        modified,
+    )
+    # If-None-Match takes precedence over If-Modified-Since
+    assert not is_not_modified(
+        {"if-none-match": '"def"', "if-modified-since": since},
+        etag,
+        modified,
+    )
+    assert not is_not_modified({}, etag, modified)
+
+
+def test_cache_headers() -> None:
+    modified = datetime(2024, 1, 2, 3, 4, 5)
+
+    headers = cache_headers('"abc"', modified, public=True)
+    assert headers["ETag"] == '"abc"'
+    assert headers["Last-Modified"] == "Tue, 02 Jan 2024 03:04:05 GMT"
+    assert "immutable" in headers["Cache-Control"]
+
+    headers = cache_headers('"abc"', modified, public=False)
+    assert headers["Cache-Control"] == "private, no-cache"
+
+
+def test_file_range_response(tmp_path) -> None:
+    path = tmp_path / "blob"
+    path.write_bytes(b"0123456789")
+
+    app = FastAPI()
+
+    @app.get("/blob")
+    async def get_blob():
+        return FileRangeResponse(
+            open(path, "rb"),
+            2,
+            5,
+            status_code=206,
+            headers={"Content-Length": "4"},
+            media_type="application/octet-stream",
+        )
+
+    response = TestClient(app).get("/blob")
+
+    assert response.status_code == 206
+    assert response.content == b"2345"
+
+
+def test_blob_range_response_closes_the_blob(tmp_path) -> None:
+    path = tmp_path / "blob"
+    path.write_bytes(b"0123456789")
+    readers = []
+
+    class FailingReader(LocalBlobReader):
+        async def readchunk(self) -> bytes:
+            raise IOError("connection lost")
+
+    app = FastAPI()
+
+    @app.get("/blob/{fail}")
+    async def get_blob(fail: bool):
+        reader_type = FailingReader if fail else LocalBlobReader
+        readers.append(reader_type(str(path), chunk_size=4))
+        return BlobRangeResponse(
+            readers[-1],
+            2,
+            7,
+            status_code=206,
+            headers={"Content-Length": "6"},
+            media_type="application/octet-stream",
+        )
+
+    client = TestClient(app, raise_server_exceptions=False)
+    response = client.get("/blob/false")
+    assert response.content == b"234567"
+    # the stream fails once the response has started
+    client.get("/blob/true")
+
+    assert [reader._file.closed for reader in readers] == [True, True]
@@ -0,0 +1,65 @@
+import asyncio
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from core.authentication import hashing
+from core.authentication.auth_middleware import authenticate_user
+from core.config import settings
+from fastapi import HTTPException
+from passlib.hash import bcrypt
+
+
+@pytest.fixture
+def thread_pool(monkeypatch):
+    # threads stand in for the spawned processes
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        monkeypatch.setattr(hashing, "get_hash_pool", lambda: pool)
+        yield pool
+
+
+def test_login_rehashes_an_outdated_hash(db, make_user, thread_pool) -> None:
+    outdated = bcrypt.using(rounds=4).hash("secret-password")
+    user = make_user(password=outdated)
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(authenticate_user(user.email, "wrong-password"))
+    assert raised.value.status_code == 401
+    assert db["users"].documents[0]["password"] == outdated
+
+    asyncio.run(authenticate_user(user.email, "secret-password"))
+
+    stored = db["users"].documents[0]["password"]
+    assert stored != outdated
+    assert stored.startswith(f"$2b${settings.BCRYPT_ROUNDS:02d}$")
+    assert bcrypt.verify("secret-password", stored)
+
+
+def test_hashing_sheds_load_past_the_queue_limit(
+    monkeypatch, thread_pool
+) -> None:
+    monkeypatch.setattr(settings, "HASH_QUEUE_LIMIT", 1)
+    monkeypatch.setattr(hashing, "_pending", 1)
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(hashing.hash_password("secret-password"))
+    assert raised.value.status_code == 503
+    assert raised.value.headers == {"Retry-After": "1"}
+
+    monkeypatch.setattr(hashing, "_pending", 0)
+    asyncio.run(hashing.hash_password("secret-password"))
+    assert hashing._pending == 0
+
+
+def test_hash_pool_imports_only_passlib() -> None:
+    # spawned pool processes import the module the functions live in
+    code = (
+        "import sys, core.authentication.bcrypt_hash; "
+        "print(sorted(m for m in sys.modules if m.startswith('core')))"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code], text=True)
+
+    assert output.strip() == (
+        "['core', 'core.authentication', 'core.authentication.bcrypt_hash']"
+    )
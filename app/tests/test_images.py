@@ -0,0 +1,97 @@
+import asyncio
+import io
+import subprocess
+import sys
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+from core import images
+from core.image_render import FALLBACK, render_variant
+from core.images import negotiate_format
+from core.storage import storage
+from fastapi import HTTPException
+from PIL import Image
+
+
+def test_negotiate_format() -> None:
+    chrome = "image/avif,image/webp,image/apng,image/*,*/*;q=0.8"
+
+    assert negotiate_format(chrome, ["avif", "webp"]) == "avif"
+    assert negotiate_format(chrome, ["webp", "avif"]) == "webp"
+    assert negotiate_format("image/webp;q=0, image/*", ["webp"]) == FALLBACK
+    assert negotiate_format("image/*,*/*;q=0.8", ["webp"]) == FALLBACK
+    assert negotiate_format(None, ["webp"]) == FALLBACK
+
+
+def _image(mode: str, size=(400, 200)) -> bytes:
+    output = io.BytesIO()
+    Image.new(mode, size).save(output, format="PNG")
+    return output.getvalue()
+
+
+def test_render_variant_fits_box() -> None:
+    content, media_type = render_variant(_image("RGB"), 100, "webp", 80)
+
+    assert media_type == "image/webp"
+    with Image.open(io.BytesIO(content)) as image:
+        assert image.format == "WEBP"
+        assert image.size == (100, 50)
+
+
+def test_render_variant_fallback_keeps_transparency() -> None:
+    _, media_type = render_variant(_image("RGBA"), 100, FALLBACK, 80)
+    assert media_type == "image/png"
+
+    _, media_type = render_variant(_image("RGB"), 100, FALLBACK, 80)
+    assert media_type == "image/jpeg"
+
+
+def test_image_pool_imports_only_pil() -> None:
+    # spawned pool processes import the module render_variant lives in
+    code = (
+        "import sys, core.image_render; "
+        "print(sorted(m for m in sys.modules if m.startswith('core')))"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code], text=True)
+
+    assert output.strip() == "['core', 'core.image_render']"
+
+
+def test_create_variants_goes_on_after_an_error(monkeypatch) -> None:
+    monkeypatch.setattr(images, "VARIANTS", {"small": 100, "large": 800})
+    monkeypatch.setattr(images, "FORMATS", ["webp"])
+    get_variant = AsyncMock(side_effect=[RuntimeError("busy"), {}])
+    monkeypatch.setattr(images, "get_variant", get_variant)
+    file = SimpleNamespace(gridfs_id="1", backend="local")
+
+    asyncio.run(images.create_variants(file))
+
+    assert [call.args[2] for call in get_variant.call_args_list] == [
+        "small",
+        "large",
+    ]
+
+
+def test_create_variant_closes_its_reader(db, monkeypatch) -> None:
+    gridfs_id = asyncio.run(storage.blob_store.put(b"not an image", "name"))
+    readers = []
+    open_data = storage.file_open_data
+
+    async def opening(*args):
+        readers.append(await open_data(*args))
+        return readers[-1]
+
+    async def unidentified(*args):
+        raise images.UnidentifiedImageError()
+
+    monkeypatch.setattr(storage, "file_open_data", opening)
+    monkeypatch.setattr(images, "_run_in_image_pool", unidentified)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(
+            images._create_variant(gridfs_id, "local", "thumbnail", "webp")
+        )
+
+    assert error.value.status_code == 415
+    assert readers[0]._file.closed
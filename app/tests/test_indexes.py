@@ -0,0 +1,94 @@
+import asyncio
+
+from core.indexes import (
+    INDEXES,
+    QUERY_SHAPES,
+    apply_indexes,
+    index_options,
+    plan_stages,
+)
+from pymongo import ASCENDING, IndexModel
+from tests.fake_mongo import FakeDatabase
+
+
+def test_plan_stages() -> None:
+    plan = {
+        "stage": "FETCH",
+        "inputStage": {
+            "stage": "OR",
+            "inputStages": [
+                {"stage": "IXSCAN"},
+                {"stage": "COLLSCAN"},
+            ],
+        },
+    }
+
+    assert list(plan_stages(plan)) == ["FETCH", "OR", "IXSCAN", "COLLSCAN"]
+    assert list(plan_stages({"queryPlan": {"stage": "IXSCAN"}})) == ["IXSCAN"]
+
+
+def test_query_shapes_target_indexed_collections() -> None:
+    for shape in QUERY_SHAPES:
+        assert shape.collection in INDEXES
+
+
+def apply(db, **kwargs):
+    report = asyncio.run(apply_indexes(db, **kwargs))
+    return {
+        (collection, action): names
+        for collection, result in report.items()
+        for action, names in result.items()
+        if names
+    }
+
+
+def test_apply_indexes_is_idempotent() -> None:
+    db = FakeDatabase()
+
+    created = apply(db)
+
+    assert created[("outbox", "created")] == [
+        "status_1_next_attempt_at_1",
+        "expire_at_1",
+    ]
+    assert {action for _, action in created} == {"created"}
+    assert db["outbox"].indexes["expire_at_1"]["expireAfterSeconds"] == 0
+    assert apply(db) == {}
+
+
+def test_apply_indexes_changes_options(monkeypatch) -> None:
+    db = FakeDatabase()
+    apply(db)
+    db["outbox"].indexes["stale"] = {"v": 2, "key": [("stale", 1)]}
+    outbox = [
+        IndexModel(
+            [("status", ASCENDING), ("next_attempt_at", ASCENDING)],
+            partialFilterExpression={"status": "pending"},
+        ),
+        IndexModel([("expire_at", ASCENDING)], expireAfterSeconds=60),
+    ]
+    monkeypatch.setitem(INDEXES, "outbox", outbox)
+
+    assert apply(db) == {
+        ("outbox", "modified"): ["expire_at_1"],
+        ("outbox", "rebuilt"): ["status_1_next_attempt_at_1"],
+        ("outbox", "unknown"): ["stale"],
+    }
+    indexes = db["outbox"].indexes
+    assert indexes["expire_at_1"]["expireAfterSeconds"] == 60
+    assert indexes["status_1_next_attempt_at_1"][
+        "partialFilterExpression"
+    ] == {"status": "pending"}
+
+    assert apply(db, prune=True) == {("outbox", "dropped"): ["stale"]}
+    assert apply(db) == {}
+
+
+def test_index_options_ignore_reported_fields() -> None:
+    declared = IndexModel([("email", ASCENDING)], unique=True)
+    reported = {"v": 2, "key": [("email", 1)], "unique": True}
+
+    assert index_options(reported) == index_options(declared.document)
+    assert index_options({**reported, "unique": False}) == index_options(
+        IndexModel([("email", ASCENDING)]).document
+    )
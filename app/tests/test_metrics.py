@@ -0,0 +1,89 @@
+import asyncio
+import io
+from datetime import timedelta
+
+from core.blobstore import LocalStore
+from core.metrics import (
+    CommandMetricsListener,
+    MetricsMiddleware,
+    current_route,
+)
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from pymongo import monitoring
+
+app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/items/{item_id}")
+async def item(item_id: str):
+    return {"id": item_id, "route": current_route()}
+
+
+client = TestClient(app)
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_requests_are_timed_by_route() -> None:
+    name = "http_request_duration_seconds_count"
+    route = {"method": "GET", "route": "/items/{item_id}", "status": "200"}
+    unmatched = {"method": "GET", "route": "unmatched", "status": "404"}
+    before = sample(name, **route), sample(name, **unmatched)
+
+    response = client.get("/items/1")
+    client.get("/items/2")
+    client.get("/missing")
+
+    assert sample(name, **route) == before[0] + 2
+    assert sample(name, **unmatched) == before[1] + 1
+    assert response.json()["route"] == "GET /items/{item_id}"
+    assert current_route() is None
+
+
+def test_commands_are_timed_by_collection() -> None:
+    listener = CommandMetricsListener()
+    name = "mongo_command_duration_seconds_count"
+    before = sample(name, command="getMore", collection="files")
+
+    address = ("localhost", 27017)
+    listener.started(
+        monitoring.CommandStartedEvent(
+            {"getMore": 1, "collection": "files"}, "db", 7, address, 1
+        )
+    )
+    listener.succeeded(
+        monitoring.CommandSucceededEvent(
+            timedelta(microseconds=1500), {"ok": 1}, "getMore", 7, address, 1
+        )
+    )
+
+    assert sample(name, command="getMore", collection="files") == before + 1
+    assert listener._collections == {}
+
+
+def test_blob_bytes_written_are_counted(tmp_path) -> None:
+    store = LocalStore(str(tmp_path), chunk_size=4)
+    before = sample("blob_bytes_written_total", backend="local")
+
+    source = io.BytesIO(b"skip0123456789")
+    source.seek(4)
+    asyncio.run(store.put(source, "name"))
+    asyncio.run(store.put(b"data", "name"))
+
+    assert sample("blob_bytes_written_total", backend="local") == before + 14
+
+
+def test_metrics_exposition() -> None:
+    from main import app as api
+
+    response = TestClient(api).get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "cache_hit_ratio" in response.text
+    assert "http_requests_in_progress" in response.text
@@ -0,0 +1,144 @@
+import asyncio
+import smtplib
+from datetime import UTC, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import pytest
+from core.config import settings
+from core.mail.outbox import MailOutbox
+from core.mail.smtp import SMTPSender
+
+
+class FakeSender:
+    """Stands in for the SMTP sender, failing as told"""
+
+    def __init__(self) -> None:
+        self.sent: List[Dict[str, Any]] = []
+        self.errors: List[Optional[Exception]] = []
+
+    def send_batch(self, messages: List[Dict]) -> List[Optional[Exception]]:
+        results = []
+        for message in messages:
+            error = self.errors.pop(0) if self.errors else None
+            if error is None:
+                self.sent.append(message)
+            results.append(error)
+        return results
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def outbox(db) -> MailOutbox:
+    outbox = MailOutbox()
+    outbox.sender = FakeSender()
+    return outbox
+
+
+def make_due(db) -> None:
+    for message in db["outbox"].documents:
+        message["next_attempt_at"] = datetime.now(UTC)
+
+
+def test_sent_messages_drop_their_body(db, outbox) -> None:
+    asyncio.run(outbox.enqueue("Reset", "<a>token</a>", "a@example.com"))
+
+    assert asyncio.run(outbox.send_due()) == 1
+    assert asyncio.run(outbox.send_due()) == 0
+
+    message = db["outbox"].documents[0]
+    assert outbox.sender.sent[0]["body"] == "<a>token</a>"
+    assert message["status"] == "sent"
+    assert "body" not in message
+    assert message["expire_at"] > datetime.now(UTC) + timedelta(days=6)
+
+
+def test_failed_sends_back_off_then_fail(db, outbox, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "MAIL_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "MAIL_RETRY_BASE_SECONDS", 30)
+    outbox.sender.errors = [smtplib.SMTPDataError(451, b"later")] * 3
+    asyncio.run(outbox.enqueue("Reset", "<a>token</a>", "a@example.com"))
+    message = db["outbox"].documents[0]
+
+    for attempt, delay in ((1, 30), (2, 60)):
+        before = datetime.now(UTC)
+        asyncio.run(outbox.send_due())
+
+        assert message["status"] == "pending"
+        assert message["attempts"] == attempt
+        wait = message["next_attempt_at"] - before
+        assert timedelta(seconds=delay) <= wait < timedelta(seconds=delay + 5)
+        # not due again until the backoff has passed
+        assert asyncio.run(outbox.send_due()) == 0
+        make_due(db)
+
+    asyncio.run(outbox.send_due())
+
+    assert message["status"] == "failed"
+    assert "451" in message["last_error"]
+    assert "body" not in message
+    assert (outbox.retried, outbox.failed, outbox.sent) == (2, 1, 0)
+
+
+def test_expired_lease_is_claimed_again(db, outbox) -> None:
+    now = datetime.now(UTC)
+    for email, lease_until in (
+        ("dead@example.com", now - timedelta(seconds=1)),
+        ("busy@example.com", now + timedelta(seconds=60)),
+    ):
+        asyncio.run(outbox.enqueue("Welcome", "hello", email))
+        db["outbox"].documents[-1].update(
+            status="sending", attempts=1, lease_until=lease_until
+        )
+
+    assert asyncio.run(outbox.send_due()) == 1
+
+    assert [m["receiver_email"] for m in outbox.sender.sent] == [
+        "dead@example.com"
+    ]
+    statuses = [message["status"] for message in db["outbox"].documents]
+    assert statuses == ["sent", "sending"]
+
+
+class FakeServer:
+    def __init__(self, fail: bool = False) -> None:
+        self.fail = fail
+        self.sent: List[str] = []
+        self.closed = False
+
+    def sendmail(self, sender: str, receiver: str, message: str):
+        if self.fail:
+            raise smtplib.SMTPServerDisconnected("gone")
+        self.sent.append(receiver)
+
+    def quit(self):
+        self.closed = True
+
+
+def test_sender_reconnects_when_disconnected(monkeypatch) -> None:
+    servers = [FakeServer(fail=True), FakeServer()]
+    connects = iter(servers)
+    sender = SMTPSender()
+    monkeypatch.setattr(sender, "_connect", lambda: next(connects))
+
+    sender.send("a@example.com", "message")
+    sender.send("b@example.com", "message")
+
+    assert servers[0].closed
+    assert servers[1].sent == ["a@example.com", "b@example.com"]
+
+
+def test_sender_reconnects_after_idle_timeout(monkeypatch) -> None:
+    servers = [FakeServer(), FakeServer()]
+    connects = iter(servers)
+    sender = SMTPSender()
+    monkeypatch.setattr(sender, "_connect", lambda: next(connects))
+    monkeypatch.setattr(settings, "SMTP_IDLE_TIMEOUT", 60)
+
+    sender.send("a@example.com", "message")
+    sender._last_used -= 61
+    sender.send("b@example.com", "message")
+
+    assert servers[0].closed
+    assert servers[1].sent == ["b@example.com"]
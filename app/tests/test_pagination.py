@@ -0,0 +1,85 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+from core.pagination import (
+    decode_keyset_cursor,
+    encode_keyset_cursor,
+    paginate_keyset,
+)
+from fastapi import HTTPException
+from fastapi_pagination.api import set_page
+from fastapi_pagination.cursor import CursorPage, CursorParams
+
+DATE = datetime(2024, 1, 1, tzinfo=UTC)
+
+
+def get_page(db, cursor=None, size=2, **kwargs):
+    async def paginate():
+        with set_page(CursorPage):
+            return await paginate_keyset(
+                db["projects"],
+                {},
+                "date_modified",
+                params=CursorParams(size=size, cursor=cursor),
+                **kwargs,
+            )
+
+    return asyncio.run(paginate())
+
+
+def test_cursor_round_trip() -> None:
+    id = ObjectId()
+
+    assert decode_keyset_cursor(encode_keyset_cursor(DATE, id)) == (DATE, id)
+
+
+@pytest.mark.parametrize(
+    "cursor", ["", "garbage", f"{DATE.isoformat()}|notanid", f"x|{ObjectId()}"]
+)
+def test_invalid_cursor(cursor) -> None:
+    with pytest.raises(HTTPException) as error:
+        decode_keyset_cursor(cursor)
+
+    assert error.value.status_code == 400
+
+
+def test_equal_dates_are_paged_by_id(db) -> None:
+    ids = sorted(ObjectId() for _ in range(5))
+    db["projects"].documents.extend(
+        {"_id": id, "date_modified": DATE} for id in ids
+    )
+    db["projects"].documents.append(
+        {"_id": ObjectId(), "date_modified": DATE - timedelta(days=1)}
+    )
+
+    seen, cursor = [], None
+    while True:
+        page = get_page(db, cursor)
+        seen.extend(item["_id"] for item in page.items)
+        cursor = page.next_page
+        if cursor is None:
+            break
+
+    assert seen == ids[::-1] + [db["projects"].documents[-1]["_id"]]
+
+
+def test_total_is_counted_once_per_listing(db, monkeypatch) -> None:
+    db["projects"].documents.extend(
+        {"_id": ObjectId(), "date_modified": DATE} for _ in range(3)
+    )
+    counts = []
+    count_documents = db["projects"].count_documents
+
+    async def counting(filter):
+        counts.append(filter)
+        return await count_documents(filter)
+
+    monkeypatch.setattr(db["projects"], "count_documents", counting)
+
+    first = get_page(db, include_total=True)
+    second = get_page(db, first.next_page, include_total=True)
+
+    assert first.total == second.total == 3
+    assert len(counts) == 1
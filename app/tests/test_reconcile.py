@@ -0,0 +1,181 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+from core.reconcile import Orphan, _repair, align, reconcile_gridfs
+from core.storage import storage
+
+
+async def _stream(*keys):
+    for key in keys:
+        yield key, {"key": key}
+
+
+async def _collect(*streams):
+    return [
+        (key, [document is not None for document in documents])
+        async for key, documents in align(*streams)
+    ]
+
+
+def test_align_merges_sorted_streams() -> None:
+    result = asyncio.run(
+        _collect(
+            _stream("a", "b", "d"),
+            _stream("b", "c"),
+            _stream("a", "a", "c", "d"),
+        )
+    )
+
+    assert result == [
+        ("a", [True, False, True]),
+        ("b", [True, True, False]),
+        ("c", [False, True, True]),
+        ("d", [True, False, True]),
+    ]
+
+
+def test_align_empty_streams() -> None:
+    assert asyncio.run(_collect(_stream(), _stream())) == []
+
+
+OLD = datetime.now(UTC) - timedelta(days=1)
+
+
+class FakeGridFS:
+    """Keeps blob data as the fs.files documents of the fake database"""
+
+    name = "gridfs"
+
+    def __init__(self, db) -> None:
+        self.db = db
+
+    async def delete(self, ids):
+        await self.db["fs.files"].delete_many(
+            {"_id": {"$in": [ObjectId(id) for id in ids]}}
+        )
+
+
+@pytest.fixture
+def gridfs(db, monkeypatch) -> FakeGridFS:
+    store = FakeGridFS(db)
+    monkeypatch.setattr(storage, "blob_stores", {store.name: store})
+    return store
+
+
+def add_data(db, date: datetime = OLD) -> str:
+    id = ObjectId()
+    db["fs.files"].documents.append({"_id": id, "uploadDate": date})
+    return str(id)
+
+
+def add_blob(db, gridfs_id: str, date: datetime = OLD) -> None:
+    db["blobs"].documents.append(
+        {
+            "_id": f"sha-{gridfs_id}",
+            "gridfs_id": gridfs_id,
+            "ref_count": 1,
+            "date_created": date,
+        }
+    )
+
+
+def add_file(db, gridfs_id: str) -> None:
+    db["files"].documents.append({"_id": ObjectId(), "gridfs_id": gridfs_id})
+
+
+def gridfs_ids(db, collection: str):
+    return sorted(
+        str(document.get("gridfs_id", document["_id"]))
+        for document in db[collection].documents
+    )
+
+
+def test_reconcile_classifies_and_repairs(db, gridfs) -> None:
+    referenced = add_data(db)
+    add_blob(db, referenced)
+    add_file(db, referenced)
+    unreferenced = add_data(db)
+    leaked = add_data(db)
+    add_blob(db, leaked)
+    dangling_blob = str(ObjectId())
+    add_blob(db, dangling_blob)
+    dangling_file = str(ObjectId())
+    add_file(db, dangling_file)
+    dangling_variant = str(ObjectId())
+    db["variants"].documents.append(
+        {"_id": ObjectId(), "gridfs_id": dangling_variant}
+    )
+    # still being uploaded
+    recent_data = add_data(db, datetime.now(UTC))
+    recent_blob = add_data(db)
+    add_blob(db, recent_blob, datetime.now(UTC))
+
+    orphans, last = asyncio.run(reconcile_gridfs())
+
+    assert last is None
+    assert sorted(orphans) == sorted(
+        [
+            Orphan("unreferenced_data", unreferenced, True),
+            Orphan("leaked_blob", leaked, True),
+            Orphan("dangling_blob", dangling_blob, True),
+            Orphan("dangling_file", dangling_file, False),
+            Orphan("dangling_variant", dangling_variant, True),
+        ]
+    )
+    assert gridfs_ids(db, "fs.files") == sorted(
+        [referenced, recent_data, recent_blob]
+    )
+    assert gridfs_ids(db, "blobs") == sorted([referenced, recent_blob])
+    assert gridfs_ids(db, "files") == sorted([referenced, dangling_file])
+    assert db["variants"].documents == []
+
+
+def test_dry_run_only_reports(db, gridfs) -> None:
+    unreferenced = add_data(db)
+
+    orphans, _ = asyncio.run(reconcile_gridfs(dry_run=True))
+
+    assert orphans == [Orphan("unreferenced_data", unreferenced)]
+    assert gridfs_ids(db, "fs.files") == [unreferenced]
+    assert db["checkpoints"].documents == []
+
+
+def test_reconcile_resumes_from_its_checkpoint(db, gridfs) -> None:
+    # dangling files are only reported, so they are found on every pass
+    ids = sorted(str(ObjectId()) for _ in range(3))
+    for id in ids:
+        add_file(db, id)
+
+    def scan(**kwargs):
+        orphans, last = asyncio.run(reconcile_gridfs(**kwargs))
+        return [orphan.gridfs_id for orphan in orphans], last
+
+    assert scan(limit=2) == (ids[:2], ids[1])
+    assert scan(limit=2) == (ids[2:], None)
+    # a finished scan starts over
+    assert scan(limit=2) == (ids[:2], ids[1])
+    assert scan(restart=True) == (ids, None)
+
+
+def test_repair_checks_again_before_deleting(db, gridfs) -> None:
+    data = add_data(db)
+    # referenced again since the scan read it
+    add_file(db, data)
+
+    assert not asyncio.run(
+        _repair(Orphan("unreferenced_data", data), None, None, None)
+    )
+
+    leaked = add_data(db)
+    add_blob(db, leaked)
+    scanned = dict(db["blobs"].documents[-1])
+    # a new upload of the same content took a reference meanwhile
+    db["blobs"].documents[-1]["ref_count"] = 2
+
+    assert not asyncio.run(
+        _repair(Orphan("leaked_blob", leaked), None, scanned, None)
+    )
+    assert gridfs_ids(db, "fs.files") == sorted([data, leaked])
+    assert gridfs_ids(db, "blobs") == [leaked]
@@ -0,0 +1,106 @@
+import asyncio
+
+import main
+from core.cache import permission_cache
+from core.storage import storage
+from fastapi.testclient import TestClient
+from schemas.project import ProjectIn
+
+api = TestClient(main.app)
+
+
+def create_project(user_id: str, name: str = "Thesis") -> str:
+    return asyncio.run(
+        storage.project_create_record(ProjectIn(name=name), user_id)
+    )
+
+
+def check_access(project_id: str, user_id: str) -> bool:
+    return asyncio.run(storage.project_check_access(project_id, user_id))
+
+
+def test_share_and_unshare(db, make_user, login_as) -> None:
+    owner = make_user()
+    friend = make_user("friend@example.com")
+    other = make_user("other@example.com")
+    project_id = create_project(owner.id)
+    url = f"/api/v1/projects/{project_id}/share"
+
+    assert not check_access(project_id, friend.id)
+
+    login_as(owner)
+    for user in (friend, other):
+        response = api.post(url, json={"email": user.email})
+        assert response.status_code == 200
+    response = api.get(f"/api/v1/projects/{project_id}")
+    assert response.json()["access_list"] == [friend.id, other.id]
+    assert api.post(url, json={"email": owner.email}).status_code == 400
+
+    # the cached denial was dropped when the project was shared
+    assert check_access(project_id, friend.id)
+
+    login_as(friend)
+    response = api.get("/api/v1/projects/shared")
+    assert response.status_code == 200
+    [project] = response.json()["items"]
+    assert project["id"] == project_id
+    assert "access_list" not in project
+
+    login_as(owner)
+    response = api.delete(f"{url}/{friend.id}")
+    assert response.status_code == 200
+    assert response.json()["access_list"] == [other.id]
+    assert not check_access(project_id, friend.id)
+
+    login_as(friend)
+    assert api.get("/api/v1/projects/shared").json()["items"] == []
+
+
+def test_access_check_is_cached(db, make_user, monkeypatch) -> None:
+    owner = make_user()
+    friend = make_user("friend@example.com")
+    project_id = create_project(owner.id)
+    asyncio.run(storage.project_share_record({"_id": project_id}, friend.id))
+    lookups = []
+    find_one = db["projects"].find_one
+
+    async def counting(*args, **kwargs):
+        lookups.append(args)
+        return await find_one(*args, **kwargs)
+
+    monkeypatch.setattr(db["projects"], "find_one", counting)
+
+    for _ in range(3):
+        assert check_access(project_id, owner.id)
+        assert check_access(project_id, friend.id)
+    assert len(lookups) == 2
+
+    asyncio.run(storage.project_delete_record({"_id": project_id}))
+
+    assert (owner.id, project_id) not in permission_cache._data
+    assert not check_access(project_id, owner.id)
+    assert not check_access(project_id, friend.id)
+
+
+def test_share_does_not_reveal_registered_emails(
+    db, make_user, login_as
+) -> None:
+    owner = make_user()
+    friend = make_user("friend@example.com")
+    project_id = create_project(owner.id)
+    url = f"/api/v1/projects/{project_id}/share"
+
+    login_as(owner)
+    known = api.post(url, json={"email": friend.email})
+    unknown = api.post(url, json={"email": "nobody@example.com"})
+
+    assert (unknown.status_code, unknown.json()) == (
+        known.status_code,
+        known.json(),
+    )
+    assert db["projects"].documents[0]["access_list"] == [friend.id]
+
+    # sharing someone else's project fails the same way for any email
+    login_as(friend)
+    for email in (owner.email, "nobody@example.com"):
+        assert api.post(url, json={"email": email}).status_code == 404
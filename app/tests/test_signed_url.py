@@ -0,0 +1,105 @@
+from urllib.parse import parse_qs, urlsplit
+
+import main
+import pytest
+from core.authentication import signed_url
+from core.authentication.signed_url import (
+    SignedDownload,
+    load_signing_keys,
+    signed_download_url,
+    verify_download,
+)
+from core.images import VARIANTS
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+FILE_ID = "65a1b2c3d4e5f6a7b8c9d0e1"
+GRIDFS_ID = "65a1b2c3d4e5f6a7b8c9d0e2"
+
+
+def _parse(url: str):
+    parts = urlsplit(url)
+    query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+    download = SignedDownload(
+        FILE_ID,
+        query["gridfs_id"],
+        query.get("backend"),
+        None,
+        int(query["expires"]),
+    )
+    return parts.path, download, query["key"], query["signature"]
+
+
+def test_load_signing_keys() -> None:
+    keys = load_signing_keys(" new:abc, old:def,broken", None)
+
+    assert list(keys) == ["new", "old"]
+    assert keys["new"] == b"abc"
+    assert list(load_signing_keys("", "secret")) == ["default"]
+    assert load_signing_keys("", None) == {}
+
+
+def test_signed_download_round_trip() -> None:
+    keys = {"new": b"abc"}
+
+    url, expires = signed_download_url(
+        FILE_ID, GRIDFS_ID, "local", ttl=60, keys=keys
+    )
+    path, download, key, signature = _parse(url)
+
+    assert path == f"/api/v1/files/{FILE_ID}/signed/download"
+    assert download.expires == expires
+    assert verify_download(download, key, signature, keys) == download
+    assert 0 < download.remaining() <= 60
+
+
+def test_signed_download_rejects_tampering() -> None:
+    keys = {"new": b"abc"}
+    url, _ = signed_download_url(FILE_ID, GRIDFS_ID, None, keys=keys)
+    _, download, key, signature = _parse(url)
+
+    for changed in [
+        download._replace(gridfs_id=FILE_ID),
+        download._replace(variant="thumbnail"),
+        download._replace(expires=download.expires + 1),
+    ]:
+        with pytest.raises(HTTPException) as error:
+            verify_download(changed, key, signature, keys)
+        assert error.value.status_code == 403
+
+    with pytest.raises(HTTPException):
+        verify_download(download, key, signature[:-1], keys)
+
+
+def test_signed_download_expires() -> None:
+    keys = {"new": b"abc"}
+    url, _ = signed_download_url(FILE_ID, GRIDFS_ID, None, ttl=-1, keys=keys)
+
+    with pytest.raises(HTTPException):
+        verify_download(*_parse(url)[1:], keys)
+
+
+def test_signed_download_key_rotation() -> None:
+    url, _ = signed_download_url(
+        FILE_ID, GRIDFS_ID, None, keys={"old": b"def"}
+    )
+    _, download, key, signature = _parse(url)
+
+    # links signed with a retired key stay valid while it is listed
+    rotated = {"new": b"abc", "old": b"def"}
+    assert verify_download(download, key, signature, rotated) == download
+
+    with pytest.raises(HTTPException):
+        verify_download(download, key, signature, {"new": b"abc"})
+
+
+def test_signed_download_of_missing_data(db, monkeypatch) -> None:
+    monkeypatch.setitem(signed_url.SIGNING_KEYS, "new", b"abc")
+    api = TestClient(main.app)
+
+    for variant in (None, next(iter(VARIANTS))):
+        url, _ = signed_download_url(FILE_ID, GRIDFS_ID, "local", variant)
+        response = api.get(url)
+
+        assert response.status_code == 404
+        assert response.json()["detail"] == "File data not found"
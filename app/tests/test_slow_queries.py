@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from core.slow_queries import SlowQueryLog, filter_shape, plan_summary
+from pymongo import monitoring
+
+ADDRESS = ("localhost", 27017)
+
+
+def run_command(
+    listener: SlowQueryLog, command: dict, reply: dict, millis: int
+) -> None:
+    name = next(iter(command))
+    listener.started(
+        monitoring.CommandStartedEvent(command, "db", 1, ADDRESS, 1)
+    )
+    listener.succeeded(
+        monitoring.CommandSucceededEvent(
+            timedelta(milliseconds=millis), reply, name, 1, ADDRESS, 1
+        )
+    )
+
+
+def test_filter_shape_redacts_values() -> None:
+    filter = {
+        "user_id": "alice",
+        "_id": {"$in": ["a", "b", "c"]},
+        "$or": [{"date": {"$lt": 5}}, {"date": 5, "_id": {"$lt": "x"}}],
+    }
+
+    assert filter_shape(filter) == {
+        "user_id": "?",
+        "_id": {"$in": ["?"]},
+        "$or": [{"date": {"$lt": "?"}}, {"date": "?", "_id": {"$lt": "?"}}],
+    }
+
+
+def test_plan_summary() -> None:
+    explain = {
+        "queryPlanner": {
+            "winningPlan": {
+                "stage": "LIMIT",
+                "inputStage": {
+                    "stage": "FETCH",
+                    "inputStage": {"stage": "IXSCAN", "indexName": "email_1"},
+                },
+            }
+        },
+        "executionStats": {
+            "nReturned": 1,
+            "totalDocsExamined": 1,
+            "totalKeysExamined": 1,
+        },
+    }
+
+    assert plan_summary(explain) == {
+        "stages": "LIMIT <- FETCH <- IXSCAN",
+        "indexes": ["email_1"],
+        "docs_examined": 1,
+        "keys_examined": 1,
+        "returned": 1,
+    }
+
+
+def test_slow_queries_are_logged_without_values(caplog) -> None:
+    listener = SlowQueryLog(threshold_ms=50)
+    command = {"find": "projects", "filter": {"user_id": "alice"}}
+    reply = {"cursor": {"firstBatch": [{}, {}], "id": 0}, "ok": 1}
+
+    with caplog.at_level(logging.WARNING, logger="core.slow_queries"):
+        run_command(listener, command, reply, millis=10)
+        run_command(listener, command, reply, millis=80)
+
+    assert listener.slow == 1
+    assert "Slow find on projects took 80.0 ms" in caplog.text
+    assert "returned 2" in caplog.text
+    assert '"user_id": "?"' in caplog.text
+    assert "alice" not in caplog.text
+
+
+def test_explain_is_rate_limited_per_shape() -> None:
+    listener = SlowQueryLog(threshold_ms=1, explain_interval=60)
+    explained = []
+
+    async def explain(query):
+        explained.append(query)
+
+    listener._explain = explain
+
+    async def scenario():
+        listener.start(client=None)
+        for user in ("alice", "bob"):
+            command = {"find": "projects", "filter": {"user_id": user}}
+            await asyncio.to_thread(
+                run_command, listener, command, {"ok": 1}, 5
+            )
+        command = {"find": "projects", "filter": {"name": "x"}}
+        await asyncio.to_thread(run_command, listener, command, {"ok": 1}, 5)
+        await asyncio.sleep(0.01)
+        await listener.stop()
+
+    asyncio.run(scenario())
+
+    assert [query.command["filter"] for query in explained] == [
+        {"user_id": "alice"},
+        {"name": "x"},
+    ]
@@ -0,0 +1,286 @@
+import asyncio
+import hashlib
+import io
+import os
+import re
+from typing import List, Optional
+from unittest.mock import AsyncMock
+
+import api.v1.routers.file as file_router
+import main
+import pytest
+from core.cache import user_cache
+from core.config import settings
+from core.storage import storage
+from core.upload import CATEGORY_MAX_SIZES, UploadSizeLimitMiddleware
+from fastapi import FastAPI, HTTPException, Request, UploadFile
+from fastapi.testclient import TestClient
+from schemas.file import FileCategory, FileMetadata
+from schemas.project import ProjectIn
+
+app = FastAPI()
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_size=10,
+    route_max_sizes={re.compile(r"/batch$"): 20},
+)
+
+
+@app.post("/echo")
+async def echo(request: Request):
+    return {"size": len(await request.body())}
+
+
+@app.post("/echo/batch")
+async def echo_batch(request: Request):
+    return {"size": len(await request.body())}
+
+
+client = TestClient(app)
+
+
+def test_upload_within_limit() -> None:
+    response = client.post("/echo", content=b"x" * 10)
+    assert response.status_code == 200
+    assert response.json()["size"] == 10
+
+
+def test_upload_content_length_over_limit() -> None:
+    response = client.post("/echo", content=b"x" * 11)
+    assert response.status_code == 413
+
+
+def test_upload_streamed_body_over_limit() -> None:
+    def body():
+        for _ in range(3):
+            yield b"x" * 5
+
+    response = client.post("/echo", content=body())
+    assert response.status_code == 413
+
+
+def test_upload_route_limit() -> None:
+    response = client.post("/echo/batch", content=b"x" * 20)
+    assert response.status_code == 200
+
+    response = client.post("/echo/batch", content=b"x" * 21)
+    assert response.status_code == 413
+
+
+class RecordingFile(io.BytesIO):
+    """Keeps the size of every read made from it"""
+
+    def __init__(self, data: bytes) -> None:
+        super().__init__(data)
+        self.reads: List[int] = []
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        self.reads.append(size)
+        return super().read(size)
+
+
+def file_metadata(user_id: str, project_id: Optional[str] = None):
+    return FileMetadata(
+        filename="figure.png",
+        user_id=user_id,
+        project_id=project_id,
+        category=FileCategory.PROJECT_FILE,
+    )
+
+
+def test_upload_is_read_in_chunks(db, make_user, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "UPLOAD_CHUNK_SIZE", 8)
+    user = make_user()
+    data = os.urandom(50)
+    source = RecordingFile(data)
+
+    file = asyncio.run(
+        storage.file_create_record(
+            UploadFile(source, filename="figure.png"), file_metadata(user.id)
+        )
+    )
+
+    assert -1 not in source.reads and None not in source.reads
+    assert max(source.reads) <= 8
+    assert file.size == 50
+    assert file.sha256 == hashlib.sha256(data).hexdigest()
+    assert asyncio.run(storage.file_get_data(file.id)) == data
+
+
+def test_upload_over_category_limit(db, make_user, monkeypatch) -> None:
+    monkeypatch.setitem(CATEGORY_MAX_SIZES, FileCategory.PROJECT_FILE, 10)
+    user = make_user()
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(
+            storage.file_create_record(
+                UploadFile(io.BytesIO(b"x" * 11), filename="figure.png"),
+                file_metadata(user.id),
+            )
+        )
+
+    assert raised.value.status_code == 413
+    assert db["blobs"].documents == []
+    assert user_cache.get(user.id) is None
+    assert db["files"].documents == []
+    assert not os.path.exists(storage.blob_store.directory)
+
+    file = asyncio.run(
+        storage.file_create_record(
+            UploadFile(io.BytesIO(b"x" * 10), filename="figure.png"),
+            file_metadata(user.id),
+        )
+    )
+    assert file.size == 10
+
+
+def test_upload_requires_an_image(db, make_user, login_as, monkeypatch):
+    monkeypatch.setattr(file_router, "create_variants", AsyncMock())
+    user = make_user()
+    login_as(user)
+    project_id = asyncio.run(
+        storage.project_create_record(ProjectIn(name="figures"), user.id)
+    )
+    api = TestClient(main.app)
+    url = f"/api/v1/projects/{project_id}/files"
+
+    response = api.post(url, files={"file": ("a.txt", b"text", "text/plain")})
+    assert response.status_code == 400
+
+    response = api.post(
+        url, files={"file": ("a.png", b"png", "image/png; charset=binary")}
+    )
+    assert response.status_code == 200
+    assert response.json()["size"] == 3
+    file_router.create_variants.assert_called_once()
+
+
+def upload_figure(user_id: str, data: bytes, project_id=None):
+    return asyncio.run(
+        storage.file_create_record(
+            UploadFile(io.BytesIO(data), filename="figure.png"),
+            file_metadata(user_id, project_id),
+        )
+    )
+
+
+def test_upload_over_quota(db, make_user, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "USER_STORAGE_QUOTA", 10)
+    user = make_user(bytes_used=6, file_count=1)
+    user_cache.set(user.id, user)
+
+    upload_figure(user.id, b"x" * 4)
+
+    assert user_cache.get(user.id) is None
+    user_doc = db["users"].documents[0]
+    assert (user_doc["bytes_used"], user_doc["file_count"]) == (10, 2)
+
+    with pytest.raises(HTTPException) as raised:
+        upload_figure(user.id, b"y")
+
+    assert raised.value.status_code == 413
+    assert (user_doc["bytes_used"], user_doc["file_count"]) == (10, 2)
+    assert len(db["files"].documents) == len(db["blobs"].documents) == 1
+
+
+@pytest.mark.parametrize(
+    "collection, method", [("files", "insert_one"), ("projects", "update_one")]
+)
+def test_reservation_is_rolled_back(
+    db, make_user, monkeypatch, collection, method
+) -> None:
+    user = make_user()
+    project_id = asyncio.run(
+        storage.project_create_record(ProjectIn(name="figures"), user.id)
+    )
+    monkeypatch.setattr(
+        db[collection], method, AsyncMock(side_effect=RuntimeError)
+    )
+    user_cache.set(user.id, user)
+
+    with pytest.raises(RuntimeError):
+        upload_figure(user.id, b"figure", project_id)
+
+    for document in (db["users"].documents[0], db["projects"].documents[0]):
+        assert document["bytes_used"] == 0
+        assert document["file_count"] == document["figure_count"] == 0
+    assert db["blobs"].documents == []
+    assert user_cache.get(user.id) is None
+
+
+def upload_batch(user_id: str, contents, project_id=None):
+    return asyncio.run(
+        storage.file_create_records(
+            [
+                UploadFile(io.BytesIO(data), filename=f"figure{i}.png")
+                for i, data in enumerate(contents)
+            ],
+            file_metadata(user_id, project_id),
+        )
+    )
+
+
+def counters(document):
+    return [document[key] for key in ("file_count", "bytes_used")]
+
+
+def test_batch_takes_in_what_fits_the_quota(db, make_user, monkeypatch):
+    monkeypatch.setattr(settings, "USER_STORAGE_QUOTA", 10)
+    user = make_user()
+    project_id = asyncio.run(
+        storage.project_create_record(ProjectIn(name="figures"), user.id)
+    )
+
+    results = upload_batch(user.id, [b"aaaa", b"bbbbbbb", b"cc"], project_id)
+
+    assert results[0].size == 4 and results[2].size == 2
+    assert results[1].status_code == 413
+    assert counters(db["users"].documents[0]) == [2, 6]
+    assert counters(db["projects"].documents[0]) == [2, 6]
+    assert len(db["files"].documents) == len(db["blobs"].documents) == 2
+
+
+def failing_reservation(calls: int):
+    """Fails the reservation after calls successful ones"""
+    reserve = storage.user_reserve_usage
+
+    async def user_reserve_usage(*args):
+        nonlocal calls
+        if calls == 0:
+            raise RuntimeError
+        calls -= 1
+        return await reserve(*args)
+
+    return user_reserve_usage
+
+
+@pytest.mark.parametrize("stage", ["reserve", "project", "insert"])
+def test_failed_batch_restores_the_counters(
+    db, make_user, monkeypatch, stage
+) -> None:
+    user = make_user(file_count=1, bytes_used=3)
+    project_id = asyncio.run(
+        storage.project_create_record(ProjectIn(name="figures"), user.id)
+    )
+    db["projects"].documents[0].update(file_count=1, bytes_used=3)
+    if stage == "reserve":
+        # the batch is over quota, and the second single reservation fails
+        monkeypatch.setattr(settings, "USER_STORAGE_QUOTA", 10)
+        monkeypatch.setattr(
+            storage, "user_reserve_usage", failing_reservation(2)
+        )
+    elif stage == "project":
+        monkeypatch.setattr(
+            db["projects"], "update_one", AsyncMock(side_effect=RuntimeError)
+        )
+    else:
+        monkeypatch.setattr(
+            db["files"], "insert_many", AsyncMock(side_effect=RuntimeError)
+        )
+
+    with pytest.raises(RuntimeError):
+        upload_batch(user.id, [b"aaaa", b"bbbb", b"cc"], project_id)
+
+    assert counters(db["users"].documents[0]) == [1, 3]
+    assert counters(db["projects"].documents[0]) == [1, 3]
+    assert db["files"].documents == [] and db["blobs"].documents == []